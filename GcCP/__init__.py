@@ -3,8 +3,14 @@
 from .image_canvas import ImgCanvas
 from .progress_label import Progress
 from .percent_label import Percent
+from .memory_label import Memory
 from .color import ColorUI
 from .overlay import OverlayUI
 from .threshold import ThresholdUI
 from .median_filter import MedianUI
 from .open_file import OpenUI
+from .classes import ClassUI
+from .file_stack import StackUI
+from .grains import GrainUI
+from .region_list import RegionUI
+from .trace_panel import TraceUI
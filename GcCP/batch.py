@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+# # Batch # #
+# Runs the pipeline over every image in a directory using a process pool
+# and writes the per-file percentages to a CSV file.
+
+# # Imports # #
+from typing import Optional, Sequence, List, Tuple
+import os
+import sys
+import csv
+from traceback import format_exc
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import resource
+except ImportError:
+    # Windows, peak memory is not reported
+    resource = None
+
+from . import pipeline
+from . import tiled
+from . import loader
+from .disk_cache import DiskCache
+from .color_space import parse_weights  # Parsed with parse_color for the command line
+
+
+def find_images(directory: str) -> List[str]:
+    """Sorted list of image files in directory"""
+    file_names = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.path.splitext(name)[1].lower() in loader.HANDLERS:
+            file_names.append(path)
+    return file_names
+
+
+def parse_color(text: str) -> Tuple[int, int, int]:
+    """Parse 'R,G,B' into a color tuple"""
+    values = [int(value) for value in text.split(',')]
+    if len(values) != 3 or any(value < 0 or value > 255 for value in values):
+        raise ValueError('color must be three integers between 0 and 255: ' + text)
+    return values[0], values[1], values[2]
+
+
+def peak_memory() -> int:
+    """Largest resident memory of this process so far in bytes, 0 if unknown"""
+    if resource is None:
+        return 0
+    # Linux reports kilobytes, macOS bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _process_file(args) -> Tuple[str, Optional[float], str, int]:
+    """Worker entry point, returns (filename, percent, error, worker peak memory)"""
+    filename, color, cutoff, size, tile, mask_dir, mode, weights, cache_dir, cache_bytes, verify = args
+    try:
+        if tile:
+            mask_path = None
+            if mask_dir is not None:
+                name = os.path.splitext(os.path.basename(filename))[0]
+                mask_path = os.path.join(mask_dir, name + '_mask.npy')
+            value = tiled.process_file(filename, color, cutoff, size, tile, mask_path, mode, weights)
+        else:
+            # Every worker opens the shared cache directory, entries are written atomically
+            disk = DiskCache(cache_dir, cache_bytes, verify=verify) if cache_dir and cache_bytes else None
+            value = pipeline.process_file(filename, color, cutoff, size, mode, weights, disk)
+        return filename, value, '', peak_memory()
+    except Exception as e:
+        return filename, None, str(e) or format_exc(), peak_memory()
+
+
+def run_batch(directory: str, color: Sequence[int], cutoff: float, size: Optional[int] = None,
+              output: Optional[str] = None, workers: Optional[int] = None,
+              tile: Optional[int] = None, mask_dir: Optional[str] = None,
+              mode: str = 'RGB', weights: Optional[Sequence[float]] = None,
+              cache_dir: Optional[str] = None, cache_bytes: int = 0, verify: bool = False,
+              verbose: bool = False) -> List[Tuple[str, Optional[float], str]]:
+    """Process every image in directory and write percents to a CSV file"""
+    file_names = find_images(directory)
+    if output is None:
+        output = os.path.join(directory, 'percent.csv')
+    if mask_dir is not None:
+        os.makedirs(mask_dir, exist_ok=True)
+
+    if verbose:
+        print('Batch:\t\t', len(file_names), 'files in', directory)
+        print('\t\t', 'Color:', list(color), 'Threshold:', cutoff, 'Median:', size or 'off', 'Mode:', mode)
+        if tile:
+            print('\t\t', 'Tiled:', tile, 'x', tile)
+        elif cache_dir and cache_bytes:
+            print('\t\t', 'Disk Cache:', cache_dir)
+
+    jobs = [(filename, tuple(color), cutoff, size, tile, mask_dir, mode, weights, cache_dir, cache_bytes,
+             verify) for filename in file_names]
+    results = []
+    peak = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map keeps input order so the CSV is sorted by file name
+        for filename, value, error, memory in executor.map(_process_file, jobs):
+            peak = max(peak, memory)
+            if verbose:
+                # Worker peak so far, the largest image a worker has held bounds what fits
+                memory = '({:.0f} MB peak)'.format(memory / 2 ** 20) if memory else ''
+                if error:
+                    print('\t\t', os.path.basename(filename), 'failed:', error, memory)
+                else:
+                    print('\t\t', os.path.basename(filename), round(value, 2), '%', memory)
+            results.append((filename, value, error))
+
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'red', 'green', 'blue', 'threshold', 'median', 'mode', 'percent', 'error'])
+        for filename, value, error in results:
+            writer.writerow([os.path.basename(filename), color[0], color[1], color[2], cutoff,
+                             size or 0, mode, '' if value is None else value, error])
+
+    if verbose:
+        print('\t\t', 'Wrote', output)
+        if peak:
+            print('Memory:\t\t', 'Largest worker peak {:.0f} MB'.format(peak / 2 ** 20))
+
+    return results
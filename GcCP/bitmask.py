@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+# # Bit Mask # #
+# Bool masks packed 8 pixels to a byte, one np.packbits row per image row
+# (big bit order, rows padded to whole bytes). A mask takes 1/8 of the memory
+# of a bool array. Area is a popcount of the bytes and masks are combined
+# with bytewise AND / OR / XOR without unpacking. Masks are built from an
+# image in row chunks so the bool mask never exists whole, and only the rows
+# and columns that are drawn are unpacked for display.
+
+# # Imports # #
+from typing import Optional, Tuple
+import numpy as np
+
+CHUNK_ROWS = 512  # Rows compared and packed at a time
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT = np.array([bin(n).count('1') for n in range(256)], dtype=np.uint8)
+
+    def _popcount(bits: np.array) -> np.array:
+        return _POPCOUNT[bits]
+
+
+class PackedMask:
+    """Height x Width bool mask stored as np.packbits rows"""
+    bits: np.array  # Height x ceil(Width / 8) uint8, padding bits are 0
+    shape: Tuple[int, int]  # Height, Width in pixels
+
+    def __init__(self, bits: np.array, shape: Tuple[int, int]):
+        self.bits = bits
+        self.shape = (int(shape[0]), int(shape[1]))
+
+    @classmethod
+    def pack(cls, mask: np.array) -> 'PackedMask':
+        """Packed copy of a 2D bool mask"""
+        return cls(np.packbits(mask, axis=1), mask.shape)
+
+    @classmethod
+    def at_least(cls, img: np.array, level: int) -> 'PackedMask':
+        """Mask of img >= level for a 2D uint8 image"""
+        height, width = img.shape
+        bits = np.empty((height, (width + 7) // 8), dtype=np.uint8)
+        chunk = np.empty((min(CHUNK_ROWS, height), width), dtype=bool)
+        for y0 in range(0, height, CHUNK_ROWS):
+            y1 = min(y0 + CHUNK_ROWS, height)
+            np.greater_equal(img[y0:y1], level, out=chunk[:y1 - y0])
+            bits[y0:y1] = np.packbits(chunk[:y1 - y0], axis=1)
+        return cls(bits, (height, width))
+
+    @property
+    def size(self) -> int:
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def count(self) -> int:
+        """Number of pixels set"""
+        return int(_popcount(self.bits).sum(dtype=np.int64))
+
+    def percent(self) -> float:
+        """Percent of pixels set"""
+        return self.count() / self.size * 100.0
+
+    def unpack(self, y0: int = 0, y1: Optional[int] = None, x0: int = 0, x1: Optional[int] = None) -> np.array:
+        """Bool array of the block [y0:y1, x0:x1], only its bytes are unpacked"""
+        y1 = self.shape[0] if y1 is None else y1
+        x1 = self.shape[1] if x1 is None else x1
+        first = x0 // 8
+        block = np.unpackbits(self.bits[y0:y1, first:(x1 + 7) // 8], axis=1)
+        return block[:, x0 - first * 8:x1 - first * 8].view(bool)
+
+    def get(self, rows: np.array, cols: np.array) -> np.array:
+        """0 / 1 uint8 values of the pixels at (rows, cols)"""
+        byte = self.bits.reshape(-1).take(rows * self.bits.shape[1] + (cols >> 3))
+        byte >>= (7 - (cols & 7)).astype(np.uint8)
+        byte &= 1
+        return byte
+
+    def put(self, positions: np.array, value: bool):
+        """Set or clear the pixels at flat positions (row * width + column) in place, like ndarray.put"""
+        rows, cols = np.divmod(positions.astype(np.intp), self.shape[1])
+        index = rows * self.bits.shape[1] + (cols >> 3)
+        bit = (np.uint8(0x80) >> (cols & 7).astype(np.uint8))
+        # Several pixels can share a byte, .at applies every one of them
+        flat = self.bits.reshape(-1)
+        if value:
+            np.bitwise_or.at(flat, index, bit)
+        else:
+            np.bitwise_and.at(flat, index, ~bit)
+
+    def _combine(self, other: 'PackedMask', op) -> 'PackedMask':
+        if self.shape != other.shape:
+            raise ValueError('mask shapes differ: {} and {}'.format(self.shape, other.shape))
+        return PackedMask(op(self.bits, other.bits), self.shape)
+
+    def __and__(self, other: 'PackedMask') -> 'PackedMask':
+        return self._combine(other, np.bitwise_and)
+
+    def __or__(self, other: 'PackedMask') -> 'PackedMask':
+        return self._combine(other, np.bitwise_or)
+
+    def __xor__(self, other: 'PackedMask') -> 'PackedMask':
+        return self._combine(other, np.bitwise_xor)
+
+    def __invert__(self) -> 'PackedMask':
+        bits = np.invert(self.bits)
+        # Padding bits past the last column stay 0 so counts are right
+        if self.shape[1] % 8:
+            bits[:, -1] &= np.uint8(0xFF << (8 - self.shape[1] % 8) & 0xFF)
+        return PackedMask(bits, self.shape)
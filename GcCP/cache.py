@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+# # Cache # #
+# Memory capped LRU cache for results computed from an image array.
+# Entries are keyed by the identity of the source array plus the stage
+# parameters, and die with the source array (weak reference), so a new
+# image can never be served an old image's result. Cached arrays are made
+# read-only, since every caller shares the same object. A cache can belong
+# to an ImageStore, which may evict its entries to keep the application
+# under a total memory budget.
+
+# # Imports # #
+from typing import Optional, Any, Hashable, List, Collection
+import threading
+import itertools
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_BYTES = 1 << 30  # 1 GB
+
+_clock = itertools.count()
+
+
+def tick() -> int:
+    """Next value of the use order shared by every cache, so the least recently used entry of all can be found"""
+    return next(_clock)
+
+
+def result_nbytes(value: Any) -> int:
+    """Memory used by a cached value (arrays or objects with an nbytes attribute)"""
+    return int(getattr(value, 'nbytes', 0))
+
+
+class ResultCache:
+    """Thread safe LRU cache of results computed from numpy arrays"""
+    verbose: bool
+    debug: bool
+
+    max_bytes: int  # Memory Cap
+    nbytes: int  # Memory currently held
+    store: Optional[Any]  # ImageStore enforcing the total budget
+
+    def __init__(self, max_bytes: int = DEFAULT_BYTES, verbose: bool = False, debug: bool = False,
+                 store: Optional[Any] = None):
+        self.verbose = verbose
+        self.debug = debug
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.store = store
+        self._entries = OrderedDict()  # (id(source), key) -> [weakref, value, nbytes, last use]
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, item) -> bool:
+        source, key = item
+        return self.get(source, key, touch=False) is not None
+
+    def get(self, source: np.array, key: Hashable, touch: bool = True) -> Optional[Any]:
+        """Cached result for source and key, None if missing"""
+        with self._lock:
+            entry = self._entries.get((id(source), key))
+            if entry is None:
+                return None
+            if entry[0]() is not source:
+                # id was reused by a new array after the old one was freed
+                self._remove((id(source), key))
+                return None
+            if touch:
+                self._entries.move_to_end((id(source), key))
+                entry[3] = tick()
+            return entry[1]
+
+    def put(self, source: np.array, key: Hashable, value: Any) -> Any:
+        """Store value and evict least recently used entries to stay under max_bytes"""
+        nbytes = result_nbytes(value)
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        with self._lock:
+            self._purge()
+            if (id(source), key) in self._entries:
+                self._remove((id(source), key))
+            if nbytes > self.max_bytes:
+                return value
+            self._entries[(id(source), key)] = [weakref.ref(source), value, nbytes, tick()]
+            self.nbytes += nbytes
+            self.evict(self.max_bytes)
+        # Outside the lock, the store locks other caches
+        if self.store is not None:
+            self.store.enforce()
+        return value
+
+    def evict(self, max_bytes: int):
+        """Drop least recently used entries until at most max_bytes are held"""
+        with self._lock:
+            while self.nbytes > max_bytes and self._entries:
+                item = next(iter(self._entries))
+                if self.debug:
+                    print('\t\t', 'Cache Evict:', item[1])
+                self._remove(item)
+
+    def values(self) -> List[Any]:
+        """Cached results, least recently used first"""
+        with self._lock:
+            return [entry[1] for entry in self._entries.values()]
+
+    def _first(self, keep: Collection[int]):
+        """Least recently used item whose value is not in keep (ids)"""
+        self._purge()
+        for item, entry in self._entries.items():
+            if id(entry[1]) not in keep:
+                return item
+        return None
+
+    def oldest(self, keep: Collection[int] = ()) -> Optional[int]:
+        """Last use of the least recently used entry not in keep, None if there is none"""
+        with self._lock:
+            item = self._first(keep)
+            return None if item is None else self._entries[item][3]
+
+    def evict_oldest(self, keep: Collection[int] = ()):
+        """Drop the least recently used entry not in keep (ids of values still in use elsewhere)"""
+        with self._lock:
+            item = self._first(keep)
+            if item is not None:
+                if self.debug:
+                    print('\t\t', 'Cache Evict:', item[1])
+                self._remove(item)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _remove(self, item):
+        entry = self._entries.pop(item)
+        self.nbytes -= entry[2]
+
+    def _purge(self):
+        """Remove entries whose source array no longer exists"""
+        for item in [item for item, entry in self._entries.items() if entry[0]() is None]:
+            self._remove(item)
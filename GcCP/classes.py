@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+# # Imports # #
+from typing import Optional, List, Sequence, Tuple
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+
+from . import classify
+from . import trace
+from .jobs import Job
+
+
+class ClassUI(tk.Frame):
+    """UI for classifying pixels by several reference colors at once"""
+    verbose: bool
+    debug: bool
+
+    colors: List[List[int]]  # Reference Colors
+    class_img: Optional[np.array]  # Class colors for display
+    counts: Optional[np.array]  # Pixels per class, last entry is unclassified
+
+    enable: tk.IntVar  # Classify Flag
+    check: ttk.Checkbutton  # Toggle Classification
+    add_button: ttk.Button  # Add current color as reference
+    clear_button: ttk.Button  # Remove all references
+    table: ttk.Treeview  # Reference colors and their percent
+
+    def __init__(self, master: Optional[tk.Frame] = None,
+                 verbose: bool = False, debug: bool = False):
+        super().__init__(master)
+        self.master = master
+
+        self.verbose = verbose
+        self.debug = debug
+
+        self.colors = []
+        self.class_img = None
+        self.counts = None
+
+        self.enable = tk.IntVar()
+        self.enable.set(0)
+        self.check = ttk.Checkbutton(
+            self,
+            text="Classify",
+            variable=self.enable,
+            onvalue=1,
+            offvalue=0,
+            command=self.callback
+        )
+        self.check.configure(state=tk.DISABLED)
+
+        self.add_button = ttk.Button(
+            self,
+            text='Add Color',
+            command=self.add
+        )
+        self.add_button.configure(state=tk.DISABLED)
+
+        self.clear_button = ttk.Button(
+            self,
+            text='Clear',
+            command=self.clear_colors
+        )
+        self.clear_button.configure(state=tk.DISABLED)
+
+        self.table = ttk.Treeview(
+            self,
+            columns=('color', 'percent'),
+            show='headings',
+            height=5
+        )
+        self.table.heading('color', text='Color')
+        self.table.heading('percent', text='Percent')
+        self.table.column('color', width=100)
+        self.table.column('percent', width=80)
+
+    def grid(self, column: int = 0, row: int = 0, columnspan: int = 1, rowspan: int = 1):
+        super().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan, sticky=tk.EW)
+        self.check.grid(column=0, row=0, padx=(18, 0))
+        self.add_button.grid(column=1, row=0, padx=(6, 0))
+        self.clear_button.grid(column=2, row=0, padx=(6, 0))
+        self.table.grid(column=0, row=1, columnspan=3, padx=(18, 6), pady=(4, 0))
+
+    def pack(self, side: str = tk.LEFT):
+        super().pack(side=side)
+        self.check.pack(side=tk.LEFT)
+        self.add_button.pack(side=tk.LEFT)
+        self.clear_button.pack(side=tk.LEFT)
+        self.table.pack(side=tk.LEFT)
+
+    def set(self, value: Optional[int] = 0, state: str = tk.DISABLED):
+        """Set value and state of widgets"""
+        if value is not None:
+            self.enable.set(value)
+        if state is not None:
+            self.check.config(state=state)
+            self.add_button.config(state=state)
+            self.clear_button.config(state=state)
+
+    def clear(self):
+        """Reset widgets to default state"""
+        self.set(0, tk.DISABLED)
+
+    def active(self) -> List[List[int]]:
+        """Reference colors if classification is on, empty otherwise"""
+        if self.enable.get() == 1:
+            return list(self.colors)
+        return []
+
+    def callback(self):
+        """Process image based on Enable flag"""
+        app = self.master
+
+        app.preview('distance')
+        app.refresh('distance')
+
+    def add(self):
+        """Register the current color as a reference"""
+        app = self.master
+
+        color = app.color.get()
+        if color not in self.colors:
+            self.colors.append(color)
+            if self.verbose or self.debug:
+                print('Classes:\t', len(self.colors), 'colors, added', color)
+        self.update_table()
+        if self.enable.get() == 1:
+            app.preview('distance')
+            app.refresh('distance')
+
+    def clear_colors(self):
+        """Remove all reference colors"""
+        app = self.master
+
+        self.colors = []
+        self.counts = None
+        self.update_table()
+        if self.enable.get() == 1:
+            app.refresh('distance')
+
+    def process(self, job: Job, img: np.array, colors: Sequence[Sequence[int]], cutoff: float,
+                mode: str = 'RGB', weights: Optional[Sequence[float]] = None) -> Tuple[np.array, np.array]:
+        """Label every pixel with its nearest color (runs on worker thread)"""
+        app = self.master
+
+        palette = app.thresh.get_palette(img, job)
+        converted = None if palette is not None else app.thresh.converted(img, mode, job)
+        with trace.span('classify', colors=len(colors), mode=mode, cutoff=cutoff) as span:
+            job.step('Classify')
+            label_img, counts = classify.classify(img, colors, cutoff, mode, weights, palette, converted,
+                                                  progress=job.progress)
+            job.step('Colors')
+            return span.result(classify.class_colors(colors, label_img)), counts
+
+    def update_table(self, counts: Optional[np.array] = None):
+        """Show reference colors with their percent, counts has one entry per color plus unclassified"""
+        if counts is not None:
+            self.counts = counts
+        self.table.delete(*self.table.get_children())
+        percents = None
+        if self.counts is not None and len(self.counts) == len(self.colors) + 1:
+            percents = classify.class_percents(self.counts)
+
+        for i, color in enumerate(self.colors):
+            hex_color = '#{:02x}{:02x}{:02x}'.format(*color)
+            self.table.tag_configure(hex_color, background=hex_color,
+                                     foreground='white' if sum(color) < 384 else 'black')
+            percent = '' if percents is None else str(round(percents[i], 2)) + ' %'
+            self.table.insert('', tk.END, values=(','.join(str(c) for c in color), percent), tags=(hex_color,))
+        if percents is not None:
+            self.table.insert('', tk.END, values=('Unclassified', str(round(percents[-1], 2)) + ' %'))
+        if self.verbose and percents is not None:
+            print('\t\t', 'Class Percents:', [round(p, 2) for p in percents])
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+# # Classify # #
+# Assigns every pixel to its nearest reference color, or to "unclassified"
+# when even the nearest one is below the threshold cutoff, and counts every
+# class with one bincount. Colors are embedded so that the distance of each
+# mode is a plain Euclidean distance (sqrt(w) scaled RGB, Lab, or hue on the
+# unit circle), which lets a k-d tree find the nearest reference once there
+# are many of them. With a palette index only the palette colors are
+# classified and the labels are gathered into the image.
+
+# # Imports # #
+from typing import Optional, Sequence, Callable, Tuple
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import pipeline
+from .palette import Palette
+from .color_space import SPACES, DEFAULT_WEIGHTS, LAB_MAX, convert
+from .distance import CHUNK_PIXELS
+
+TREE_CLASSES = 16  # Use a k-d tree for more references than this
+CHUNK = CHUNK_PIXELS >> 2  # Pixels per chunk, the brute force pass holds CHUNK x classes distances
+HUE_GRAY = 2.0  # Off circle coordinate of grays in Hue mode, further from every hue than the largest chord
+
+
+def embed(pixels: np.array, mode: str = 'RGB', weights: Optional[Sequence[float]] = None,
+          converted: Optional[np.array] = None) -> np.array:
+    """N x K float64 points whose Euclidean distance is the distance of mode.
+    pixels is N x 3 uint8, converted the same pixels already in the space of mode."""
+    if mode in SPACES:
+        if converted is None:
+            converted = convert(pixels[:, np.newaxis, :], mode)[:, 0]
+        if mode == 'Hue':
+            # Chord on the unit circle grows with the hue angle, grays (nan) sit above the circle
+            angle = np.radians(converted[:, 0].astype(np.float64))
+            hued = ~np.isnan(angle)
+            angle[~hued] = 0
+            return np.stack([np.cos(angle) * hued, np.sin(angle) * hued, HUE_GRAY * ~hued], axis=1)
+        return converted.astype(np.float64)
+    points = pixels[:, :3].astype(np.float64)
+    if mode == 'Weighted RGB':
+        points *= np.sqrt(np.asarray(weights or DEFAULT_WEIGHTS, dtype=np.float64))
+    return points
+
+
+def levels(dist: np.array, mode: str = 'RGB', weights: Optional[Sequence[float]] = None) -> np.array:
+    """uint8 distance level (255 is an exact match) of embedded distances, same scale as pipeline.distance"""
+    if mode == 'Hue':
+        dist = np.degrees(2 * np.arcsin(np.minimum(dist / 2, 1))) * (255.0 / 180.0)
+    elif mode == 'Lab':
+        dist = dist * (255.0 / LAB_MAX)
+    elif mode == 'Weighted RGB':
+        dist = dist / np.sqrt(sum(weights or DEFAULT_WEIGHTS))
+    else:
+        # Same float operations as the RGB lookup table
+        dist = dist / (3 ** 0.5)
+    return np.clip(255.0 - dist, 0, 255).astype(np.uint8)
+
+
+class Classifier:
+    """Nearest reference color lookup for one set of references in one mode"""
+    colors: np.array  # Reference colors (N x 3 uint8)
+    mode: str
+    weights: Optional[Sequence[float]]
+    points: np.array  # Embedded references
+    tree: Optional[cKDTree]  # Only for more than TREE_CLASSES references
+
+    def __init__(self, colors: Sequence[Sequence[int]], mode: str = 'RGB',
+                 weights: Optional[Sequence[float]] = None):
+        self.colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        self.mode = mode
+        self.weights = weights
+        self.points = embed(self.colors, mode, weights)
+        if mode == 'Hue':
+            # Gray references sit below the circle, so they don't match gray pixels either
+            self.points[:, 2] *= -1
+        self.tree = cKDTree(self.points) if len(self.colors) > TREE_CLASSES else None
+
+    def __len__(self) -> int:
+        return self.colors.shape[0]
+
+    @property
+    def dtype(self):
+        # Label len(self) is unclassified
+        return np.uint8 if len(self) < 255 else np.uint16
+
+    def nearest(self, points: np.array) -> Tuple[np.array, np.array]:
+        """Index of and embedded distance to the nearest reference for every point"""
+        if self.tree is not None:
+            dist, index = self.tree.query(points, k=1)
+            return index, dist
+        # Few references: |r|^2 - 2 p.r ranks them like the distance, first one wins ties
+        rank = points @ (-2 * self.points.T)
+        rank += (self.points ** 2).sum(axis=1)
+        index = rank.argmin(axis=1)
+        diff = points - self.points[index]
+        return index, np.sqrt((diff * diff).sum(axis=1))
+
+    def labels(self, pixels: np.array, level: int, converted: Optional[np.array] = None) -> np.array:
+        """Class of every pixel (N x 3 uint8), len(self) where the nearest reference is below level"""
+        index, dist = self.nearest(embed(pixels, self.mode, self.weights, converted))
+        return np.where(levels(dist, self.mode, self.weights) >= level, index, len(self)).astype(self.dtype)
+
+
+def classify(img: np.array, colors: Sequence[Sequence[int]], cutoff: float, mode: str = 'RGB',
+             weights: Optional[Sequence[float]] = None, palette: Optional[Palette] = None,
+             converted: Optional[np.array] = None,
+             progress: Optional[Callable[[float], None]] = None) -> Tuple[np.array, np.array]:
+    """Label image and per class pixel counts, the last class counts unclassified pixels"""
+    classifier = Classifier(colors, mode, weights)
+    level = pipeline.threshold_level(cutoff)
+
+    if palette is not None:
+        label_img = palette.gather(classifier.labels(palette.colors, level), progress=progress)
+    else:
+        height, width = img.shape[0], img.shape[1]
+        label_img = np.empty((height, width), dtype=classifier.dtype)
+        rows = max(1, min(height, CHUNK // max(width, 1)))
+        for y0 in range(0, height, rows):
+            y1 = min(y0 + rows, height)
+            pixels = img[y0:y1].reshape(-1, img.shape[2])
+            chunk = None if converted is None else converted[y0:y1].reshape(-1, converted.shape[2])
+            label_img[y0:y1] = classifier.labels(pixels, level, chunk).reshape(y1 - y0, width)
+            if progress is not None:
+                progress(y1 / height)
+
+    counts = np.bincount(label_img.ravel(), minlength=len(classifier) + 1)
+    return label_img, counts
+
+
+def class_percents(counts: np.array) -> np.array:
+    """Percent of pixels in each class"""
+    return counts / max(counts.sum(), 1) * 100.0
+
+
+def class_colors(colors: Sequence[Sequence[int]], label_img: np.array,
+                 unclassified: Sequence[int] = (0, 0, 0)) -> np.array:
+    """RGB image of the reference color of each pixel's class"""
+    lut = np.empty((len(colors) + 1, 3), dtype=np.uint8)
+    lut[:len(colors)] = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    lut[len(colors)] = unclassified
+    out = np.empty(label_img.shape + (3,), dtype=np.uint8)
+    rows = max(1, CHUNK // max(label_img.shape[1], 1))
+    for y0 in range(0, label_img.shape[0], rows):
+        np.take(lut, label_img[y0:y0 + rows], axis=0, out=out[y0:y0 + rows], mode='clip')
+    return out
@@ -48,7 +48,7 @@ class ColorUI(tk.Frame):
     debug: bool
     
     enable: bool
-    oval: List[int]  # should move to canvas...
+    oval: List[float]  # handle, x, y, radius in image coordinates. should move to canvas...
     value: np.array  # Array to store RGB value
     button: ttk.Button  # Button to start color picking
     rgb_frame: tk.Frame  # Frame to display RGB values
@@ -134,6 +134,10 @@ class ColorUI(tk.Frame):
         """Reset widgets to default state"""
         self.set(tk.DISABLED, tk.NORMAL)
 
+    def get(self) -> List[int]:
+        """RGB value currently in the entries, clipped to 0 - 255 since the entries accept any number"""
+        return [min(max(int(rgb.entry.get()), 0), 255) for rgb in self.rgb]
+
     def toggle(self):
         """Toggles Enable flag for enabling/disabling color selection on canvas"""
         app = self.master
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+# # Color Space # #
+# Distance modes besides plain RGB. Lab and Hue work on a float32 copy of the
+# image in that space, converted in chunks once per image so the caller can
+# cache it and pay only for the distance pass when the reference color or
+# mode changes. Every mode returns the same uint8 scale as rgb_distance:
+# 255 is an exact match and 0 is the largest possible distance. Grays have
+# no hue, in Hue mode they are level 0 whatever the reference, and a gray
+# reference matches nothing.
+
+# # Imports # #
+from typing import Optional, Sequence, Callable, Tuple
+import numpy as np
+
+from .distance import rgb_distance, CHUNK_PIXELS
+
+MODES = ('RGB', 'Weighted RGB', 'Lab', 'Hue')  # Distance modes, RGB is the default
+SPACES = ('Lab', 'Hue')  # Modes that need a converted image
+DEFAULT_WEIGHTS = (1.0, 1.0, 1.0)  # Weighted RGB channel weights
+
+# sRGB (D65) to CIE Lab constants
+SRGB_LINEAR = np.where(np.arange(256) / 255.0 <= 0.04045,
+                       np.arange(256) / 255.0 / 12.92,
+                       ((np.arange(256) / 255.0 + 0.055) / 1.055) ** 2.4).astype(np.float32)
+RGB_TO_XYZ = (np.array([[0.4124, 0.3576, 0.1805],
+                        [0.2126, 0.7152, 0.0722],
+                        [0.0193, 0.1192, 0.9505]])
+              / np.array([[0.95047], [1.0], [1.08883]])).astype(np.float32)  # white point folded in
+LAB_EPSILON = (6 / 29) ** 3
+LAB_MAX = 258.7  # Largest Lab distance between two sRGB colors (blue to green)
+
+
+def parse_weights(text: str) -> Tuple[float, float, float]:
+    """Parse 'R,G,B' channel weights"""
+    values = [float(value) for value in text.split(',')]
+    if len(values) != 3 or any(value < 0 for value in values) or sum(values) == 0:
+        raise ValueError('weights must be three non-negative numbers, not all 0: ' + text)
+    return values[0], values[1], values[2]
+
+
+def _rows(height: int, width: int, chunk_pixels: int) -> int:
+    return max(1, min(height, chunk_pixels // max(width, 1)))
+
+
+def _lab(rgb: np.array) -> np.array:
+    """N x 3 uint8 RGB to N x 3 float32 Lab"""
+    xyz = np.take(SRGB_LINEAR, rgb[:, :3]) @ RGB_TO_XYZ.T
+    f = np.where(xyz > LAB_EPSILON, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29).astype(np.float32)
+    lab = np.empty(f.shape, dtype=np.float32)
+    lab[:, 0] = 116 * f[:, 1] - 16
+    lab[:, 1] = 500 * (f[:, 0] - f[:, 1])
+    lab[:, 2] = 200 * (f[:, 1] - f[:, 2])
+    return lab
+
+
+def _hue(rgb: np.array) -> np.array:
+    """N x 3 uint8 RGB to N x 1 float32 HSV hue in degrees (nan for grays)"""
+    r = rgb[:, 0].astype(np.float32)
+    g = rgb[:, 1].astype(np.float32)
+    b = rgb[:, 2].astype(np.float32)
+    high = np.maximum(np.maximum(r, g), b)
+    delta = high - np.minimum(np.minimum(r, g), b)
+    gray = delta == 0
+    delta[gray] = 1
+
+    # Sector of the largest channel, red wins ties then green
+    is_red = high == r
+    is_green = ~is_red & (high == g)
+    hue = r - g
+    hue += 4 * delta
+    np.copyto(hue, b - r + 2 * delta, where=is_green)
+    np.copyto(hue, g - b, where=is_red)
+    hue /= delta
+    hue *= 60
+    hue[hue < 0] += 360
+    hue[gray] = np.nan
+    return hue[:, np.newaxis]
+
+
+CONVERSIONS = {'Lab': (_lab, 3), 'Hue': (_hue, 1)}  # Converter and number of channels
+
+
+def convert(img: np.array, space: str, chunk_pixels: int = CHUNK_PIXELS,
+            progress: Optional[Callable[[float], None]] = None) -> np.array:
+    """float32 copy of a uint8 RGB(A) image in space ('Lab' or 'Hue')"""
+    func, channels = CONVERSIONS[space]
+    height, width = img.shape[0], img.shape[1]
+    out = np.empty((height, width, channels), dtype=np.float32)
+    rows = _rows(height, width, chunk_pixels)
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        out[y0:y1] = func(img[y0:y1].reshape(-1, img.shape[2])).reshape(y1 - y0, width, channels)
+        if progress is not None:
+            progress(y1 / height)
+    return out
+
+
+def convert_color(color: Sequence[int], space: str) -> np.array:
+    """Reference color in space"""
+    return CONVERSIONS[space][0](np.array([color[:3]], dtype=np.uint8))[0]
+
+
+def _to_level(dist: np.array, scale: float, out: np.array):
+    """Write 255 - dist * scale as uint8, truncated like the RGB formula"""
+    dist *= scale
+    np.subtract(255.0, dist, out=dist)
+    np.clip(dist, 0, 255, out=dist)
+    np.copyto(out, dist, casting='unsafe')
+
+
+def converted_distance(converted: np.array, color: Sequence[int], space: str,
+                       out: Optional[np.array] = None, chunk_pixels: int = CHUNK_PIXELS,
+                       progress: Optional[Callable[[float], None]] = None) -> np.array:
+    """Distance image from an image already converted to space"""
+    height, width = converted.shape[0], converted.shape[1]
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+    ref = convert_color(color, space)
+
+    rows = _rows(height, width, chunk_pixels)
+    dist = np.empty((rows, width), dtype=np.float32)
+    tmp = np.empty((rows, width), dtype=np.float32)
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        n = y1 - y0
+        if space == 'Hue':
+            # Angle between hues, 180 degrees is the largest
+            np.subtract(converted[y0:y1, :, 0], ref[0], out=dist[:n])
+            np.abs(dist[:n], out=dist[:n])
+            np.subtract(360.0, dist[:n], out=tmp[:n])
+            np.minimum(dist[:n], tmp[:n], out=dist[:n])
+            # Grays (nan) are as far as the opposite hue
+            np.nan_to_num(dist[:n], copy=False, nan=180.0)
+            _to_level(dist[:n], 255.0 / 180.0, out[y0:y1])
+        else:
+            dist[:n] = 0
+            for c in range(3):
+                np.subtract(converted[y0:y1, :, c], ref[c], out=tmp[:n])
+                np.multiply(tmp[:n], tmp[:n], out=tmp[:n])
+                dist[:n] += tmp[:n]
+            np.sqrt(dist[:n], out=dist[:n])
+            _to_level(dist[:n], 255.0 / LAB_MAX, out[y0:y1])
+        if progress is not None:
+            progress(y1 / height)
+    return out
+
+
+def weighted_distance(img: np.array, color: Sequence[int], weights: Sequence[float] = DEFAULT_WEIGHTS,
+                      out: Optional[np.array] = None, chunk_pixels: int = CHUNK_PIXELS,
+                      progress: Optional[Callable[[float], None]] = None) -> np.array:
+    """RGB distance with per channel weights, sqrt(sum w (dc)^2 / sum w)"""
+    height, width = img.shape[0], img.shape[1]
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+
+    # Weighted squared difference for every value of each channel
+    values = np.arange(256, dtype=np.float32)
+    tables = [np.float32(w) * (values - np.float32(c)) ** 2 for c, w in zip(color[:3], weights)]
+    scale = 1.0 / np.sqrt(sum(weights))
+
+    rows = _rows(height, width, chunk_pixels)
+    dist = np.empty((rows, width), dtype=np.float32)
+    tmp = np.empty((rows, width), dtype=np.float32)
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        n = y1 - y0
+        np.take(tables[0], img[y0:y1, :, 0], out=dist[:n], mode='clip')
+        for c in (1, 2):
+            np.take(tables[c], img[y0:y1, :, c], out=tmp[:n], mode='clip')
+            dist[:n] += tmp[:n]
+        np.sqrt(dist[:n], out=dist[:n])
+        _to_level(dist[:n], scale, out[y0:y1])
+        if progress is not None:
+            progress(y1 / height)
+    return out
+
+
+def mode_distance(img: np.array, color: Sequence[int], mode: str = 'RGB',
+                  weights: Optional[Sequence[float]] = None, converted: Optional[np.array] = None,
+                  out: Optional[np.array] = None,
+                  progress: Optional[Callable[[float], None]] = None) -> np.array:
+    """Distance image of a uint8 image in any mode, converted is the cached conversion for Lab/Hue"""
+    if mode == 'RGB':
+        return rgb_distance(img, color, out=out, progress=progress)
+    if mode == 'Weighted RGB':
+        return weighted_distance(img, color, weights or DEFAULT_WEIGHTS, out=out, progress=progress)
+    if mode not in SPACES:
+        raise ValueError('unknown distance mode: ' + str(mode))
+    if converted is None:
+        converted = convert(img, mode)
+    return converted_distance(converted, color, mode, out=out, progress=progress)
@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+
+# # Components # #
+# Grain analysis of a threshold mask: every connected group of set pixels is
+# a grain. The mask is labeled tile by tile with scipy, so only one tile of
+# int32 labels exists at a time. Each tile's grains get provisional ids, and
+# their area, coordinate sums, color sums and bounding box are accumulated
+# with bincount and ufunc.at passes. Grains cut by a tile seam are joined by
+# comparing the last row / column of labels of the neighbouring tiles and
+# merging their ids in a union-find. The provisional statistics are then
+# summed per root. Memory is one tile plus a row of labels plus the
+# statistics, which are needed for the result anyway.
+
+# # Imports # #
+from typing import Optional, Callable, Tuple, List, Union
+import csv
+import numpy as np
+from scipy import ndimage
+
+from .bitmask import PackedMask
+
+TILE = 2048  # Default tile height and width
+CONNECTIVITY = 2  # 1: edge neighbors only, 2: diagonal neighbors too
+
+
+class UnionFind:
+    """Disjoint sets of ids 0..n-1, ids are added in blocks"""
+    parent: np.array  # parent[i] == i for roots
+    n: int  # ids in use
+
+    def __init__(self, capacity: int = 1024):
+        self.parent = np.arange(capacity, dtype=np.int64)
+        self.n = 0
+
+    def add(self, count: int) -> int:
+        """Add count new single element sets, returns the first new id"""
+        first = self.n
+        if first + count > len(self.parent):
+            capacity = max(first + count, 2 * len(self.parent))
+            self.parent = np.concatenate([self.parent[:first], np.arange(first, capacity, dtype=np.int64)])
+        self.n += count
+        return first
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            # Path halving keeps chains short without recursion
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a: np.array, b: np.array):
+        """Join the sets of every pair a[i], b[i], the smaller id becomes the root"""
+        if len(a) == 0:
+            return
+        pairs = np.unique(np.stack([a, b], axis=1), axis=0)
+        for x, y in pairs.tolist():
+            x, y = self.find(x), self.find(y)
+            if x < y:
+                self.parent[y] = x
+            elif y < x:
+                self.parent[x] = y
+
+    def roots(self) -> np.array:
+        """Root of every id, by pointer jumping over the whole array"""
+        roots = self.parent[:self.n].copy()
+        while True:
+            jumped = roots[roots]
+            if np.array_equal(jumped, roots):
+                return roots
+            roots = jumped
+
+
+class Grains:
+    """Statistics of every grain, grains are ordered by their first pixel in tile order"""
+    shape: Tuple[int, int]  # Height, Width of the mask
+    area: np.array  # Pixels per grain
+    bbox: np.array  # n x 4 y0, x0, y1, x1 with exclusive ends
+    centroid: np.array  # n x 2 y, x
+    mean: Optional[np.array]  # n x channels mean color, None without an image
+    std: Optional[np.array]  # n x channels color standard deviation
+
+    def __init__(self, shape: Tuple[int, int], area: np.array, bbox: np.array, centroid: np.array,
+                 mean: Optional[np.array] = None, std: Optional[np.array] = None):
+        self.shape = shape
+        self.area = area
+        self.bbox = bbox
+        self.centroid = centroid
+        self.mean = mean
+        self.std = std
+
+    def __len__(self) -> int:
+        return len(self.area)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(value.nbytes for value in (self.area, self.bbox, self.centroid, self.mean, self.std)
+                   if value is not None)
+
+    def percent(self) -> float:
+        """Percent of the mask covered by grains"""
+        return self.area.sum() / (self.shape[0] * self.shape[1]) * 100.0
+
+    def size_bins(self) -> np.array:
+        """Size class of every grain, floor(log2(area))"""
+        return np.floor(np.log2(self.area)).astype(np.intp)
+
+    def size_histogram(self) -> Tuple[np.array, np.array]:
+        """Grain counts by area in powers of two: counts[i] grains have edges[i] <= area < edges[i + 1]"""
+        counts = np.bincount(self.size_bins())
+        return counts, 2 ** np.arange(len(counts) + 1, dtype=np.int64)
+
+    def write_csv(self, filename: str):
+        """One row per grain"""
+        channels = 0 if self.mean is None else self.mean.shape[1]
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            header = ['grain', 'area', 'y0', 'x0', 'y1', 'x1', 'centroid_y', 'centroid_x']
+            for name in 'RGBA'[:channels]:
+                header += ['mean_' + name, 'std_' + name]
+            writer.writerow(header)
+            for i in range(len(self)):
+                row = [i + 1, int(self.area[i])] + self.bbox[i].tolist() + \
+                      [round(float(v), 2) for v in self.centroid[i]]
+                for c in range(channels):
+                    row += [round(float(self.mean[i, c]), 2), round(float(self.std[i, c]), 2)]
+                writer.writerow(row)
+
+
+def _tile_mask(mask: Union[np.array, PackedMask], y0: int, y1: int, x0: int, x1: int) -> np.array:
+    if isinstance(mask, PackedMask):
+        return mask.unpack(y0, y1, x0, x1)
+    return np.asarray(mask[y0:y1, x0:x1], dtype=bool)
+
+
+def _edge_ids(line: np.array, first: int) -> np.array:
+    """Provisional ids of a line of tile labels, -1 where empty"""
+    ids = line.astype(np.int64)
+    ids += first - 1
+    ids[line == 0] = -1
+    return ids
+
+
+def _seam_pairs(edge: np.array, other: np.array, connectivity: int) -> Tuple[np.array, np.array]:
+    """Ids of touching grains across a seam, edge and other are the label lines on both sides (-1 is empty)"""
+    firsts, seconds = [], []
+    shifts = (-1, 0, 1) if connectivity == 2 else (0,)
+    for shift in shifts:
+        # edge[i] touches other[i + shift]
+        lo, hi = max(0, -shift), min(len(edge), len(other) - shift)
+        if lo >= hi:
+            continue
+        a = edge[lo:hi]
+        b = other[lo + shift:hi + shift]
+        both = (a >= 0) & (b >= 0)
+        firsts.append(a[both])
+        seconds.append(b[both])
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def analyze(mask: Union[np.array, PackedMask], img: Optional[np.array] = None, tile: int = TILE,
+            connectivity: int = CONNECTIVITY, progress: Optional[Callable[[float], None]] = None) -> Grains:
+    """Grains of a bool or packed mask, with color statistics from img (same height and width) if given"""
+    height, width = mask.shape[:2]
+    structure = ndimage.generate_binary_structure(2, connectivity)
+    channels = 0 if img is None else (img.shape[2] if img.ndim == 3 else 1)
+    sets = UnionFind()
+    stats: List[List[np.array]] = [[] for _ in range(7 + 2 * channels)]
+
+    # Provisional ids along the bottom row of the previous tile row (-1 is empty)
+    above = np.full(width, -1, dtype=np.int64)
+    n_tiles = -(-height // tile) * -(-width // tile)
+    done = 0
+    for y0 in range(0, height, tile):
+        y1 = min(y0 + tile, height)
+        bottom = np.full(width, -1, dtype=np.int64)
+        left = None
+        for x0 in range(0, width, tile):
+            x1 = min(x0 + tile, width)
+            labels, count = ndimage.label(_tile_mask(mask, y0, y1, x0, x1), structure)
+            first = sets.add(count)
+
+            # Provisional id of every labeled pixel, flat takes are much faster than 2D indexing
+            flat = labels.reshape(-1)
+            set_pixels = np.flatnonzero(flat)
+            ids = flat.take(set_pixels).astype(np.int64)
+            ids -= 1
+            ys, xs = np.divmod(set_pixels, x1 - x0)
+            area = np.bincount(ids, minlength=count)
+            y_min = np.full(count, y1, dtype=np.int64)
+            x_min = np.full(count, x1, dtype=np.int64)
+            y_max = np.zeros(count, dtype=np.int64)
+            x_max = np.zeros(count, dtype=np.int64)
+            np.minimum.at(y_min, ids, ys)
+            np.minimum.at(x_min, ids, xs)
+            np.maximum.at(y_max, ids, ys)
+            np.maximum.at(x_max, ids, xs)
+            tile_stats = [area, y_min + y0, x_min + x0, y_max + (y0 + 1), x_max + (x0 + 1),
+                          np.bincount(ids, weights=ys, minlength=count) + y0 * area,
+                          np.bincount(ids, weights=xs, minlength=count) + x0 * area]
+            if img is not None:
+                pixels = img[y0:y1, x0:x1].reshape(-1, channels).take(set_pixels, axis=0).astype(np.float64)
+                for c in range(channels):
+                    tile_stats.append(np.bincount(ids, weights=pixels[:, c], minlength=count))
+                    tile_stats.append(np.bincount(ids, weights=pixels[:, c] ** 2, minlength=count))
+            for values, value in zip(stats, tile_stats):
+                values.append(value)
+
+            # Join grains cut by the seams above and to the left
+            # The line above includes one pixel past each end for diagonal neighbors in other tiles
+            a0, a1 = max(x0 - 1, 0), min(x1 + 1, width)
+            top = np.full(a1 - a0, -1, dtype=np.int64)
+            top[x0 - a0:x1 - a0] = _edge_ids(labels[0], first)
+            sets.union(*_seam_pairs(top, above[a0:a1], connectivity))
+            if left is not None:
+                sets.union(*_seam_pairs(_edge_ids(labels[:, 0], first), left, connectivity))
+            left = _edge_ids(labels[:, -1], first)
+            bottom[x0:x1] = _edge_ids(labels[-1], first)
+
+            done += 1
+            if progress is not None:
+                progress(done / n_tiles)
+        above = bottom
+
+    if sets.n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        colors = np.zeros((0, channels)) if img is not None else None
+        return Grains((height, width), empty, np.zeros((0, 4), dtype=np.int64), np.zeros((0, 2)), colors, colors)
+
+    # Sum provisional statistics per root, grains are numbered by their smallest provisional id
+    roots, grain = np.unique(sets.roots(), return_inverse=True)
+    n = len(roots)
+    columns = [np.concatenate(values) for values in stats]
+    area = np.bincount(grain, weights=columns[0], minlength=n).astype(np.int64)
+    bbox = np.empty((n, 4), dtype=np.int64)
+    bbox[:, :2] = np.iinfo(np.int64).max
+    bbox[:, 2:] = 0
+    for i, ufunc in enumerate((np.minimum, np.minimum, np.maximum, np.maximum)):
+        ufunc.at(bbox[:, i], grain, columns[1 + i])
+    centroid = np.stack([np.bincount(grain, weights=columns[5], minlength=n),
+                         np.bincount(grain, weights=columns[6], minlength=n)], axis=1) / area[:, np.newaxis]
+    mean = std = None
+    if img is not None:
+        sums = np.stack([np.bincount(grain, weights=columns[7 + 2 * c], minlength=n)
+                         for c in range(channels)], axis=1)
+        squares = np.stack([np.bincount(grain, weights=columns[8 + 2 * c], minlength=n)
+                            for c in range(channels)], axis=1)
+        mean = sums / area[:, np.newaxis]
+        std = np.sqrt(np.maximum(squares / area[:, np.newaxis] - mean ** 2, 0))
+    return Grains((height, width), area, bbox, centroid, mean, std)
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+# # Composite # #
+# Integer overlay compositing for display. Masks are applied with one table
+# lookup per channel: the table is indexed by mask weight * 256 + pixel value,
+# so dimming, tinting and the soft edges of downsampled masks all cost the same
+# gather. Median overlays are (a + b) >> 1. Everything is written with out=
+# into buffers the caller keeps, scratch space is one small chunk.
+
+# # Imports # #
+from typing import Optional, Sequence
+import numpy as np
+
+CHUNK_PIXELS = 1 << 16  # Pixels per chunk, bounds the scratch memory
+DIM = 0.25  # Default brightness of pixels outside the mask
+
+
+def mask_tables(dim: float = DIM, tint: Optional[Sequence[int]] = None) -> np.array:
+    """(3, 256 * 256) uint8 tables, entry [c, w * 256 + v] is channel c of value v under mask weight w"""
+    values = np.arange(256, dtype=np.float64)
+    # Truncation matches the old float path: (v * 0.25).astype(uint8)
+    outside = np.floor(values * dim)
+    inside = np.empty((3, 256))
+    for c in range(3):
+        inside[c] = values if tint is None else (values.astype(np.int64) + int(tint[c])) >> 1
+
+    weight = np.arange(256, dtype=np.float64)[:, np.newaxis] / 255.0
+    tables = np.empty((3, 256 * 256), dtype=np.uint8)
+    for c in range(3):
+        # Weights between 0 and 255 come from the soft edges of downsampled masks
+        tables[c] = np.rint(weight * inside[c] + (1.0 - weight) * outside).reshape(-1)
+    return tables
+
+
+class Compositor:
+    """Applies masks and median overlays to RGB images without full size temporaries"""
+    dim: float  # Brightness of pixels outside the mask
+    tint: Optional[Sequence[int]]  # Color blended 50/50 into pixels inside the mask
+    tables: np.array  # Lookup tables from mask_tables
+    chunk_pixels: int
+
+    def __init__(self, dim: float = DIM, tint: Optional[Sequence[int]] = None,
+                 chunk_pixels: int = CHUNK_PIXELS):
+        self.chunk_pixels = chunk_pixels
+        self._index = np.empty(chunk_pixels, dtype=np.uint16)
+        self.set_style(dim, tint)
+
+    def set_style(self, dim: float = DIM, tint: Optional[Sequence[int]] = None):
+        """Change dim factor and tint, only the tables are rebuilt"""
+        self.dim = dim
+        self.tint = None if tint is None else tuple(int(c) for c in tint)
+        self.tables = mask_tables(dim, self.tint)
+
+    def mask(self, img: np.array, mask: np.array, out: Optional[np.array] = None) -> np.array:
+        """Dim img outside mask (bool, or uint8 weight 0-255) and tint inside it"""
+        if out is None:
+            out = np.empty(img.shape[:2] + (3,), dtype=np.uint8)
+        flat_img = img.reshape(-1, img.shape[-1])
+        flat_mask = mask.reshape(-1)
+        flat_out = out.reshape(-1, 3)
+        # bool masks are scaled to the 0/255 weights
+        weight = np.uint16(255 * 256 if mask.dtype == bool else 256)
+        flat_mask = flat_mask.view(np.uint8)
+
+        for i0 in range(0, flat_mask.size, self.chunk_pixels):
+            i1 = min(i0 + self.chunk_pixels, flat_mask.size)
+            index = self._index[:i1 - i0]
+            for c in range(3):
+                np.multiply(flat_mask[i0:i1], weight, out=index, dtype=np.uint16)
+                index += flat_img[i0:i1, c]
+                np.take(self.tables[c], index, out=flat_out[i0:i1, c], mode='clip')
+        return out
+
+    def blend(self, img: np.array, other: np.array, out: Optional[np.array] = None) -> np.array:
+        """(img + other) >> 1 per channel, same as the old (img / 2.0 + other / 2.0).astype(uint8)"""
+        if out is None:
+            out = np.empty(img.shape[:2] + (3,), dtype=np.uint8)
+        flat_img = img.reshape(-1, img.shape[-1])
+        flat_other = other.reshape(-1, other.shape[-1])
+        flat_out = out.reshape(-1, 3)
+
+        for i0 in range(0, flat_img.shape[0], self.chunk_pixels):
+            i1 = min(i0 + self.chunk_pixels, flat_img.shape[0])
+            acc = self._index[:i1 - i0]
+            for c in range(3):
+                np.add(flat_img[i0:i1, c], flat_other[i0:i1, c], out=acc, dtype=np.uint16)
+                acc >>= 1
+                flat_out[i0:i1, c] = acc
+        return out
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+
+# # Disk Cache # #
+# Intermediate results kept on disk between sessions. Every array with a
+# known origin has a content digest: an opened file gets the hash of its
+# bytes, and a result gets the hash of its source's digest plus the stage
+# parameters (median size, reference color, distance mode, ...). Results are
+# stored as .npy files named by that digest, so the same scan opened again
+# tomorrow, or by a batch run with overlapping parameters, finds them no
+# matter what the file is called. Files are loaded with mmap_mode='r', only
+# the pages that are used are read. A JSON sidecar records shape, dtype and
+# a checksum of the data; shape, dtype and file size are checked on every
+# load and the checksum too when verify is set. Files are written under a
+# temporary name and renamed, so a crash never leaves a partial entry. Use
+# is recorded in the file modification time and the least recently used
+# entries are deleted once the directory holds more than max_bytes.
+
+# # Imports # #
+from typing import Optional, Any, Hashable, Callable, Dict, List, Tuple
+import os
+import json
+import time
+import hashlib
+import threading
+import weakref
+import numpy as np
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gccp')
+DEFAULT_DISK_BYTES = 8 << 30  # 8 GB
+MIN_BYTES = 1 << 20  # Smaller results are computed again, cheaper than a file
+HASH_CHUNK = 1 << 24  # Bytes hashed at a time
+STALE_SECONDS = 3600  # Temporary files older than this are left over from a crash
+
+
+def file_digest(filename: str) -> str:
+    """Hash of the bytes of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def array_digest(arr: np.array) -> str:
+    """Hash of the data of an array, a chunk of rows at a time so memory-mapped arrays are not read whole"""
+    digest = hashlib.blake2b(digest_size=16)
+    flat = arr.reshape(arr.shape[0], -1) if arr.ndim else arr.reshape(1)
+    rows = max(1, HASH_CHUNK // max(flat[:1].nbytes, 1))
+    for y0 in range(0, len(flat), rows):
+        digest.update(np.ascontiguousarray(flat[y0:y0 + rows]).data)
+    return digest.hexdigest()
+
+
+def key_digest(digest: str, key: Hashable) -> str:
+    """Digest of the result of stage parameters key applied to the array with digest"""
+    text = digest + '\0' + json.dumps(key, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class DiskCache:
+    """Size capped LRU cache of arrays in .npy files, keyed by content digests"""
+    verbose: bool
+    debug: bool
+
+    directory: str  # Where entries are stored
+    max_bytes: int  # Disk cap, 0 disables the cache
+    verify: bool  # Check the checksum of every loaded entry
+    min_bytes: int  # Smaller results are not stored
+    hits: int  # Entries loaded
+    misses: int  # Entries looked up but not found or not valid
+    writes: int  # Entries stored
+
+    def __init__(self, directory: str = DEFAULT_DIR, max_bytes: int = DEFAULT_DISK_BYTES, verify: bool = False,
+                 min_bytes: int = MIN_BYTES, verbose: bool = False, debug: bool = False):
+        self.verbose = verbose
+        self.debug = debug
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.min_bytes = min_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._digests: Dict[int, Tuple[Any, str]] = {}  # id(array) -> (weakref, digest)
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def register(self, arr: np.array, digest: str) -> np.array:
+        """Remember the content digest of arr for as long as arr exists"""
+        with self._lock:
+            self._purge()
+            self._digests[id(arr)] = (weakref.ref(arr), digest)
+        return arr
+
+    def digest(self, arr: np.array) -> Optional[str]:
+        """Content digest of arr, None if its origin is unknown"""
+        with self._lock:
+            entry = self._digests.get(id(arr))
+            if entry is None or entry[0]() is not arr:
+                return None
+            return entry[1]
+
+    def load(self, filename: str, loader: Callable[[str], np.array]) -> np.array:
+        """Read an image file with loader, its results are then found by the file's content"""
+        img = loader(filename)
+        if not self.enabled:
+            return img
+        return self.register(img, file_digest(filename))
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name + '.npy')
+
+    def meta_path(self, name: str) -> str:
+        return os.path.join(self.directory, name + '.json')
+
+    def get(self, source: np.array, key: Hashable) -> Optional[np.array]:
+        """Read-only memory-mapped result of key for source, None if not stored"""
+        digest = self.digest(source) if self.enabled else None
+        if digest is None:
+            return None
+        name = key_digest(digest, key)
+        path = self.path(name)
+        try:
+            with open(self.meta_path(name)) as f:
+                meta = json.load(f)
+            arr = np.load(path, mmap_mode='r')
+            valid = (list(arr.shape) == meta['shape'] and arr.dtype.str == meta['dtype']
+                     and os.path.getsize(path) == arr.offset + arr.nbytes)
+            if valid and self.verify:
+                valid = array_digest(arr) == meta['checksum']
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError):
+            valid = False
+        if not valid:
+            if self.verbose or self.debug:
+                print('Disk Cache:\t', 'Invalid entry', name, key)
+            self.misses += 1
+            self._delete(name)
+            return None
+        # Modification time is the last use
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        if self.verbose or self.debug:
+            print('Disk Cache:\t', 'Loaded', key, arr.shape)
+        return self.register(arr, name)
+
+    def put(self, source: np.array, key: Hashable, value: np.array) -> np.array:
+        """Store the result value of key for source, returns value"""
+        digest = self.digest(source) if self.enabled else None
+        if digest is None:
+            return value
+        name = key_digest(digest, key)
+        self.register(value, name)
+        if value.nbytes < self.min_bytes or value.nbytes > self.max_bytes:
+            return value
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(name)
+        temp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        meta = dict(key=json.loads(json.dumps(key, default=str)), shape=list(value.shape), dtype=value.dtype.str,
+                    checksum=array_digest(value), time=time.time())
+        try:
+            # Sidecar first, a data file without one is never read
+            with open(temp, 'w') as f:
+                json.dump(meta, f)
+            os.replace(temp, self.meta_path(name))
+            with open(temp, 'wb') as f:
+                np.save(f, np.asarray(value), allow_pickle=False)
+            os.replace(temp, path)
+        except OSError as e:
+            if self.verbose or self.debug:
+                print('Disk Cache:\t', 'Unable to write', key, e)
+            self._delete(name)
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return value
+        self.writes += 1
+        if self.verbose or self.debug:
+            print('Disk Cache:\t', 'Stored', key, '{:.1f} MB'.format(value.nbytes / 2 ** 20))
+        self.evict(self.max_bytes)
+        return value
+
+    def cached(self, source: np.array, key: Hashable, compute: Callable[[], np.array]) -> np.array:
+        """Result of key for source from disk, or computed and stored"""
+        value = self.get(source, key)
+        if value is None:
+            value = self.put(source, key, compute())
+        return value
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """(last use, bytes, name) of every stored entry, least recently used first"""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        now = time.time()
+        stored = set(name[:-4] for name in names if name.endswith('.npy'))
+        for filename in names:
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if filename.endswith('.npy'):
+                entries.append((stat.st_mtime, stat.st_size, filename[:-4]))
+            elif now - stat.st_mtime > STALE_SECONDS and (
+                    filename.endswith('.tmp') or (filename.endswith('.json') and filename[:-5] not in stored)):
+                # Left over from a crash
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        entries.sort()
+        return entries
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes stored on disk"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes: int):
+        """Delete least recently used entries until at most max_bytes are stored"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= max_bytes:
+                break
+            if self._delete(name):
+                total -= size
+                if self.debug:
+                    print('\t\t', 'Disk Cache Evict:', name)
+
+    def clear(self):
+        """Delete every entry"""
+        self.evict(0)
+
+    def report(self) -> str:
+        return '{} loaded, {} computed, {} stored, {:.0f} / {:.0f} MB in {}'.format(
+            self.hits, self.misses, self.writes, self.nbytes / 2 ** 20, self.max_bytes / 2 ** 20, self.directory)
+
+    def _delete(self, name: str) -> bool:
+        """Remove the files of an entry, False if they are still in use (Windows keeps mapped files)"""
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        try:
+            os.remove(self.meta_path(name))
+        except OSError:
+            pass
+        return True
+
+    def _purge(self):
+        """Forget digests of arrays that no longer exist"""
+        for item in [item for item, entry in self._digests.items() if entry[0]() is None]:
+            del self._digests[item]
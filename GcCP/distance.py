@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+# # Distance # #
+# Integer lookup table kernel for the RGB distance image.
+# Gives bit-identical output to
+#     (255.0 - sqrt(dr^2 + dg^2 + db^2) / sqrt(3)).astype(np.uint8)
+# without any int64 or float64 full image temporaries.
+
+# # Imports # #
+from typing import Optional, Sequence, Tuple, Callable
+import numpy as np
+
+MAX_SQUARED = 3 * 255 * 255  # Largest possible squared RGB distance
+CHUNK_PIXELS = 1 << 18  # Pixels processed per chunk, keeps buffers small enough for cache
+
+# uint8 result for every possible squared distance, built with the original float formula
+SCALE_LUT = (255.0 - (np.arange(MAX_SQUARED + 1) ** 0.5) / (3 ** 0.5)).astype(np.uint8)
+
+
+def squared_tables(color: Sequence[int]) -> Tuple[np.array, np.array, np.array]:
+    """256 entry (value - color) ** 2 table for each channel, color is clipped to 0 - 255 so entries fit uint16"""
+    values = np.arange(256, dtype=np.int32)
+    return tuple(((values - min(max(int(c), 0), 255)) ** 2).astype(np.uint16) for c in color[:3])
+
+
+def rgb_distance(img: np.array, color: Sequence[int], out: Optional[np.array] = None,
+                 chunk_pixels: int = CHUNK_PIXELS,
+                 progress: Optional[Callable[[float], None]] = None) -> np.array:
+    """Scaled RGB distance of a uint8 image to color, 255 is an exact match"""
+    height, width = img.shape[0], img.shape[1]
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+
+    tables = squared_tables(color)
+
+    # Buffers are reused for every chunk
+    rows = max(1, min(height, chunk_pixels // max(width, 1)))
+    acc = np.empty((rows, width), dtype=np.uint32)
+    tmp = np.empty((rows, width), dtype=np.uint16)
+
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        n = y1 - y0
+        np.take(tables[0], img[y0:y1, :, 0], out=tmp[:n], mode='clip')
+        np.copyto(acc[:n], tmp[:n])
+        for c in (1, 2):
+            np.take(tables[c], img[y0:y1, :, c], out=tmp[:n], mode='clip')
+            np.add(acc[:n], tmp[:n], out=acc[:n])
+        np.take(SCALE_LUT, acc[:n], out=out[y0:y1], mode='clip')
+        if progress is not None:
+            progress(y1 / height)
+
+    return out
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+# # Imports # #
+from typing import Optional, Dict, Sequence
+import tkinter as tk
+from tkinter import ttk
+
+from . import pipeline
+from .stack import ImageStack
+from .jobs import Job, JobScheduler, Cancelled
+
+
+class StackUI(tk.Frame):
+    """UI for switching between opened files and measuring all of them"""
+    verbose: bool
+    debug: bool
+
+    percents: Dict[int, Optional[float]]  # Percent of every file for the last run (None if it failed)
+    jobs: JobScheduler  # Runs over the whole stack, separate from the pipeline jobs
+
+    prev_button: ttk.Button  # Previous File
+    file_box: ttk.Combobox  # File Selection
+    next_button: ttk.Button  # Next File
+    apply_button: ttk.Button  # Measure every file with current settings
+    status: ttk.Label  # Progress of stack run
+    table: ttk.Treeview  # Percent of every file
+
+    def __init__(self, master: Optional[tk.Frame] = None,
+                 verbose: bool = False, debug: bool = False):
+        super().__init__(master)
+        self.master = master
+
+        self.verbose = verbose
+        self.debug = debug
+
+        self.percents = {}
+
+        self.prev_button = ttk.Button(
+            self,
+            text='<',
+            width=2,
+            command=lambda: self.step(-1)
+        )
+        self.file_box = ttk.Combobox(
+            self,
+            values=(),
+            width=18
+        )
+        self.file_box.bind('<<ComboboxSelected>>', self.file_callback)
+        self.next_button = ttk.Button(
+            self,
+            text='>',
+            width=2,
+            command=lambda: self.step(1)
+        )
+        self.apply_button = ttk.Button(
+            self,
+            text='All Files',
+            command=self.apply_all
+        )
+        self.status = ttk.Label(
+            self,
+            text='',
+            width=12
+        )
+        self.table = ttk.Treeview(
+            self,
+            columns=('file', 'percent'),
+            show='headings',
+            height=5
+        )
+        self.table.heading('file', text='File')
+        self.table.heading('percent', text='Percent')
+        self.table.column('file', width=140)
+        self.table.column('percent', width=80)
+
+        self.jobs = JobScheduler(self, self.status, verbose=verbose, debug=debug)
+        self.set(tk.DISABLED)
+
+    def grid(self, column: int = 0, row: int = 0, columnspan: int = 1, rowspan: int = 1):
+        super().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan, sticky=tk.EW)
+        self.prev_button.grid(column=0, row=0, padx=(18, 0))
+        self.file_box.grid(column=1, row=0, padx=(4, 0))
+        self.next_button.grid(column=2, row=0, padx=(4, 0))
+        self.apply_button.grid(column=0, row=1, columnspan=2, padx=(18, 0), pady=(4, 0), sticky=tk.W)
+        self.status.grid(column=1, row=1, columnspan=2, pady=(4, 0), sticky=tk.E)
+        self.table.grid(column=0, row=2, columnspan=3, padx=(18, 6), pady=(4, 0))
+
+    def pack(self, side: str = tk.LEFT):
+        super().pack(side=side)
+        self.prev_button.pack(side=tk.LEFT)
+        self.file_box.pack(side=tk.LEFT)
+        self.next_button.pack(side=tk.LEFT)
+        self.apply_button.pack(side=tk.LEFT)
+        self.status.pack(side=tk.LEFT)
+        self.table.pack(side=tk.LEFT)
+
+    def set(self, state: str = tk.DISABLED):
+        """Set state of widgets"""
+        for widget in (self.prev_button, self.next_button, self.apply_button):
+            widget.config(state=state)
+        self.file_box.config(state='readonly' if state == tk.NORMAL else state)
+
+    def clear(self):
+        """Reset widgets to default state"""
+        self.jobs.cancel()
+        self.percents = {}
+        self.file_box.config(values=())
+        self.file_box.set('')
+        self.table.delete(*self.table.get_children())
+        self.set(tk.DISABLED)
+
+    def set_stack(self, stack: ImageStack):
+        """Show files of a newly opened stack"""
+        self.jobs.cancel()
+        self.percents = {}
+        self.file_box.config(values=[stack.name(index) for index in range(len(stack))])
+        self.set(tk.NORMAL if len(stack) > 1 else tk.DISABLED)
+        self.update_table()
+
+    def set_current(self, index: int):
+        self.file_box.current(index)
+
+    def step(self, offset: int):
+        """Show previous/next file"""
+        app = self.master
+
+        stack = app.open.stack
+        if stack is not None:
+            self.select((app.open.index + offset) % len(stack))
+
+    def file_callback(self, event=None):
+        self.select(self.file_box.current())
+
+    def select(self, index: int):
+        """Show file index of the stack, pipeline settings are kept"""
+        app = self.master
+
+        if index < 0 or index == app.open.index:
+            return
+        if not app.open.show(index):
+            self.set_current(app.open.index)
+
+    def apply_all(self):
+        """Measure every file of the stack with the current settings"""
+        app = self.master
+
+        stack = app.open.stack
+        if stack is None:
+            return
+        # The table holds one threshold percent per file, other settings would disagree with the GUI
+        if app.thresh.enable.get() != 1:
+            self.status.config(text='Threshold is off')
+            return
+        if app.classes.active():
+            self.status.config(text='Not with classes')
+            return
+        # Read widgets here, the worker thread must not touch Tk
+        params = dict(
+            size=int(app.median.var.get()) if app.median.enable.get() == 1 else 0,
+            color=app.color.get(),
+            mode=app.thresh.mode.get(),
+            weights=app.thresh.weights,
+            cutoff=round(app.thresh.var.get(), 2)
+        )
+        self.percents = {}
+        self.update_table()
+        self.jobs.submit(lambda job: self.process(job, stack, **params), on_done=self.update_table)
+
+    def process(self, job: Job, stack: ImageStack, size: int, color: Sequence[int], mode: str,
+                weights: Sequence[float], cutoff: float) -> Dict[int, Optional[float]]:
+        """Percent of every file in stack (runs on worker thread)"""
+        app = self.master
+
+        if self.verbose or self.debug:
+            print('Stack:\t\t', len(stack), 'files')
+        percents = {}
+        for index in range(len(stack)):
+            job.step('Loading')
+            try:
+                img = stack.get(index, job)
+                # Intermediates land in the same caches the pipeline uses, so switching to the file is fast
+                if size:
+                    job.step('Median')
+                    img = app.median.filtered(img, size, job)
+                dist_img, hist = app.thresh.make_distance_img(job, img, color, mode, weights)
+            except Cancelled:
+                raise
+            except Exception as e:
+                # A file that can't be read or measured doesn't stop the others
+                if self.verbose or self.debug:
+                    print('\t\t', stack.name(index), 'failed:', e)
+                percents[index] = None
+                continue
+            percents[index] = pipeline.histogram_percent(hist, cutoff)
+            if self.verbose or self.debug:
+                print('\t\t', stack.name(index), round(percents[index], 2), '%')
+        return percents
+
+    def update_table(self, percents: Optional[Dict[int, Optional[float]]] = None):
+        """Show percent of every file"""
+        app = self.master
+
+        if percents is not None:
+            self.percents = percents
+        self.table.delete(*self.table.get_children())
+        stack = app.open.stack
+        if stack is None:
+            return
+        for index in range(len(stack)):
+            percent = self.percents.get(index, '')
+            if percent is None:
+                percent = 'failed'
+            elif percent != '':
+                percent = str(round(percent, 2)) + ' %'
+            self.table.insert('', tk.END, values=(stack.name(index), percent))
+
+    def shutdown(self):
+        """Stop worker thread"""
+        self.jobs.shutdown()
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+# # Imports # #
+from typing import Optional
+import tkinter as tk
+from tkinter import ttk
+from tkinter import filedialog as fd
+import numpy as np
+
+from . import components
+from . import trace
+from .components import Grains
+from .bitmask import PackedMask
+from .jobs import Job, JobScheduler
+
+
+class GrainUI(tk.Frame):
+    """UI for counting and measuring the connected grains of the threshold mask"""
+    verbose: bool
+    debug: bool
+
+    grains: Optional[Grains]  # Result of the last analysis
+    jobs: JobScheduler  # Own worker, so the analysis doesn't cancel pipeline updates
+
+    analyze_button: ttk.Button  # Analyze current mask
+    save_button: ttk.Button  # Write grain table to CSV
+    status: ttk.Label  # Progress and grain count
+    table: ttk.Treeview  # Grain size distribution
+
+    def __init__(self, master: Optional[tk.Frame] = None,
+                 verbose: bool = False, debug: bool = False):
+        super().__init__(master)
+        self.master = master
+
+        self.verbose = verbose
+        self.debug = debug
+
+        self.grains = None
+
+        self.analyze_button = ttk.Button(
+            self,
+            text='Grains',
+            command=self.analyze
+        )
+        self.save_button = ttk.Button(
+            self,
+            text='Save CSV',
+            command=self.save
+        )
+        self.status = ttk.Label(
+            self,
+            text='',
+            width=16
+        )
+        self.table = ttk.Treeview(
+            self,
+            columns=('area', 'count', 'color'),
+            show='headings',
+            height=5
+        )
+        self.table.heading('area', text='Area (px)')
+        self.table.heading('count', text='Grains')
+        self.table.heading('color', text='Mean Color')
+        self.table.column('area', width=90)
+        self.table.column('count', width=60)
+        self.table.column('color', width=90)
+
+        self.jobs = JobScheduler(self, self.status, verbose=verbose, debug=debug)
+        self.set(tk.DISABLED)
+
+    def grid(self, column: int = 0, row: int = 0, columnspan: int = 1, rowspan: int = 1):
+        super().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan, sticky=tk.EW)
+        self.analyze_button.grid(column=0, row=0, padx=(18, 0))
+        self.save_button.grid(column=1, row=0, padx=(6, 0))
+        self.status.grid(column=2, row=0, padx=(6, 0))
+        self.table.grid(column=0, row=1, columnspan=3, padx=(18, 6), pady=(4, 0))
+
+    def pack(self, side: str = tk.LEFT):
+        super().pack(side=side)
+        self.analyze_button.pack(side=tk.LEFT)
+        self.save_button.pack(side=tk.LEFT)
+        self.status.pack(side=tk.LEFT)
+        self.table.pack(side=tk.LEFT)
+
+    def set(self, state: str = tk.DISABLED):
+        """Set state of widgets"""
+        self.analyze_button.config(state=state)
+        self.save_button.config(state=state if self.grains is not None else tk.DISABLED)
+
+    def clear(self):
+        """Reset widgets to default state"""
+        self.reset()
+        self.set(tk.DISABLED)
+
+    def reset(self):
+        """Forget the result, the mask it was measured on is gone"""
+        self.jobs.cancel()
+        self.grains = None
+        self.status.config(text='')
+        self.save_button.config(state=tk.DISABLED)
+        self.update_table()
+
+    def analyze(self):
+        """Measure the grains of the current threshold mask"""
+        app = self.master
+
+        if app.thresh.enable.get() != 1 or app.thresh.thresh_img.size == 0:
+            self.status.config(text='No threshold mask')
+            return
+        # Colors are measured on the original image, not the median filtered one.
+        # The slider edits the mask in place, the worker gets its own copy (1/8 of a byte per pixel)
+        mask = app.thresh.thresh_img
+        mask = PackedMask(mask.bits.copy(), mask.shape) if isinstance(mask, PackedMask) else mask.copy()
+        img = app.open.img if app.open.img.shape[:2] == mask.shape else None
+        self.grains = None
+        self.save_button.config(state=tk.DISABLED)
+        self.update_table()
+        self.jobs.submit(lambda job: self.process(job, mask, img), on_done=self.update_table)
+
+    def process(self, job: Job, mask, img: Optional[np.array]) -> Grains:
+        """Connected components of mask (runs on worker thread)"""
+        with trace.span('grains') as span:
+            job.step('Grains')
+            grains = components.analyze(mask, img, progress=job.progress)
+            span.set(grains=len(grains))
+            return span.result(grains)
+
+    def update_table(self, grains: Optional[Grains] = None):
+        """Show grain count and the number of grains per power of two area"""
+        if grains is not None:
+            self.grains = grains
+            self.save_button.config(state=tk.NORMAL)
+        self.table.delete(*self.table.get_children())
+        if self.grains is None:
+            return
+        grains = self.grains
+        self.status.config(text='{} grains'.format(len(grains)))
+        counts, edges = grains.size_histogram()
+        bins = grains.size_bins()
+        for i, count in enumerate(counts):
+            if count == 0:
+                continue
+            area = str(edges[i]) if edges[i + 1] - edges[i] == 1 else '{}-{}'.format(edges[i], edges[i + 1] - 1)
+            color = ''
+            if grains.mean is not None:
+                # Area weighted mean color of the grains in the bin
+                in_bin = bins == i
+                mean = grains.mean[in_bin].T @ grains.area[in_bin] / grains.area[in_bin].sum()
+                color = ','.join(str(int(round(c))) for c in mean[:3])
+            self.table.insert('', tk.END, values=(area, count, color))
+        if self.verbose or self.debug:
+            print('Grains:\t\t', len(grains), 'grains,', round(grains.percent(), 2), '% of the image')
+            if len(grains):
+                print('\t\t', 'Area: mean', round(float(grains.area.mean()), 1), 'median',
+                      float(np.median(grains.area)), 'largest', int(grains.area.max()))
+
+    def save(self):
+        """Write one row per grain to a CSV file"""
+        if self.grains is None:
+            return
+        filename = fd.asksaveasfilename(
+            title='Save grains',
+            defaultextension='.csv',
+            filetypes=(('CSV', '*.csv'), ('All files', '*.*'))
+        )
+        if filename:
+            self.grains.write_csv(filename)
+            if self.verbose or self.debug:
+                print('Grains:\t\t', 'Wrote', filename)
+
+    def shutdown(self):
+        """Stop worker thread"""
+        self.jobs.shutdown()
@@ -1,11 +1,21 @@
 #!/usr/bin/python3
 
 # # Imports # #
-from typing import Optional
+from typing import Optional, Tuple, Dict, List, Any
 import tkinter as tk
 import numpy as np
 from PIL import Image, ImageTk
-from scipy.ndimage import zoom
+
+from . import trace
+from .pyramid import Pyramid
+from .sampling import DiskSampler
+from .cache import ResultCache, DEFAULT_BYTES
+from .disk_cache import DiskCache
+
+VIEW_SIZE = 1000  # Largest canvas side in pixels
+MAX_ZOOM = 16.0  # Largest scale in screen pixels per image pixel
+ZOOM_STEP = 1.25  # Scale change per mouse wheel step
+TILE = 128  # Side of the canvas image tiles, only tiles that changed are sent to Tk
 
 
 class ImgCanvas(tk.Canvas):
@@ -13,13 +23,32 @@ class ImgCanvas(tk.Canvas):
     verbose: bool
     debug: bool
 
-    display_img: Optional[np.array]  # # probably not needed # #
-    scale_img: Optional[np.array]  # # probably not needed (maybe return from function?) # #
-    tk_img: Optional[ImageTk.PhotoImage]  # Current image in canvas
+    display_img: Optional[np.array]  # Image being shown, overlay is added when drawing
+    pyramid: Optional[Pyramid]  # Display levels of display_img
+    pyramids: ResultCache  # Pyramids by display image
+    disk: DiskCache  # Pyramid levels kept between sessions
+    buffers: Dict[str, np.array]  # Reused view and overlay arrays
+    sampler: Optional[DiskSampler]  # Selection statistics of the current image
+    tiles: List[Tuple[int, int, int, int, ImageTk.PhotoImage, int]]  # x0, y0, x1, y1, photo, canvas item
+    shown: Optional[np.array]  # Copy of the last drawn view, to find changed tiles
+    redraws: int  # Number of draw calls
+    tiles_pasted: int  # Number of tiles sent to Tk
+
+    # Viewport transform: canvas = (image - view) * scale
+    scale: float  # Screen pixels per image pixel
+    fit_scale: float  # Scale showing the whole image
+    view_x: float  # Image x at left edge of canvas
+    view_y: float  # Image y at top edge of canvas
+    view_width: int  # Canvas width in pixels
+    view_height: int  # Canvas height in pixels
+    image_shape: Optional[Tuple[int, int]]  # Height, Width of image the view was fit to
+    pan_start: Optional[Tuple[int, int, float, float]]  # Mouse x, y and view x, y at start of pan
 
     def __init__(self, master: Optional[tk.Frame] = None,
                  width: int = 400, height: int = 400,
-                 verbose: bool = False, debug: bool = False):
+                 verbose: bool = False, debug: bool = False,
+                 cache_bytes: int = DEFAULT_BYTES, store: Optional[Any] = None,
+                 disk: Optional[DiskCache] = None):
         # Initialize tk.Canvas
         super().__init__(master)
         self.master = master
@@ -31,14 +60,49 @@ class ImgCanvas(tk.Canvas):
         self.bind('<Button-1>', self.pressed)
         self.bind('<B1-Motion>', self.drag)
         self.bind('<ButtonRelease-1>', self.released)
+        self.bind('<Double-Button-1>', self.double_clicked)
+        # Pan with middle/right button as well, zoom with the mouse wheel
+        for button in (2, 3):
+            self.bind(f'<Button-{button}>', self.pan_pressed)
+            self.bind(f'<B{button}-Motion>', self.pan_drag)
+        self.bind('<MouseWheel>', self.wheel)
+        self.bind('<Button-4>', self.wheel)
+        self.bind('<Button-5>', self.wheel)
 
         # set default size
         self.configure(width=width, height=height)
         
         # save currently displayed image data
         self.display_img = None
-        self.scale_img = None
-        self.tk_img = None
+        self.pyramid = None
+        if store is not None:
+            self.pyramids = store.cache('pyramid', cache_bytes)
+        else:
+            self.pyramids = ResultCache(cache_bytes, verbose=verbose, debug=debug)
+        self.disk = disk if disk is not None else DiskCache(max_bytes=0)
+        self.buffers = {}
+        self.sampler = None
+        self.tiles = []
+        self.shown = None
+        self.redraws = 0
+        self.tiles_pasted = 0
+
+        self.scale = 1.0
+        self.fit_scale = 1.0
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.view_width = width
+        self.view_height = height
+        self.image_shape = None
+        self.pan_start = None
+
+    def to_image(self, x: float, y: float) -> Tuple[float, float]:
+        """Canvas coordinates to image coordinates"""
+        return self.view_x + x / self.scale, self.view_y + y / self.scale
+
+    def to_canvas(self, x: float, y: float) -> Tuple[float, float]:
+        """Image coordinates to canvas coordinates"""
+        return (x - self.view_x) * self.scale, (y - self.view_y) * self.scale
 
     def pressed(self, event):
         """Callback for Clicking on Image"""
@@ -49,14 +113,20 @@ class ImgCanvas(tk.Canvas):
 
         # Start Oval Selection
         if app.color.enable:
+            # Oval is kept in image coordinates so it follows pan and zoom
+            x, y = self.to_image(event.x, event.y)
             app.color.reset_oval()
             app.color.oval.append(self.create_oval(event.x, event.y, event.x, event.y))
-            app.color.oval.append(event.x)
-            app.color.oval.append(event.y)
+            app.color.oval.append(x)
+            app.color.oval.append(y)
             app.color.oval.append(0)  # initial radius
 
             if self.debug:
                 print('\t\t', 'Color Oval:', app.color.oval)
+        elif app.regions.drawing:
+            app.regions.press(*self.to_image(event.x, event.y))
+        else:
+            self.pan_pressed(event)
 
     def drag(self, event):
         """Callback for dragging on Image"""
@@ -64,16 +134,17 @@ class ImgCanvas(tk.Canvas):
 
         if app.color.enable:
             # Calculate radius from original position
-            app.color.oval[3] = round(((event.x - app.color.oval[1]) ** 2 + (event.y - app.color.oval[2]) ** 2) ** 0.5)
+            x, y = self.to_image(event.x, event.y)
+            app.color.oval[3] = ((x - app.color.oval[1]) ** 2 + (y - app.color.oval[2]) ** 2) ** 0.5
             if self.debug:
                 print('\t\t', 'Color Oval Radius:', app.color.oval[3])
 
             # Redraw color oval
-            self.coords(app.color.oval[0],                      # oval handle
-                        app.color.oval[1] - app.color.oval[3],  # x1
-                        app.color.oval[2] - app.color.oval[3],  # y1
-                        app.color.oval[1] + app.color.oval[3],  # x2
-                        app.color.oval[2] + app.color.oval[3])  # y2
+            self.draw_oval()
+        elif app.regions.drawing:
+            app.regions.drag(*self.to_image(event.x, event.y))
+        else:
+            self.pan_drag(event)
 
     def released(self, event):
         """Callback for finishing click/drag on Image"""
@@ -82,6 +153,7 @@ class ImgCanvas(tk.Canvas):
         if self.debug:
             print('\t\t', 'Button 1 released:', event)
 
+        self.pan_start = None
         if app.color.enable:
             # Reset Color Button
             app.color.enable = False
@@ -91,55 +163,43 @@ class ImgCanvas(tk.Canvas):
                 print('\t\t', 'Color Oval:', app.color.oval)
 
             self.get_color()
+        elif app.regions.drawing:
+            app.regions.release(*self.to_image(event.x, event.y))
+
+    def double_clicked(self, event):
+        """Callback for double click on Image, closes the polygon being drawn"""
+        app = self.master
+
+        if app.regions.drawing == 'Polygon':
+            app.regions.finish()
 
     def get_color(self):
         """Get average color inside selected oval"""
         app = self.master
 
         if type(app.img) is np.ndarray and app.img.size > 1:
-            # calculate selection on original image size
-            x = int(float(app.color.oval[1]) / app.scale_factor)
-            y = int(float(app.color.oval[2]) / app.scale_factor)
-            r = int(float(app.color.oval[3]) / app.scale_factor)
-
-            # make mask
-            y_grid, x_grid = np.ogrid[-r:r + 1, -r:r + 1]
-            mask = x_grid * x_grid + y_grid * y_grid <= r * r
-
-            y_min = y - r
-            y_max = y + r + 1
-            x_min = x - r
-            x_max = x + r + 1
-            
-            # clip mask to fit within image
-            if y_min < 0:
-                mask = mask[-y_min:,:]
-                y_min = 0;
-            if y_max > app.img.shape[0]:
-                mask = mask[:app.img.shape[0]-y_max,:]
-                y_max = app.img.shape[0];
-            if x_min < 0:
-                mask = mask[:, -x_min:]
-                x_min = 0;
-            if x_max > app.img.shape[1]:
-                mask = mask[:, :app.img.shape[1]-x_max]
-                x_max = app.img.shape[1];
-            
+            # selection is stored in original image coordinates
+            x = int(app.color.oval[1])
+            y = int(app.color.oval[2])
+            r = int(app.color.oval[3])
+
+            # Disk mean from row prefix sums, O(r) once the rows have been sampled
+            if self.sampler is None or self.sampler.source is not app.img:
+                self.sampler = DiskSampler(app.img)
+            total, count = self.sampler.sum(x, y, r)
+            if count == 0:
+                return
+            color = list(total[:3] / count)
+
             if self.debug:
                 print('\t\t', 'Color Mask:', x, y, r)
-                print('\t\t', 'Color Mask:', mask)
-                print('\t\t', 'Color Mask:', mask.shape)
-                print('\t\t', 'Color Mask:', 'Mask Bounds:', [y_min, y_max, x_min, x_max])
                 print('\t\t', 'Color Mask:', 'Image Bounds:', app.img.shape)
-
-            # get average of color over mask
-            img_area = app.img[y_min:y_max, x_min:x_max, :]
-            color = [img_area[mask, 0].mean(),
-                     img_area[mask, 1].mean(),
-                     img_area[mask, 2].mean()]
-
             if self.verbose or self.debug:
                 print('Color Selector:\t', color)
+                stats = self.sampler.stats(x, y, r)
+                print('\t\t', 'Median:', list(stats['median'][:3]))
+                print('\t\t', 'Std:', [round(value, 2) for value in stats['std'][:3]])
+                print('\t\t', 'Pixels:', stats['count'])
 
             # maybe everything after this should be moved out of Canvas Class...
 
@@ -149,93 +209,210 @@ class ImgCanvas(tk.Canvas):
                 rgb.entry.insert(0, "{:.0f}".format(round(color[idx])))
 
             app.color.draw_rect(color)
-            app.thresh.make_distance_img()
+            app.preview('distance')
+            app.refresh('distance')
 
-            if app.thresh.enable.get() == 1:
-                app.thresh.process()
+    def pan_pressed(self, event):
+        """Start panning the view"""
+        self.pan_start = (event.x, event.y, self.view_x, self.view_y)
+
+    def pan_drag(self, event):
+        """Move the view with the mouse"""
+        if self.pan_start is None or self.pyramid is None:
+            return
+        x, y, view_x, view_y = self.pan_start
+        self.view_x = view_x - (event.x - x) / self.scale
+        self.view_y = view_y - (event.y - y) / self.scale
+        self.clamp_view()
+        self.draw()
+
+    def wheel(self, event):
+        """Zoom in or out around the mouse position"""
+        if self.pyramid is None:
+            return
+        if event.num == 4 or event.delta > 0:
+            scale = self.scale * ZOOM_STEP
+        else:
+            scale = self.scale / ZOOM_STEP
+        self.zoom(scale, event.x, event.y)
+
+    def zoom(self, scale: float, x: float = 0.0, y: float = 0.0):
+        """Set scale keeping the image point under canvas point (x, y) in place"""
+        scale = min(max(scale, self.fit_scale), max(MAX_ZOOM, self.fit_scale))
+        image_x, image_y = self.to_image(x, y)
+        self.scale = scale
+        self.view_x = image_x - x / scale
+        self.view_y = image_y - y / scale
+        self.clamp_view()
+        if self.verbose or self.debug:
+            print('\t\t', 'Zoom:', round(self.scale, 3))
+        self.draw()
+
+    def clamp_view(self):
+        """Keep the view inside the image"""
+        height, width = self.image_shape
+        self.view_x = min(max(self.view_x, 0.0), max(width - self.view_width / self.scale, 0.0))
+        self.view_y = min(max(self.view_y, 0.0), max(height - self.view_height / self.scale, 0.0))
+
+    def fit(self, shape: Tuple[int, ...], max_pixels: int = VIEW_SIZE):
+        """Size canvas and view to show the whole image"""
+        # TO DO: set max_pixels based on screen width/height https://www.geeksforgeeks.org/getting-screens-height-and-width-using-tkinter-python/
+        height, width = shape[0], shape[1]
+        self.image_shape = (height, width)
+        self.fit_scale = min(1.0, max_pixels / max(height, width))
+        self.scale = self.fit_scale
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.view_width = max(1, int(round(width * self.scale)))
+        self.view_height = max(1, int(round(height * self.scale)))
+        self.config(width=self.view_width, height=self.view_height)
+        self.make_tiles()
+
+    def make_tiles(self):
+        """Create the persistent photo images and canvas items covering the view"""
+        app = self.master
+
+        for tile in self.tiles:
+            self.delete(tile[5])
+        self.tiles = []
+        self.shown = None
+        for y0 in range(0, self.view_height, TILE):
+            for x0 in range(0, self.view_width, TILE):
+                x1 = min(x0 + TILE, self.view_width)
+                y1 = min(y0 + TILE, self.view_height)
+                photo = ImageTk.PhotoImage('RGB', (x1 - x0, y1 - y0), master=self)
+                item = self.create_image(x0, y0, anchor=tk.NW, image=photo)
+                self.tiles.append((x0, y0, x1, y1, photo, item))
+
+        # Keep selection circle above the image
+        if app.color.oval:
+            self.tag_raise(app.color.oval[0])
+        self.tag_raise('region')
+
+    def reset_view(self):
+        """Fit the view again on the next update_img"""
+        self.image_shape = None
 
     def clear(self):
         """Reset canvas to default state"""
         self.delete("all")
         self.configure(width=400, height=400)
-
-    def update_img(self, img_arr: Optional[np.array] = None):
-        """Draw Image in canvas"""
+        self.tiles = []
+        self.shown = None
+        self.display_img = None
+        self.pyramid = None
+        self.image_shape = None
+
+    def pyramid_for(self, img: np.array) -> Pyramid:
+        """Cached display pyramid of a full size image"""
+        pyramid = self.pyramids.get(img, 'pyramid')
+        if pyramid is None:
+            pyramid = self.pyramids.put(img, 'pyramid', self.stored_pyramid(img))
+        return pyramid
+
+    def stored_pyramid(self, img: np.array) -> Pyramid:
+        """Pyramid of img with its levels read from the disk cache, or built and stored there"""
+        pyramid = Pyramid(img)
+        if self.disk.digest(img) is None:
+            return pyramid
+        while True:
+            level = self.disk.get(img, ('pyramid', len(pyramid.levels)))
+            if level is None:
+                break
+            pyramid.levels.append(level)
+        if len(pyramid.levels) == 1:
+            # Build every level now so they can be stored, levels too small to store are built again next time
+            with trace.span('pyramid', log=False) as span:
+                span.result(pyramid.level(64))
+            for k in range(1, len(pyramid.levels)):
+                self.disk.put(img, ('pyramid', k), pyramid.levels[k])
+        return pyramid
+
+    def update_img(self, img_arr: Optional[np.array] = None, level: int = 0,
+                   full_shape: Optional[Tuple[int, ...]] = None):
+        """Draw Image in canvas, level > 0 marks a preview computed on that pyramid level of the image"""
         app = self.master
-        
-        # Clear Canvas
-        self.delete("all")
 
         if img_arr is None:
             self.clear()
             return
+        self.display_img = img_arr
+
+        # Pyramid is built once per displayed array
+        if level:
+            self.pyramid = self.pyramids.get(img_arr, ('pyramid', level))
+            if self.pyramid is None:
+                self.pyramid = self.pyramids.put(img_arr, ('pyramid', level),
+                                                 Pyramid(img_arr, level, full_shape or app.open.img.shape))
+        else:
+            self.pyramid = self.pyramid_for(img_arr)
+
+        if self.image_shape != self.pyramid.shape[:2]:
+            self.fit(self.pyramid.shape)
+        self.draw()
+
+    def update_pixels(self, img_arr: np.array, positions: np.array):
+        """Draw img_arr after the pixels at flat positions were changed in place, its pyramid is patched not rebuilt"""
+        pyramid = self.pyramids.get(img_arr, 'pyramid', touch=False)
+        if pyramid is not None:
+            pyramid.update(positions)
+        self.update_img(img_arr)
+
+    def buffer(self, name: str, shape: Tuple[int, ...]) -> np.array:
+        """Reusable uint8 array for a view, so redraws do not allocate"""
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self.buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def draw(self):
+        """Render the visible part of the pyramid into the canvas"""
+        app = self.master
 
-        # Apply overlay (should really move this outside of ImgCanvas)
-        # maybe add update_img function to main app that applies overlay and calls this function
-        # could return scaled image and scale factor...
+        if self.pyramid is None:
+            return
+        size = (self.view_height, self.view_width)
+        with trace.span('render', log=False, scale=round(self.scale, 4)) as span:
+            view = span.result(self.pyramid.render(self.view_x, self.view_y, self.scale,
+                                                   self.view_width, self.view_height,
+                                                   out=self.buffer('view', size + self.pyramid.levels[0].shape[2:])))
+
+        # Overlay is composited at screen resolution, so its cost does not depend on the image size
         if app.overlay.enable.get():
-            self.display_img = app.overlay.add_overlay(img_arr)
-        else:
-            self.display_img = img_arr
-        
-        # Scale image to fit on screen
-        self.scale_img, app.scale_factor = self.scale_image(self.display_img)
-        
-        # Add img to canvas
-        self.tk_img = ImageTk.PhotoImage(master=self, image=Image.fromarray(self.scale_img))
-        self.create_image(0, 0, anchor=tk.NW, image=self.tk_img)
-        self.config(width=self.scale_img.shape[1], height=self.scale_img.shape[0])
-        
-        # Redraw selection circle
-        # make app.color.oval an input parameter!
-        # or even it's own function (duh!)
-        if app.color.oval:
-            self.delete(app.color.oval[0])
-            app.color.oval[0] = self.create_oval(app.color.oval[1] - app.color.oval[3],
-                                                 app.color.oval[2] - app.color.oval[3],
-                                                 app.color.oval[1] + app.color.oval[3],
-                                                 app.color.oval[2] + app.color.oval[3])
-
-    def scale_image(self, img_arr: np.array, scale: Optional[float] = None, max_pixels: int = 1000):
-        """Scale img to fit on Screen"""
-        # Set scale_factor if not passed in
-        # TO DO: set max_pixels based on screen width/height https://www.geeksforgeeks.org/getting-screens-height-and-width-using-tkinter-python/
-        if scale is None:
-            max_dim = max(img_arr.shape[0], img_arr.shape[1])
-            if max_dim > max_pixels:
-                scale = max_pixels / max_dim
-            else:
-                scale = 1
-        
-        if scale != 1:
-            # Calculate final Height, Width, Depth
-            scale_height = int(round(float(img_arr.shape[0]) * scale))
-            scale_width = int(round(float(img_arr.shape[1]) * scale))
-            n = img_arr.ndim
-            
-            if self.verbose or self.debug:
-                print("\t\t", "Scaling Image:", str(scale))
-
-            if n > 2:
-                # initialize array
-                scale_img = np.zeros([scale_height, scale_width, img_arr.shape[2]])
-                # zoom r,g, and b separately
-                for rgb in range(img_arr.shape[2]):
-                    scale_img[:, :, rgb] = zoom(img_arr[:, :, rgb], scale)
-            else:
-                if img_arr.dtype == bool:
-                    scale_img = np.zeros(img_arr.shape)
-                    scale_img[img_arr] += 255.0
-                    scale_img = zoom(scale_img, scale, order=1)
-                else:
-                    scale_img = zoom(img_arr, scale)
-
-            # recast to uint8 for canvas
-            scale_img = scale_img.astype(np.uint8)
-            
-            if self.verbose or self.debug:
-                print("\t\t", str(scale_img.shape))
-        else:
-            scale_img = img_arr
-        
-        return scale_img, scale
+            original = self.pyramid_for(app.open.img)
+            if original is not self.pyramid:
+                original_view = original.render(self.view_x, self.view_y, self.scale,
+                                                self.view_width, self.view_height,
+                                                out=self.buffer('original', size + original.levels[0].shape[2:]))
+                view = app.overlay.add_overlay(view, original_view, out=self.buffer('overlay', size + (3,)))
+
+        # Send only the tiles that changed since the last draw to Tk
+        with trace.span('redraw', log=False) as span:
+            pasted = 0
+            redraw_all = self.shown is None or self.shown.shape != view.shape
+            if redraw_all:
+                self.shown = np.empty_like(view)
+            for x0, y0, x1, y1, photo, item in self.tiles:
+                tile = view[y0:y1, x0:x1]
+                if not redraw_all and np.array_equal(tile, self.shown[y0:y1, x0:x1]):
+                    continue
+                photo.paste(Image.fromarray(tile))
+                self.shown[y0:y1, x0:x1] = tile
+                pasted += 1
+            span.set(tiles=pasted, of=len(self.tiles))
+        self.redraws += 1
+        self.tiles_pasted += pasted
+
+        # Selection circle and region outlines are persistent canvas items, only moved
+        self.draw_oval()
+        app.regions.draw()
+
+    def draw_oval(self):
+        """Place selection oval at its image position"""
+        app = self.master
+
+        if not app.color.oval:
+            return
+        x1, y1 = self.to_canvas(app.color.oval[1] - app.color.oval[3], app.color.oval[2] - app.color.oval[3])
+        x2, y2 = self.to_canvas(app.color.oval[1] + app.color.oval[3], app.color.oval[2] + app.color.oval[3])
+        self.coords(app.color.oval[0], x1, y1, x2, y2)
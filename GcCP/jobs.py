@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+# # Jobs # #
+# Runs pipeline stages on a worker thread so the Tk main loop keeps running.
+# NumPy releases the GIL for the heavy work, results are delivered back on
+# the Tk thread by polling with after(). Cancellation is cooperative: engine
+# loops call job.progress() between chunks, which raises Cancelled once the
+# job is stale.
+
+# # Imports # #
+from typing import Optional, Callable, Any
+import threading
+import tkinter as tk
+from traceback import format_exc
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor, Future
+
+POLL_MS = 50  # How often the Tk thread checks for finished jobs
+
+
+class Cancelled(Exception):
+    """Raised inside a job once it has been cancelled"""
+    pass
+
+
+class Job:
+    """Handle passed to job functions for progress reporting and cancellation"""
+    name: str  # Name of current step, shown in progress label
+    fraction: float  # Progress of current step (0 to 1)
+
+    def __init__(self, name: str = 'Working'):
+        self.name = name
+        self.fraction = 0.0
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        """Raise Cancelled if job has been cancelled"""
+        if self._cancelled.is_set():
+            raise Cancelled()
+
+    def step(self, name: str):
+        """Start a new named step"""
+        self.check()
+        self.name = name
+        self.fraction = 0.0
+
+    def progress(self, fraction: float):
+        """Report progress of current step, also a cancellation point"""
+        self.check()
+        self.fraction = fraction
+
+    def status(self) -> str:
+        """Text for progress label"""
+        return '{} {:.0f}%'.format(self.name, 100.0 * self.fraction)
+
+
+def wait(future: Future, job: Optional[Job] = None) -> Any:
+    """Wait for a future from another pool while staying cancellable"""
+    if job is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=POLL_MS / 1000)
+        except futures.TimeoutError:
+            job.check()
+
+
+class JobScheduler:
+    """Runs one job at a time on a worker thread and calls back on the Tk thread"""
+    verbose: bool
+    debug: bool
+
+    widget: tk.Misc  # Any widget, used for after()
+    label: Optional[tk.Widget]  # Label showing progress of current job
+    executor: ThreadPoolExecutor
+    job: Optional[Job]  # Current job
+    future: Optional[Future]  # Current job result
+    on_done: Optional[Callable[[Any], None]]
+    on_error: Optional[Callable[[BaseException], None]]
+
+    def __init__(self, widget: tk.Misc, label: Optional[tk.Widget] = None,
+                 verbose: bool = False, debug: bool = False):
+        self.verbose = verbose
+        self.debug = debug
+
+        self.widget = widget
+        self.label = label
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline')
+        self.job = None
+        self.future = None
+        self.on_done = None
+        self.on_error = None
+        self._polling = False
+
+    @property
+    def busy(self) -> bool:
+        return self.job is not None
+
+    def submit(self, func: Callable[[Job], Any],
+               on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None) -> Job:
+        """Cancel the current job and run func(job) on the worker thread"""
+        self.cancel()
+        self.job = Job()
+        self.future = self.executor.submit(self._run, func, self.job)
+        self.on_done = on_done
+        self.on_error = on_error
+        self._set_label(self.job.status())
+        if not self._polling:
+            self._polling = True
+            self.widget.after(POLL_MS, self._poll)
+        return self.job
+
+    def cancel(self):
+        """Cancel the current job, its callbacks will not be called"""
+        if self.job is not None:
+            if self.debug:
+                print('\t\t', 'Job Cancelled:', self.job.name)
+            self.job.cancel()
+            self.future.cancel()
+            self._set_label('Done')
+        self.job = None
+        self.future = None
+        self.on_done = None
+        self.on_error = None
+
+    def shutdown(self):
+        """Cancel current job and stop the worker thread"""
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, func: Callable[[Job], Any], job: Job) -> Any:
+        job.check()
+        return func(job)
+
+    def _poll(self):
+        """Deliver finished job or update progress, runs on the Tk thread"""
+        if self.job is None:
+            self._polling = False
+            return
+
+        if not self.future.done():
+            self._set_label(self.job.status())
+            self.widget.after(POLL_MS, self._poll)
+            return
+
+        future, on_done, on_error = self.future, self.on_done, self.on_error
+        self.job = None
+        self.future = None
+        self.on_done = None
+        self.on_error = None
+        self._polling = False
+        self._set_label('Done')
+
+        try:
+            result = future.result()
+        except Cancelled:
+            return
+        except Exception as e:
+            if self.debug:
+                print(format_exc())
+            if self.verbose or self.debug:
+                print('\t\t', 'Job Failed:', e)
+            self._set_label('Failed')
+            if on_error is not None:
+                on_error(e)
+            return
+
+        if on_done is not None:
+            on_done(result)
+
+    def _set_label(self, text: str):
+        if self.label is not None:
+            self.label.config(text=text)
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+# # Level Index # #
+# Pixel positions of a uint8 distance image grouped by their 256 levels, a
+# counting sort done once per distance image. Moving the threshold from one
+# level to another only changes pixels whose level lies between the two, and
+# those are one contiguous run of the index. update() flips exactly those in
+# the mask, so scrubbing the slider costs in proportion to the pixels that
+# change instead of the image size.
+
+# # Imports # #
+from typing import Optional, Callable, Tuple, Union
+import numpy as np
+
+from .bitmask import PackedMask
+
+CHUNK_PIXELS = 1 << 20  # Pixels sorted at a time, bounds the int64 scratch of argsort
+
+
+class LevelIndex:
+    """Flat pixel positions of a uint8 image sorted by value"""
+    order: np.array  # Positions, level v pixels are order[starts[v]:starts[v + 1]]
+    starts: np.array  # 257 offsets into order
+    shape: Tuple[int, ...]  # Shape of the indexed image
+
+    def __init__(self, img: np.array, progress: Optional[Callable[[float], None]] = None):
+        flat = img.ravel()
+        self.shape = img.shape
+        counts = np.bincount(flat, minlength=256)
+        self.starts = np.zeros(257, dtype=np.int64)
+        np.cumsum(counts, out=self.starts[1:])
+        self.order = np.empty(flat.size, dtype=np.uint32 if flat.size <= 1 << 32 else np.int64)
+
+        # Each chunk is sorted on its own (radix sort for uint8) and its runs are
+        # appended to the run of their level, so positions stay in ascending order
+        fill = self.starts[:256].copy()
+        for p0 in range(0, flat.size, CHUNK_PIXELS):
+            p1 = min(p0 + CHUNK_PIXELS, flat.size)
+            chunk = flat[p0:p1]
+            local = np.argsort(chunk, kind='stable')
+            local += p0
+            bounds = np.zeros(257, dtype=np.int64)
+            np.cumsum(np.bincount(chunk, minlength=256), out=bounds[1:])
+            for level in np.flatnonzero(bounds[1:] > bounds[:-1]):
+                n = bounds[level + 1] - bounds[level]
+                self.order[fill[level]:fill[level] + n] = local[bounds[level]:bounds[level + 1]]
+                fill[level] += n
+            if progress is not None:
+                progress(p1 / flat.size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.order.nbytes + self.starts.nbytes
+
+    def count(self, lo: int, hi: int) -> int:
+        """Number of pixels with level in [lo, hi)"""
+        return int(self.starts[hi] - self.starts[lo])
+
+    def between(self, lo: int, hi: int) -> np.array:
+        """Flat positions of pixels with level in [lo, hi), a view of the index"""
+        return self.order[self.starts[lo]:self.starts[hi]]
+
+    def update(self, mask: Union[np.array, PackedMask], old_level: int, new_level: int) -> np.array:
+        """Turn bool or packed mask of img >= old_level into img >= new_level in place,
+        returns the flat positions flipped"""
+        if new_level == old_level:
+            return self.order[:0]
+        changed = self.between(min(old_level, new_level), max(old_level, new_level))
+        # Lowering the level adds pixels, raising it removes them
+        mask.put(changed, new_level < old_level)
+        return changed
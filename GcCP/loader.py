@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+
+# # Loader # #
+# Decodes image files straight into integer arrays: uint8 RGB(A), or uint16
+# when the source has 16 bit samples and the caller asks for them. Nothing is
+# decoded on open, only the header is read. JPEGs can be decoded at 1/2, 1/4
+# or 1/8 size in the DCT (draft mode), which is many times faster than a full
+# decode and gives exactly the shape of that pyramid level, so a preview can
+# be shown while the full image is still loading. Formats are handled by
+# classes registered per file extension.
+
+# # Imports # #
+from typing import Tuple, Dict, Type, Sequence
+from abc import ABC, abstractmethod
+import os
+import time
+import numpy as np
+from PIL import Image
+
+from . import trace
+
+CHUNK_ROWS = 256  # Rows copied out of a decoded PIL image at a time
+MAX_DRAFT_LEVEL = 3  # JPEG decoders scale by at most 1/8
+
+# Bytes per pixel PIL keeps in memory for a decoded image (RGB is padded to 4)
+PIL_PIXEL_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2}
+SIXTEEN_BIT_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I')
+
+
+class ImageFile(ABC):
+    """Lazily decoded image file, subclasses decode one format"""
+    reduces: bool = False  # Whether preview decodes less than the whole image
+    filename: str
+    shape: Tuple[int, ...]  # Shape of the full size uint8 array
+    seconds: float  # Time spent in the last decode
+    peak_bytes: int  # Estimate of the most decoded data held at once during the last decode, from array sizes
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.seconds = 0.0
+        self.peak_bytes = 0
+
+    @abstractmethod
+    def read(self, depth: int = 8) -> np.array:
+        """Full size image, depth 16 keeps 16 bit samples as uint16"""
+
+    def preview(self, max_size: int) -> Tuple[np.array, int]:
+        """Image and its pyramid level, as coarse as possible with the longer side still >= max_size"""
+        return self.read(), 0
+
+    def report(self) -> str:
+        return '{:.0f} ms, {:.1f} MB peak (estimated)'.format(self.seconds * 1000, self.peak_bytes / 2 ** 20)
+
+
+class NumpyFile(ImageFile):
+    """Array saved with np.save, uint8 or uint16, gray (2D or one channel), RGB or RGBA"""
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        try:
+            header = np.load(filename, mmap_mode='r')
+        except ValueError as e:
+            raise OSError('unable to read ' + filename + ': ' + str(e))
+        if header.dtype not in (np.uint8, np.uint16):
+            raise OSError('unsupported dtype {} in {}, expected uint8 or uint16'.format(header.dtype, filename))
+        if header.ndim == 2 or (header.ndim == 3 and header.shape[2] == 1):
+            self.shape = header.shape[:2] + (3,)
+        elif header.ndim == 3 and header.shape[2] in (3, 4):
+            self.shape = header.shape
+        else:
+            raise OSError('unsupported shape {} in {}, expected gray, RGB or RGBA'.format(header.shape, filename))
+
+    def read(self, depth: int = 8) -> np.array:
+        start = time.perf_counter()
+        try:
+            img = np.load(self.filename)
+        except ValueError as e:
+            raise OSError('unable to read ' + self.filename + ': ' + str(e))
+        self.peak_bytes = img.nbytes
+        # Same arrays as PILFile: uint16 only when asked for, gray becomes RGB
+        if img.dtype == np.uint16 and depth == 16:
+            self.seconds = time.perf_counter() - start
+            return img[:, :, 0] if img.ndim == 3 and img.shape[2] == 1 else img
+        if img.dtype == np.uint16:
+            img = (img >> 8).astype(np.uint8)
+            self.peak_bytes += img.nbytes
+        if img.shape != self.shape:
+            gray = img.reshape(img.shape[:2])
+            img = np.empty(self.shape, dtype=np.uint8)
+            img[...] = gray[:, :, np.newaxis]
+            self.peak_bytes += img.nbytes
+        self.seconds = time.perf_counter() - start
+        return img
+
+
+class PILFile(ImageFile):
+    """Any format PIL can decode"""
+    mode: str  # PIL mode of the file
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        # Only reads the header
+        with Image.open(filename) as im:
+            self.mode = im.mode
+            width, height = im.size
+            alpha = im.mode not in SIXTEEN_BIT_MODES and ('A' in im.mode or 'transparency' in im.info)
+        self.shape = (height, width, 4 if alpha else 3)
+
+    def read(self, depth: int = 8) -> np.array:
+        start = time.perf_counter()
+        with Image.open(self.filename) as im:
+            img = self._decode(im, depth)
+        self.seconds = time.perf_counter() - start
+        return img
+
+    def _decode(self, im: Image.Image, depth: int) -> np.array:
+        im.load()
+        decoded = im.size[0] * im.size[1] * PIL_PIXEL_BYTES.get(im.mode, 4)
+
+        if im.mode in SIXTEEN_BIT_MODES:
+            img = np.asarray(im)
+            if img.dtype != np.uint16:
+                img = np.clip(img, 0, 65535).astype(np.uint16)
+            self.peak_bytes = decoded + 2 * img.nbytes
+            if depth == 16:
+                return img
+            # Gray to RGB like every other 8 bit image
+            gray = (img >> 8).astype(np.uint8)
+            img = np.empty(gray.shape + (3,), dtype=np.uint8)
+            img[...] = gray[:, :, np.newaxis]
+            self.peak_bytes += gray.nbytes + img.nbytes
+            return img
+
+        if im.mode not in ('RGB', 'RGBA'):
+            converted = im.convert('RGBA' if 'A' in im.mode or 'transparency' in im.info else 'RGB')
+            decoded += converted.size[0] * converted.size[1] * 4
+            im = converted
+
+        # Copy strips so only the decoded image and the output are ever held in full,
+        # np.asarray(im) would add a whole image of bytes in between
+        width, height = im.size
+        img = np.empty((height, width, len(im.mode)), dtype=np.uint8)
+        for y0 in range(0, height, CHUNK_ROWS):
+            y1 = min(y0 + CHUNK_ROWS, height)
+            strip = im.crop((0, y0, width, y1))
+            img[y0:y1] = np.frombuffer(strip.tobytes(), dtype=np.uint8).reshape(y1 - y0, width, -1)
+        self.peak_bytes = decoded + img.nbytes
+        return img
+
+
+class JPEGFile(PILFile):
+    """JPEG, previews are decoded at reduced size"""
+    reduces = True
+
+    def preview(self, max_size: int) -> Tuple[np.array, int]:
+        start = time.perf_counter()
+        height, width = self.shape[0], self.shape[1]
+        ratio = min(1.0, max_size / max(width, height))
+        with Image.open(self.filename) as im:
+            im.draft('RGB', (int(np.ceil(width * ratio)), int(np.ceil(height * ratio))))
+            # DCT scaling rounds up like the pyramid's 2x2 boxes, so the size names the level
+            level = 0
+            for k in range(1, MAX_DRAFT_LEVEL + 1):
+                if im.size == (-(-width >> k), -(-height >> k)):
+                    level = k
+            img = self._decode(im, 8)
+        self.seconds = time.perf_counter() - start
+        return img, level
+
+
+HANDLERS: Dict[str, Type[ImageFile]] = {
+    '.jpg': JPEGFile,
+    '.jpeg': JPEGFile,
+    '.png': PILFile,
+    '.tif': PILFile,
+    '.tiff': PILFile,
+    '.bmp': PILFile,
+    '.npy': NumpyFile,
+}  # File extension to format handler
+
+
+def register(extensions: Sequence[str], handler: Type[ImageFile]):
+    """Decode files ending in extensions (e.g. '.webp') with handler"""
+    for extension in extensions:
+        HANDLERS[extension.lower()] = handler
+
+
+def open_image(filename: str) -> ImageFile:
+    """Handler for filename, raises OSError if it can not be read"""
+    extension = os.path.splitext(filename)[1].lower()
+    return HANDLERS.get(extension, PILFile)(filename)
+
+
+def load(filename: str, depth: int = 8, verbose: bool = False) -> np.array:
+    """Decode a whole image file"""
+    with trace.span('load', log=False, file=os.path.basename(filename)) as span:
+        image_file = open_image(filename)
+        img = span.result(image_file.read(depth))
+        span.set(est_peak_bytes=image_file.peak_bytes)
+    if verbose:
+        print('Load:\t\t', os.path.basename(filename), img.shape, img.dtype, image_file.report())
+    return img
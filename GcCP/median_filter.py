@@ -1,10 +1,19 @@
 #!/usr/bin/python3
 
 # # Imports # #
-from typing import Optional
+from typing import Optional, Dict, Tuple, Sequence, Any
 import tkinter as tk
 from tkinter import ttk
-from scipy.ndimage import median_filter
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from . import pipeline
+from . import trace
+from .cache import ResultCache, DEFAULT_BYTES
+from .disk_cache import DiskCache
+from .jobs import Job, wait
+
+PRECOMPUTE_SIZES = (3, 5, 7)  # Sizes filtered in the background after loading
 
 
 class MedianUI(tk.Frame):
@@ -19,8 +28,16 @@ class MedianUI(tk.Frame):
     var: tk.StringVar  # self.spinbox Value
     label: ttk.Label  # Median Neighbors Display
 
+    cache: ResultCache  # Filtered Images by (source image, size)
+    store: Optional[Any]  # ImageStore, precompute only runs while it has room
+    disk: DiskCache  # Filtered images kept between sessions
+    executor: ThreadPoolExecutor  # Idle Workers for precompute
+    pending: Dict[Tuple[int, int], Future]  # Precompute Jobs by (id(source image), size)
+
     def __init__(self, master: Optional[tk.Frame] = None,
-                 verbose: bool = False, debug: bool = False):
+                 verbose: bool = False, debug: bool = False,
+                 cache_bytes: int = DEFAULT_BYTES, workers: int = 1, store: Optional[Any] = None,
+                 disk: Optional[DiskCache] = None):
         # Initialize tk.Frame
         super().__init__(master)
         self.master = master
@@ -28,6 +45,15 @@ class MedianUI(tk.Frame):
         self.verbose = verbose
         self.debug = debug
 
+        self.store = store
+        self.disk = disk if disk is not None else DiskCache(max_bytes=0)
+        if store is not None:
+            self.cache = store.cache('median', cache_bytes)
+        else:
+            self.cache = ResultCache(cache_bytes, verbose=verbose, debug=debug)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='median')
+        self.pending = {}
+
         self.enable = tk.IntVar()
         self.enable.set(0)
         self.check = ttk.Checkbutton(
@@ -95,37 +121,62 @@ class MedianUI(tk.Frame):
 
     def callback(self):
         app = self.master
-        original_img = app.open.img
 
         if self.enable.get() == 1:
             self.label.config(state=tk.NORMAL)
             self.spinbox.config(state=tk.NORMAL)
-            self.process()
-            app.thresh.make_distance_img()
-            if app.thresh.enable.get() == 1:
-                app.thresh.process()
-            else:
-                app.thresh.dist_img = []
         else:
             self.label.config(state=tk.DISABLED)
             self.spinbox.config(state=tk.DISABLED)
-            app.img = original_img
-            app.thresh.make_distance_img()
-            if app.thresh.enable.get() == 1:
-                app.thresh.process()
-            else:
-                app.canvas.update_img(app.img)
-
-    def process(self):
-        app = self.master
-
-        M = int(self.var.get())
-        print('Median Filter:\t', M, 'x', M)
-
-        app.set_busy_state(True)
-
-        app.img = median_filter(app.open.img, size=(M, M, 1))
-
-        if not app.thresh.enable.get():
-            app.canvas.update_img(app.img)
-            app.set_busy_state(False)
+        app.preview('median')
+        app.refresh('median')
+
+    def process(self, job: Job, img: np.array, M: int) -> np.array:
+        """Median filter img (runs on worker thread)"""
+        with trace.span('median', size=M) as span:
+            job.step('Median')
+            return span.result(self.filtered(img, M, job))
+
+    def filtered(self, img: np.array, M: int, job: Optional[Job] = None) -> np.array:
+        """Median filtered img from cache, a running precompute job, or computed now"""
+        result = self.cache.get(img, M)
+        if result is not None:
+            if self.verbose or self.debug:
+                print('\t\t', 'Cached')
+            return result
+
+        future = self.pending.pop((id(img), M), None)
+        if future is not None and not future.cancelled():
+            if self.verbose or self.debug:
+                print('\t\t', 'Waiting for precompute')
+            return wait(future, job)
+
+        progress = job.progress if job is not None else None
+        return self.cache.put(img, M, self.disk.cached(img, ('median', M),
+                                                       lambda: pipeline.median(img, M, progress=progress)))
+
+    def precompute(self, img: np.array, sizes: Sequence[int] = PRECOMPUTE_SIZES):
+        """Speculatively filter img with common sizes on idle worker threads"""
+        self.cancel_pending()
+        for M in sizes:
+            if self.store is not None and self.store.headroom() < (len(self.pending) + 1) * img.nbytes:
+                # Speculative results would only push out ones that are in use
+                break
+            if self.cache.get(img, M, touch=False) is None:
+                self.pending[(id(img), M)] = self.executor.submit(self._precompute, img, M)
+
+    def _precompute(self, img: np.array, M: int) -> np.array:
+        with trace.span('precompute', log=False, size=M) as span:
+            return span.result(self.cache.put(img, M, self.disk.cached(img, ('median', M),
+                                                                       lambda: pipeline.median(img, M))))
+
+    def cancel_pending(self):
+        """Cancel precompute jobs that have not started"""
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+
+    def shutdown(self):
+        """Stop worker threads"""
+        self.cancel_pending()
+        self.executor.shutdown(wait=False, cancel_futures=True)
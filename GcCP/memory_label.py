@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+# # Imports # #
+from typing import Optional, List
+import tkinter as tk
+from tkinter import ttk
+
+from .store import ImageStore
+
+REPORT_MS = 1000  # How often the memory report is refreshed
+
+
+class Memory(tk.Frame):
+    """Labels to show memory used by images against the budget"""
+    store: ImageStore
+    label: List[ttk.Label]
+
+    def __init__(self, master: Optional[tk.Frame] = None, store: Optional[ImageStore] = None):
+        super().__init__(master)
+        self.master = master
+        self.store = store if store is not None else ImageStore()
+
+        self.label = []
+        self.label.append(ttk.Label(
+            self,
+            text="Memory:",
+            anchor=tk.E,
+            width=12
+        ))
+        self.label.append(ttk.Label(
+            self,
+            text="0 MB",
+            anchor=tk.W,
+            width=24
+        ))
+        self.refresh_report()
+
+    def grid(self, column: int = 0, row: int = 0, columnspan: int = 1, rowspan: int = 1):
+        super().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan)
+        self.label[0].grid(column=0, row=0)
+        self.label[1].grid(column=1, row=0)
+
+    def pack(self, side: str = tk.LEFT):
+        super().pack(side=side)
+        self.label[0].pack(side=tk.LEFT)
+        self.label[1].pack(side=tk.LEFT)
+
+    def refresh_report(self):
+        """Show current usage, runs every REPORT_MS"""
+        self.label[1].config(text=self.store.report()[0])
+        self.after(REPORT_MS, self.refresh_report)
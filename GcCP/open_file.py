@@ -1,15 +1,19 @@
 #!/usr/bin/python3
 
 # # Imports # #
-from typing import Optional
+from typing import Optional, Sequence
 import tkinter as tk
 from tkinter import ttk
 import numpy as np
 
 import os
+from functools import partial
 from traceback import format_exc
 from tkinter import filedialog as fd
-from matplotlib.image import imread
+
+from . import pipeline
+from .stack import ImageStack
+from .image_canvas import VIEW_SIZE
 
 
 class OpenUI(tk.Frame):
@@ -17,6 +21,8 @@ class OpenUI(tk.Frame):
     debug: bool
 
     img: Optional[np.array]  # Original Image
+    stack: Optional[ImageStack]  # Opened Files
+    index: int  # Current File in stack
     button: ttk.Button  # Open File Dialog
     label: ttk.Label  # Current File Name
 
@@ -42,6 +48,8 @@ class OpenUI(tk.Frame):
 
         # save original image
         self.img = []
+        self.stack = None
+        self.index = -1
 
     def grid(self, column: int = 0, row: int = 0, columnspan: int = 1, rowspan: int = 1):
         super().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan, sticky=tk.EW)
@@ -59,8 +67,11 @@ class OpenUI(tk.Frame):
         file_types = (
             ('All Image Types', '*.jpg'),
             ('All Image Types', '*.png'),
+            ('All Image Types', '*.tif'),
             ('JPEG', '*.jpg'),
             ('PNG', '*.png'),
+            ('TIFF', '*.tif'),
+            ('NumPy', '*.npy'),
             ('All files', '*.*')
         )
 
@@ -77,7 +88,7 @@ class OpenUI(tk.Frame):
             # Load image from file
             if self.verbose or self.debug:
                 print('\t\t', 'Loading File')
-            self.load_img(file_names[0])
+            self.open_files(file_names)
 
             if self.verbose or self.debug:
                 print('\t\t', 'Done!')
@@ -97,34 +108,94 @@ class OpenUI(tk.Frame):
                 app.thresh.clear()
                 app.color.clear()
                 app.overlay.clear()
+                app.classes.clear()
+                app.stack.clear()
+                app.grains.clear()
+                app.regions.clear()
+
+    def open_files(self, file_names: Sequence[str]):
+        """Open files as a stack, every file starts decoding in the background"""
+        app = self.master
 
-    def load_img(self, filename=''):
+        if not file_names:
+            # Dialog was cancelled
+            raise IndexError('no files selected')
+        # Files are hashed as they are read, so results stored on disk are found by content
+        loader = partial(app.disk.load, loader=partial(pipeline.load_image, verbose=self.verbose or self.debug))
+        stack = ImageStack(file_names, loader=loader,
+                           max_bytes=app.cache_bytes, store=app.store, verbose=self.verbose, debug=self.debug)
+        stack.prefetch()
+        if not self.load_img(0, stack):
+            stack.shutdown()
+
+    def show(self, index: int) -> bool:
+        """Switch to file index of the current stack"""
+        return self.load_img(index, self.stack)
+
+    def load_img(self, index: int = 0, stack: Optional[ImageStack] = None) -> bool:
+        """Show file index of stack, a new stack resets the pipeline settings"""
         app = self.master
 
-        print('\t\t', filename)
         try:
-            app.img = imread(filename)
-            if app.img.dtype == np.float64 or app.img.dtype == np.float32:
-                if self.verbose or self.debug:
-                    print('\t\t', 'Converting to uint8')
-                app.img = 255.0 * app.img
-                app.img = app.img.astype(np.uint8)
+            filename = stack.files[index]
+            print('\t\t', filename)
+            # Anything still running belongs to the previous image
+            app.jobs.cancel()
+            new_stack = stack is not self.stack
+            if not stack.loaded(index) and not app.overlay.enable.get():
+                self.show_preview(stack, index, new_stack)
+            img = stack.get(index)
 
             if self.debug:
-                print(app.img)
-                print(type(app.img))
-                print(app.img.dtype)
-            self.img = np.copy(app.img)
-            app.canvas.update_img(app.img)
+                print(img)
+                print(type(img))
+                print(img.dtype)
+            # The stack keeps handing out this array, so cached results of it are found again
+            same_shape = type(self.img) is np.ndarray and self.img.shape == img.shape
+            self.img = img
+            app.img = self.img
+            if new_stack:
+                if self.stack is not None:
+                    self.stack.shutdown()
+                self.stack = stack
+                app.store.register('stack', stack)
+            self.index = index
+            stack.current = index
+
+            app.thresh.dist_img = np.empty(0)
+            app.thresh.hist = np.empty(0)
+            app.thresh.levels = None
+            app.thresh.thresh_img = np.empty(0)
+            app.classes.class_img = None
+            app.grains.reset()
+            app.regions.reset(img.shape)
+            app.median.precompute(self.img)
+            app.thresh.index_img(app.img)
+            if new_stack or not same_shape:
+                app.canvas.reset_view()
+            # Show the source array so its display pyramid is reused by previews
+            app.canvas.update_img(self.img)
             if self.verbose or self.debug:
                 print('\t\t', app.img.shape)
             self.label.config(text=os.path.basename(os.path.realpath(filename)))
-            app.median.set(0, tk.NORMAL)
-            app.thresh.set(0, tk.NORMAL)
-            app.color.set(tk.NORMAL, tk.NORMAL)
-            app.overlay.set(0, tk.NORMAL)
+            if new_stack:
+                app.median.set(0, tk.NORMAL)
+                app.thresh.set(0, tk.NORMAL)
+                app.color.set(tk.NORMAL, tk.NORMAL)
+                app.overlay.set(0, tk.NORMAL)
+                app.classes.set(0, tk.NORMAL)
+                app.grains.set(tk.NORMAL)
+                app.regions.set(tk.NORMAL)
+                app.regions.refresh()
+                app.stack.set_stack(stack)
+            else:
+                # Same settings on the next file
+                app.refresh('median')
+            app.stack.set_current(index)
             # reset_color_oval()
-        except OSError:
+            return True
+        except Exception:
+            # Any decode error (corrupt .npy, decompression bomb, ...) leaves the current image open
             if self.debug:
                 print(format_exc())
             if self.verbose or self.debug:
@@ -140,5 +211,23 @@ class OpenUI(tk.Frame):
                 app.thresh.clear()
                 app.color.clear()
                 app.overlay.clear()
+                app.classes.clear()
+                app.stack.clear()
+                app.grains.clear()
+                app.regions.clear()
                 
             # Should add message box warning when file open fails
+            return False
+
+    def show_preview(self, stack: ImageStack, index: int, new_stack: bool):
+        """Show a reduced size decode of file index while the full image is decoding"""
+        app = self.master
+
+        preview = stack.preview(index, VIEW_SIZE)
+        if preview is None:
+            return
+        img, level, shape = preview
+        if new_stack or type(self.img) is not np.ndarray or self.img.shape != shape:
+            app.canvas.reset_view()
+        app.canvas.update_img(img, level, shape)
+        app.canvas.update_idletasks()
@@ -1,11 +1,14 @@
 #!/usr/bin/python3
 
 # # Imports # #
-from typing import Optional
+from typing import Optional, Sequence
 import tkinter as tk
 from tkinter import ttk
 import numpy as np
 
+from . import trace
+from .composite import Compositor, DIM
+
 
 class OverlayUI(tk.Frame):
     """UI for adding overlay to processed image for display"""
@@ -14,14 +17,18 @@ class OverlayUI(tk.Frame):
     
     enable: tk.IntVar  # Overlay Flag
     check: ttk.Checkbutton  # Toggle Overlay
+    compositor: Compositor  # Dim/tint tables and scratch space
     
     def __init__(self, master: Optional[tk.Frame] = None,
-                 verbose: bool = False, debug: bool = False):
+                 verbose: bool = False, debug: bool = False,
+                 dim: float = DIM, tint: Optional[Sequence[int]] = None):
         super().__init__(master)
         self.master = master
 
         self.verbose = verbose
         self.debug = debug
+
+        self.compositor = Compositor(dim, tint)
         
         self.enable = tk.IntVar()
         self.enable.set(0)
@@ -61,39 +68,32 @@ class OverlayUI(tk.Frame):
         """Update canvas based on enable state"""
         app = self.master
 
-        if app.thresh.enable.get():
-            app.canvas.update_img(app.thresh.thresh_img)
-        else:
-            app.canvas.update_img(app.img)
+        # Overlay is added when drawing, the shown image does not change
+        app.canvas.draw()
 
-    def add_overlay(self, img_arr: Optional[np.array] = None):
-        """Combine original image with processed image array for display"""
+    def set_style(self, dim: float = DIM, tint: Optional[Sequence[int]] = None):
+        """Brightness outside the mask and tint color inside it"""
         app = self.master
-        original_img = app.open.img
 
-        display_img = original_img
+        self.compositor.set_style(dim, tint)
+        if self.enable.get():
+            app.canvas.draw()
+
+    def add_overlay(self, img_arr: Optional[np.array] = None, original_img: Optional[np.array] = None,
+                    out: Optional[np.array] = None) -> np.array:
+        """Combine original image (or its view) with processed image array (or its view) for display"""
+        app = self.master
+        if original_img is None:
+            original_img = app.open.img
 
         if img_arr is None:
-            return display_img
+            return original_img
 
-        if img_arr.dtype == bool:
+        if img_arr.ndim != 2 and img_arr is original_img:
+            return original_img
+        with trace.span('overlay', log=False) as span:
             if img_arr.ndim == 2:
-                # Use threshold array as mask
-                # # TO DO # #
-                # Maybe more efficient way to do this
-                # Try to combine this all into one line, maybe weighted average???
-                mask = ~img_arr
-                display_img = display_img.astype(np.float64)
-                display_img[mask, 0] *= 0.25
-                display_img[mask, 1] *= 0.25
-                display_img[mask, 2] *= 0.25
-                display_img = display_img.astype(np.uint8)
-            else:
-                # This case should not happen
-                print('\n???\n')
-        else:
+                # Use threshold array as mask, downsampled masks have soft edges
+                return span.result(self.compositor.mask(original_img, img_arr, out))
             # Overlay median image with original image
-            if img_arr is not original_img and (img_arr != original_img).any():
-                display_img = (original_img / 2.0 + img_arr / 2.0).astype(np.uint8)
-
-        return display_img
+            return span.result(self.compositor.blend(original_img, img_arr, out))
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+
+# # Palette # #
+# Unique colors of an image plus the palette index of every pixel.
+# XRF false color maps have far fewer colors than pixels, so a new reference
+# color only needs one distance per palette entry and a gather into dist_img.
+
+# # Imports # #
+from typing import Optional, Sequence, Callable
+import numpy as np
+
+from .distance import CHUNK_PIXELS
+from .color_space import mode_distance
+
+MAX_COLORS = 1 << 16  # Largest palette kept, so the index fits in uint16
+
+
+def _color_keys(img: np.array, y0: int, y1: int, out: np.array) -> np.array:
+    """Pack the RGB values of rows y0:y1 into 24 bit keys"""
+    n = y1 - y0
+    key = out[:n]
+    np.left_shift(img[y0:y1, :, 0], 16, out=key, dtype=np.uint32)
+    key |= np.left_shift(img[y0:y1, :, 1], 8, dtype=np.uint32)
+    key |= img[y0:y1, :, 2]
+    return key
+
+
+class Palette:
+    """Unique colors of an image with the palette index of every pixel"""
+    colors: np.array  # Unique Colors (K x 3 uint8)
+    inverse: np.array  # Index into colors for every pixel (uint16)
+
+    def __init__(self, colors: np.array, inverse: np.array):
+        self.colors = colors
+        self.inverse = inverse
+
+    def __len__(self) -> int:
+        return self.colors.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.colors.nbytes + self.inverse.nbytes
+
+    @classmethod
+    def build(cls, img: np.array, max_colors: int = MAX_COLORS,
+              chunk_pixels: int = CHUNK_PIXELS,
+              progress: Optional[Callable[[float], None]] = None) -> Optional['Palette']:
+        """Index a uint8 RGB(A) image, None if it has more than max_colors colors"""
+        height, width = img.shape[0], img.shape[1]
+        rows = max(1, min(height, chunk_pixels // max(width, 1)))
+        key = np.empty((rows, width), dtype=np.uint32)
+
+        # First pass: mark every color that is present
+        present = np.zeros(1 << 24, dtype=bool)
+        for y0 in range(0, height, rows):
+            y1 = min(y0 + rows, height)
+            present[_color_keys(img, y0, y1, key)] = True
+            if progress is not None:
+                progress(0.5 * y1 / height)
+
+        keys = np.flatnonzero(present)
+        del present
+        if keys.size > max_colors:
+            return None
+
+        colors = np.empty((keys.size, 3), dtype=np.uint8)
+        colors[:, 0] = keys >> 16
+        colors[:, 1] = (keys >> 8) & 0xFF
+        colors[:, 2] = keys & 0xFF
+
+        # Second pass: look up the palette index of every pixel
+        lut = np.zeros(1 << 24, dtype=np.uint16)
+        lut[keys] = np.arange(keys.size)
+        inverse = np.empty((height, width), dtype=np.uint16)
+        for y0 in range(0, height, rows):
+            y1 = min(y0 + rows, height)
+            np.take(lut, _color_keys(img, y0, y1, key), out=inverse[y0:y1], mode='clip')
+            if progress is not None:
+                progress(0.5 + 0.5 * y1 / height)
+
+        return cls(colors, inverse)
+
+    def distance(self, color: Sequence[int], out: Optional[np.array] = None,
+                 progress: Optional[Callable[[float], None]] = None,
+                 mode: str = 'RGB', weights: Optional[Sequence[float]] = None) -> np.array:
+        """Scaled distance image, same result as mode_distance on the full image"""
+        # Any mode only needs the palette colors converted, never the image
+        dist = mode_distance(self.colors[:, np.newaxis, :], color, mode, weights)[:, 0]
+        return self.gather(dist, out, progress)
+
+    def gather(self, values: np.array, out: Optional[np.array] = None,
+               progress: Optional[Callable[[float], None]] = None) -> np.array:
+        """Image of values[palette index] for every pixel"""
+        if out is None:
+            out = np.empty(self.inverse.shape, dtype=values.dtype)
+
+        # Gather in chunks, np.take widens the index to intp internally
+        height, width = self.inverse.shape
+        rows = max(1, min(height, CHUNK_PIXELS // max(width, 1)))
+        for y0 in range(0, height, rows):
+            y1 = min(y0 + rows, height)
+            np.take(values, self.inverse[y0:y1], out=out[y0:y1], mode='clip')
+            if progress is not None:
+                progress(y1 / height)
+        return out
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+# # Pipeline # #
+# Pure NumPy processing used by both the GUI and the batch runner:
+# load -> median -> distance -> threshold -> percent
+# Nothing in here may touch tkinter so it can run without a display.
+
+# # Imports # #
+from typing import Optional, Sequence, Callable
+import numpy as np
+from scipy.ndimage import median_filter
+
+from . import loader
+from .bitmask import PackedMask
+from .color_space import mode_distance, DEFAULT_WEIGHTS
+from .histogram_median import median_uint8
+from .palette import Palette
+from .disk_cache import DiskCache
+
+# Smallest kernel where the histogram median beats scipy's selection median
+HISTOGRAM_MEDIAN_SIZE = 7
+
+# Normalized value of every possible uint8 distance level
+LEVELS = np.arange(256) / 255.0
+
+
+def load_image(filename: str, verbose: bool = False) -> np.array:
+    """Read image file into a uint8 array"""
+    return loader.load(filename, verbose=verbose)
+
+
+def median(img: np.array, size: int,
+           progress: Optional[Callable[[float], None]] = None) -> np.array:
+    """Apply size x size median filter to each channel separately"""
+    if img.dtype == np.uint8 and size >= HISTOGRAM_MEDIAN_SIZE:
+        return median_uint8(img, size, progress=progress)
+    return median_filter(img, size=(size, size, 1))
+
+
+def distance(img: np.array, color: Sequence[int], out: Optional[np.array] = None,
+             palette: Optional[Palette] = None,
+             progress: Optional[Callable[[float], None]] = None,
+             mode: str = 'RGB', weights: Optional[Sequence[float]] = None,
+             converted: Optional[np.array] = None) -> np.array:
+    """Calculate distance to color in mode (see color_space.MODES), scaled so 255 is an exact match"""
+    if palette is not None:
+        return palette.distance(color, out=out, progress=progress, mode=mode, weights=weights)
+    return mode_distance(img, color, mode, weights, converted, out=out, progress=progress)
+
+
+def distance_key(color: Sequence[int], mode: str = 'RGB', weights: Optional[Sequence[float]] = None) -> tuple:
+    """Cache key of a distance image, the same for every way distance() computes it"""
+    # Weights only change the Weighted RGB distance
+    weights = [float(w) for w in weights or DEFAULT_WEIGHTS] if mode == 'Weighted RGB' else None
+    return ('distance', [int(c) for c in color[:3]], mode, weights)
+
+
+def threshold_level(cutoff: float) -> int:
+    """Lowest uint8 distance level whose normalized value is at least cutoff (256 if none)"""
+    return int(np.searchsorted(LEVELS, cutoff, side='left'))
+
+
+def threshold(dist_img: np.array, cutoff: float) -> np.array:
+    """Bool mask of pixels whose normalized distance value is at least cutoff"""
+    # Comparing the uint8 levels gives the same mask as dist_img / 255.0 >= cutoff
+    # without the float64 copy of the whole image
+    return dist_img >= threshold_level(cutoff)
+
+
+def threshold_packed(dist_img: np.array, cutoff: float) -> PackedMask:
+    """threshold() packed 8 pixels to a byte, the bool mask is never made whole"""
+    return PackedMask.at_least(dist_img, threshold_level(cutoff))
+
+
+def percent(thresh_img: np.array) -> float:
+    """Percent of pixels set in a bool or packed mask"""
+    if isinstance(thresh_img, PackedMask):
+        return thresh_img.percent()
+    return thresh_img.sum() / thresh_img.size * 100.0
+
+
+def histogram(dist_img: np.array) -> np.array:
+    """Count of pixels at or above each distance level, with a trailing 0 for level 256"""
+    counts = np.bincount(dist_img.ravel(), minlength=256)
+    hist = np.zeros(257, dtype=np.int64)
+    hist[:256] = np.cumsum(counts[::-1])[::-1]
+    return hist
+
+
+def histogram_percent(hist: np.array, cutoff: float) -> float:
+    """Percent of pixels passing cutoff, read from a cumulative histogram in O(1)"""
+    return hist[threshold_level(cutoff)] / hist[0] * 100.0
+
+
+def process(img: np.array, color: Sequence[int], cutoff: float, size: Optional[int] = None,
+            mode: str = 'RGB', weights: Optional[Sequence[float]] = None,
+            disk: Optional[DiskCache] = None) -> float:
+    """Run the full pipeline on a loaded image and return the percent, reusing intermediates stored in disk"""
+    if disk is None:
+        disk = DiskCache(max_bytes=0)
+    if size:
+        source = img
+        img = disk.cached(source, ('median', size), lambda: median(source, size))
+    dist_img = disk.cached(img, distance_key(color, mode, weights),
+                           lambda: distance(img, color, mode=mode, weights=weights))
+    return histogram_percent(histogram(dist_img), cutoff)
+
+
+def process_file(filename: str, color: Sequence[int], cutoff: float, size: Optional[int] = None,
+                 mode: str = 'RGB', weights: Optional[Sequence[float]] = None,
+                 disk: Optional[DiskCache] = None) -> float:
+    """Run the full pipeline on an image file and return the percent"""
+    if disk is None:
+        return process(load_image(filename), color, cutoff, size, mode, weights)
+    return process(disk.load(filename, load_image), color, cutoff, size, mode, weights, disk)
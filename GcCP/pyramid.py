@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+# # Pyramid # #
+# Multi-resolution copies of an image for display. Each level is a 2x2 box
+# average of the one before, built lazily and only once per image. Drawing a
+# viewport picks the coarsest level that still has at least one pixel per
+# screen pixel and samples just the visible part of it, so the cost depends
+# on the screen size, not the image size. Level 0 can be a bit-packed mask,
+# which is unpacked a chunk of rows at a time while building level 1 and only
+# for the visible block when drawn at full size.
+
+# # Imports # #
+from typing import List, Tuple, Optional
+import numpy as np
+
+from .bitmask import PackedMask
+
+MIN_SIZE = 256  # Stop adding levels once both sides are this small
+CHUNK_ROWS = 512  # Rows downsampled at a time
+
+
+def _box(img: np.array, out: np.array):
+    """2x2 box average of an image with even height and width into out"""
+    h, w = out.shape[0], out.shape[1]
+    v = img.reshape((h, 2, w, 2) + img.shape[2:])
+    for y0 in range(0, h, CHUNK_ROWS):
+        y1 = min(y0 + CHUNK_ROWS, h)
+        acc = v[y0:y1, 0, :, 0].astype(np.uint16)
+        acc += v[y0:y1, 0, :, 1]
+        acc += v[y0:y1, 1, :, 0]
+        acc += v[y0:y1, 1, :, 1]
+        if img.dtype == bool:
+            acc *= 255
+        acc += 2
+        acc >>= 2
+        out[y0:y1] = acc
+
+
+def _box_at(img: np.array, rows: np.array, cols: np.array) -> np.array:
+    """2x2 box average of a 2D img at half size pixels (rows, cols), same values as downsample"""
+    # Odd sides: clamping the second row / column repeats the last one like downsample does
+    height, width = img.shape
+    r0 = rows * 2
+    c0 = cols * 2
+    r1 = np.minimum(r0 + 1, height - 1)
+    c1 = np.minimum(c0 + 1, width - 1)
+    if isinstance(img, PackedMask):
+        acc = img.get(r0, c0).astype(np.uint16)
+        acc += img.get(r0, c1)
+        acc += img.get(r1, c0)
+        acc += img.get(r1, c1)
+        acc *= 255
+        acc += 2
+        acc >>= 2
+        return acc
+    flat = img.reshape(-1)
+    r0 *= width
+    r1 *= width
+    # Flat takes are several times faster than 2D fancy indexing
+    acc = flat.take(r0 + c0).astype(np.uint16)
+    acc += flat.take(r0 + c1)
+    acc += flat.take(r1 + c0)
+    acc += flat.take(r1 + c1)
+    if img.dtype == bool:
+        acc *= 255
+    acc += 2
+    acc >>= 2
+    return acc
+
+
+def downsample(img: np.array) -> np.array:
+    """Half size 2x2 box average of a uint8, bool or packed image (bool is treated as 0/255)"""
+    height, width = img.shape[0], img.shape[1]
+    if isinstance(img, PackedMask):
+        # Even chunks of rows downsample to exactly their half, the last one handles an odd height
+        out = np.empty(((height + 1) // 2, (width + 1) // 2), dtype=np.uint8)
+        for y0 in range(0, height, 2 * CHUNK_ROWS):
+            y1 = min(y0 + 2 * CHUNK_ROWS, height)
+            out[y0 // 2:(y1 + 1) // 2] = downsample(img.unpack(y0, y1))
+        return out
+    h, w = height // 2, width // 2
+    out = np.empty(((height + 1) // 2, (width + 1) // 2) + img.shape[2:], dtype=np.uint8)
+
+    _box(img[:2 * h, :2 * w], out[:h, :w])
+
+    # Odd sides: the last row / column is averaged with itself
+    if width % 2:
+        _box(np.repeat(img[:2 * h, -1:], 2, axis=1), out[:h, w:])
+    if height % 2:
+        row = np.repeat(img[-1:], 2, axis=0)
+        if width % 2:
+            row = np.concatenate([row, row[:, -1:]], axis=1)
+        _box(row, out[h:])
+    return out
+
+
+class Pyramid:
+    """Lazily built box downsampled levels of an image"""
+    levels: List[np.array]  # levels[k] is 1 / 2**(k + offset) of full size
+    offset: int  # Level of levels[0], nonzero for pyramids of preview images
+    full_shape: Tuple[int, ...]  # Shape of the full size image
+
+    def __init__(self, img: np.array, offset: int = 0, full_shape: Optional[Tuple[int, ...]] = None):
+        self.levels = [img]
+        self.offset = offset
+        self.full_shape = img.shape if full_shape is None else full_shape
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.full_shape
+
+    @property
+    def nbytes(self) -> int:
+        # Level 0 is the caller's array, only count what the pyramid added
+        return sum(level.nbytes for level in self.levels[1:])
+
+    def level(self, k: int) -> np.array:
+        """Level k, building any missing levels up to it"""
+        while len(self.levels) <= k:
+            last = self.levels[-1]
+            if max(last.shape[0], last.shape[1]) <= MIN_SIZE:
+                break
+            self.levels.append(downsample(last))
+        return self.levels[min(k, len(self.levels) - 1)]
+
+    def update(self, positions: np.array):
+        """Recompute the built levels where pixels of a 2D or packed level 0 at flat positions were changed in place"""
+        rows, cols = np.divmod(positions.astype(np.intp), self.levels[0].shape[1])
+        for k in range(1, len(self.levels)):
+            # Pixels sharing a parent just compute it twice, cheaper than finding unique parents
+            rows >>= 1
+            cols >>= 1
+            level = self.levels[k]
+            level.reshape(-1)[rows * level.shape[1] + cols] = _box_at(self.levels[k - 1], rows, cols)
+
+    def level_for(self, scale: float) -> int:
+        """Coarsest level with at least one pixel per screen pixel at scale (screen px / image px)"""
+        k = 0
+        while scale * 2 ** (k + self.offset + 1) <= 1.0:
+            k += 1
+        return k
+
+    def nearest(self, scale: float) -> Tuple[int, np.array]:
+        """Level number (relative to full size) and array used to draw at scale"""
+        k = self.level_for(scale)
+        level = self.level(k)
+        return min(k, len(self.levels) - 1) + self.offset, level
+
+    def built(self, scale: float, max_pixels: int) -> Optional[Tuple[int, np.array]]:
+        """Level number and array of the finest already built level with at most max_pixels, no finer than needed
+        at scale, None if that level is not built yet (building is left to the caller)"""
+        k = self.level_for(scale)
+        while k < len(self.levels) and self.levels[k].shape[0] * self.levels[k].shape[1] > max_pixels:
+            k += 1
+        if k >= len(self.levels):
+            last = self.levels[-1]
+            if max(last.shape[0], last.shape[1]) > MIN_SIZE or last.shape[0] * last.shape[1] > max_pixels:
+                return None
+            # Image is too small for more levels
+            k = len(self.levels) - 1
+        return k + self.offset, self.levels[k]
+
+    def render(self, x0: float, y0: float, scale: float, width: int, height: int,
+               out: Optional[np.array] = None) -> np.array:
+        """width x height view with full size image point (x0, y0) at the top left corner"""
+        k, level = self.nearest(scale)
+        factor = 2 ** k
+
+        # Level pixel under the center of every screen pixel
+        cols = np.floor((x0 + (np.arange(width) + 0.5) / scale) / factor).astype(np.intp)
+        rows = np.floor((y0 + (np.arange(height) + 0.5) / scale) / factor).astype(np.intp)
+        inside_x = (cols >= 0) & (cols < level.shape[1])
+        inside_y = (rows >= 0) & (rows < level.shape[0])
+
+        if out is None:
+            out = np.zeros((height, width) + level.shape[2:], dtype=np.uint8)
+        else:
+            out[...] = 0
+        if not inside_x.any() or not inside_y.any():
+            return out
+
+        # Only the visible block of the level is touched
+        sx = np.flatnonzero(inside_x)
+        sy = np.flatnonzero(inside_y)
+        cols = cols[sx[0]:sx[-1] + 1]
+        rows = rows[sy[0]:sy[-1] + 1]
+        if isinstance(level, PackedMask):
+            block = level.unpack(rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        else:
+            block = level[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        view = block.take(rows - rows[0], axis=0).take(cols - cols[0], axis=1)
+        if view.dtype == bool:
+            # Expand 0 / 1 straight into the display buffer
+            np.multiply(view.view(np.uint8), np.uint8(255), out=out[sy[0]:sy[-1] + 1, sx[0]:sx[-1] + 1])
+        else:
+            out[sy[0]:sy[-1] + 1, sx[0]:sx[-1] + 1] = view
+        return out
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+
+# # Imports # #
+from typing import Optional, List, Tuple
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+
+from . import regions as roi
+from . import trace
+from .regions import Region, RegionLabels, RegionStats
+from .jobs import Job, JobScheduler
+
+OUTLINE = '#ffd700'  # Color of region outlines on the canvas
+
+
+class RegionUI(tk.Frame):
+    """UI for drawing regions of interest on the canvas and measuring each of them"""
+    verbose: bool
+    debug: bool
+
+    regions: List[Region]  # Regions in the order they were drawn, they may overlap
+    items: List[int]  # Canvas item of every region
+    labels: Optional[RegionLabels]  # Rasterized regions, None once regions change
+    stats: Optional[RegionStats]  # Measurements of the current regions, distance image and image
+    drawing: Optional[str]  # Shape being drawn, None when not drawing
+    points: List[Tuple[float, float]]  # Image coordinates of the region being drawn
+    outline: Optional[int]  # Canvas item of the region being drawn
+    jobs: JobScheduler  # Own worker, so measuring doesn't cancel pipeline updates
+
+    shape: tk.StringVar  # Shape of the next region
+    shape_box: ttk.Combobox
+    draw_button: ttk.Button  # Start drawing a region
+    clear_button: ttk.Button  # Remove all regions
+    status: ttk.Label  # Progress and hints
+    table: ttk.Treeview  # Pixels, percent and mean color per region
+
+    def __init__(self, master: Optional[tk.Frame] = None,
+                 verbose: bool = False, debug: bool = False):
+        super().__init__(master)
+        self.master = master
+
+        self.verbose = verbose
+        self.debug = debug
+
+        self.regions = []
+        self.items = []
+        self.labels = None
+        self.stats = None
+        self.drawing = None
+        self.points = []
+        self.outline = None
+
+        self.shape = tk.StringVar(value=roi.SHAPES[0])
+        self.shape_box = ttk.Combobox(
+            self,
+            textvariable=self.shape,
+            values=roi.SHAPES,
+            state='readonly',
+            width=9
+        )
+        self.draw_button = ttk.Button(
+            self,
+            text='Draw ROI',
+            command=self.toggle
+        )
+        self.clear_button = ttk.Button(
+            self,
+            text='Clear',
+            command=self.remove_all
+        )
+        self.status = ttk.Label(
+            self,
+            text='',
+            width=16
+        )
+        self.table = ttk.Treeview(
+            self,
+            columns=('name', 'pixels', 'percent', 'color'),
+            show='headings',
+            height=4
+        )
+        self.table.heading('name', text='ROI')
+        self.table.heading('pixels', text='Pixels')
+        self.table.heading('percent', text='Percent')
+        self.table.heading('color', text='Mean Color')
+        self.table.column('name', width=50)
+        self.table.column('pixels', width=70)
+        self.table.column('percent', width=60)
+        self.table.column('color', width=90)
+
+        self.jobs = JobScheduler(self, self.status, verbose=verbose, debug=debug)
+        self.set(tk.DISABLED)
+
+    def grid(self, column: int = 0, row: int = 0, columnspan: int = 1, rowspan: int = 1):
+        super().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan, sticky=tk.EW)
+        self.draw_button.grid(column=0, row=0, padx=(18, 0))
+        self.shape_box.grid(column=1, row=0, padx=(6, 0))
+        self.clear_button.grid(column=2, row=0, padx=(6, 0))
+        self.status.grid(column=0, row=1, columnspan=3, padx=(18, 0), sticky=tk.W)
+        self.table.grid(column=0, row=2, columnspan=3, padx=(18, 6), pady=(4, 0))
+
+    def pack(self, side: str = tk.LEFT):
+        super().pack(side=side)
+        self.draw_button.pack(side=tk.LEFT)
+        self.shape_box.pack(side=tk.LEFT)
+        self.clear_button.pack(side=tk.LEFT)
+        self.status.pack(side=tk.LEFT)
+        self.table.pack(side=tk.LEFT)
+
+    def set(self, state: str = tk.DISABLED):
+        """Set state of widgets"""
+        self.draw_button.config(state=state)
+        self.shape_box.config(state='readonly' if state == tk.NORMAL else state)
+        self.clear_button.config(state=state)
+
+    def clear(self):
+        """Reset widgets to default state"""
+        self.remove_all()
+        self.set(tk.DISABLED)
+
+    def reset(self, shape: Tuple[int, ...]):
+        """New image of shape, regions are kept for images of the same size but measured again"""
+        app = self.master
+
+        if app.canvas.image_shape is not None and app.canvas.image_shape != shape[:2]:
+            self.remove_all()
+            return
+        self.jobs.cancel()
+        self.stats = None
+        self.update_table()
+
+    def toggle(self):
+        """Start drawing a region of the selected shape on the canvas"""
+        self.cancel()
+        self.drawing = self.shape.get()
+        self.draw_button.config(state=tk.DISABLED)
+        self.status.config(text='Double click to close' if self.drawing == 'Polygon' else 'Drag on the image')
+        if self.verbose or self.debug:
+            print('Regions:\t', 'Drawing', self.drawing)
+
+    def cancel(self):
+        """Stop drawing without adding a region"""
+        app = self.master
+
+        if self.outline is not None:
+            app.canvas.delete(self.outline)
+        self.outline = None
+        self.points = []
+        self.drawing = None
+        self.draw_button.config(state=tk.NORMAL)
+
+    def press(self, x: float, y: float):
+        """Mouse pressed at image point x, y while drawing"""
+        app = self.master
+
+        if self.drawing == 'Polygon':
+            if self.points and self.points[-1] == (x, y):
+                return
+            self.points.append((x, y))
+        else:
+            self.points = [(x, y), (x, y)]
+        if self.outline is None:
+            self.outline = self.create_item(self.drawing, dash=(4, 2))
+        self.draw_outline(self.outline, self.drawing, self.points)
+        app.canvas.tag_raise(self.outline)
+
+    def drag(self, x: float, y: float):
+        """Mouse dragged to image point x, y while drawing"""
+        if not self.points:
+            return
+        self.points[-1] = (x, y)
+        self.draw_outline(self.outline, self.drawing, self.points)
+
+    def release(self, x: float, y: float):
+        """Mouse released at image point x, y, rectangles and ellipses are done"""
+        if self.drawing != 'Polygon' and self.points:
+            self.drag(x, y)
+            self.finish()
+
+    def finish(self):
+        """Add the region being drawn and measure all regions again"""
+        region = Region(self.drawing, self.points, name=str(len(self.regions) + 1))
+        self.cancel()
+        self.status.config(text='')
+        if not region.valid():
+            return
+        self.regions.append(region)
+        self.items.append(self.create_item(region.shape))
+        self.draw_outline(self.items[-1], region.shape, region.points)
+        if self.debug:
+            print('\t\t', 'Region:', region.shape, region.points)
+        self.labels = None
+        self.refresh()
+
+    def remove_all(self):
+        """Remove every region"""
+        app = self.master
+
+        self.cancel()
+        self.jobs.cancel()
+        for item in self.items:
+            app.canvas.delete(item)
+        self.regions = []
+        self.items = []
+        self.labels = None
+        self.stats = None
+        self.status.config(text='')
+        self.update_table()
+
+    def create_item(self, shape: str, **options) -> int:
+        """Canvas item outlining a region, placed by draw_outline"""
+        app = self.master
+
+        if shape == 'Rectangle':
+            return app.canvas.create_rectangle(0, 0, 0, 0, outline=OUTLINE, tags='region', **options)
+        if shape == 'Ellipse':
+            return app.canvas.create_oval(0, 0, 0, 0, outline=OUTLINE, tags='region', **options)
+        return app.canvas.create_polygon(0, 0, 0, 0, outline=OUTLINE, fill='', tags='region', **options)
+
+    def draw_outline(self, item: int, shape: str, points: List[Tuple[float, float]]):
+        """Place outline item at the canvas position of points"""
+        app = self.master
+
+        coords = []
+        for x, y in points if shape == 'Polygon' else (points[0], points[-1]):
+            coords += app.canvas.to_canvas(x, y)
+        if len(coords) < 4:
+            coords += coords
+        app.canvas.coords(item, *coords)
+
+    def draw(self):
+        """Move outlines after the view changed"""
+        for region, item in zip(self.regions, self.items):
+            self.draw_outline(item, region.shape, region.points)
+        if self.outline is not None and self.points:
+            self.draw_outline(self.outline, self.drawing, self.points)
+
+    def refresh(self):
+        """Measure every region on the current image and distance image"""
+        app = self.master
+
+        self.jobs.cancel()
+        self.stats = None
+        if not self.regions or type(app.open.img) is not np.ndarray:
+            self.update_table()
+            return
+        # Colors are measured on the original image, percents on the distance image behind the mask
+        img = app.open.img
+        dist_img = app.thresh.dist_img if app.thresh.dist_img.shape == img.shape[:2] else None
+        regions = list(self.regions)
+        labels = self.labels if self.labels is not None and self.labels.count == len(regions) else None
+        self.jobs.submit(lambda job: self.process(job, regions, labels, img, dist_img), on_done=self.measured)
+
+    def process(self, job: Job, regions: List[Region], labels: Optional[RegionLabels], img: np.array,
+                dist_img: Optional[np.array]) -> Tuple[RegionLabels, RegionStats]:
+        """Rasterize regions unless labels are given and measure them (runs on worker thread)"""
+        with trace.span('regions', regions=len(regions)) as span:
+            job.step('Regions')
+            if labels is None:
+                labels = roi.rasterize(regions, img.shape)
+            stats = roi.region_stats(labels, dist_img, img, progress=job.progress)
+            span.set(pixels=labels.size, layers=len(labels.layers))
+            return labels, span.result(stats)
+
+    def measured(self, result: Tuple[RegionLabels, RegionStats]):
+        """Keep the measurements of a finished job (runs on Tk thread)"""
+        self.labels, self.stats = result
+        self.update_table()
+
+    def cutoff(self) -> Optional[float]:
+        """Current threshold, None if the threshold is off"""
+        app = self.master
+
+        if app.thresh.enable.get() != 1:
+            return None
+        return round(app.thresh.var.get(), 2)
+
+    def update_table(self):
+        """Show pixels, percent and mean color of every region"""
+        self.table.delete(*self.table.get_children())
+        if self.stats is None:
+            return
+        cutoff = self.cutoff()
+        percents = self.stats.percent(cutoff) if cutoff is not None else None
+        means = self.stats.mean()
+        for i, region in enumerate(self.regions):
+            color = ''
+            if means is not None and self.stats.pixels[i]:
+                color = ','.join(str(int(round(c))) for c in means[i, :3])
+            self.table.insert('', tk.END, iid=str(i), values=(region.name, int(self.stats.pixels[i]),
+                                                              self.format_percent(percents, i), color))
+        self.status.config(text='{} ROIs'.format(len(self.regions)))
+        if self.verbose or self.debug:
+            print('Regions:\t', len(self.regions), 'ROIs,', len(self.labels.layers), 'label layers,',
+                  self.labels.nbytes, 'bytes')
+            for i, region in enumerate(self.regions):
+                print('\t\t', region.name, region.shape, int(self.stats.pixels[i]), 'pixels',
+                      self.format_percent(percents, i))
+
+    def show_percent(self, cutoff: float):
+        """Update the percent column for cutoff from the region histograms (no pass over the image)"""
+        if self.stats is None or self.stats.hist is None:
+            return
+        percents = self.stats.percent(cutoff)
+        for i in range(len(self.regions)):
+            if self.table.exists(str(i)):
+                self.table.set(str(i), 'percent', self.format_percent(percents, i))
+
+    @staticmethod
+    def format_percent(percents: Optional[np.array], i: int) -> str:
+        if percents is None or np.isnan(percents[i]):
+            return ''
+        return str(round(float(percents[i]), 2)) + ' %'
+
+    def shutdown(self):
+        """Stop worker thread"""
+        self.jobs.shutdown()
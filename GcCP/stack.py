@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+
+# # Stack # #
+# Several image files opened together. Files are decoded concurrently on a
+# thread pool as soon as the stack is opened, and kept in a memory capped LRU.
+# The same array object is handed out every time a file is requested while it
+# is loaded, so every result cache keyed by the source image (median, palette,
+# pyramid, conversions) is hit again when switching back to a file.
+
+# # Imports # #
+from typing import Optional, List, Callable, Dict, Tuple, Any, Collection
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+import numpy as np
+
+from . import pipeline
+from . import loader
+from .cache import DEFAULT_BYTES, tick
+from .jobs import Job, wait
+
+
+class ImageStack:
+    """Lazily loaded list of image files"""
+    verbose: bool
+    debug: bool
+
+    files: List[str]  # File names in stack order
+    loader: Callable[[str], np.array]  # Decodes one file
+    max_bytes: int  # Memory cap for decoded images
+    executor: ThreadPoolExecutor  # Decoding workers
+    futures: Dict[int, Future]  # Loads in flight by index
+    current: Optional[int]  # File being shown, never evicted
+    store: Optional[Any]  # ImageStore enforcing the total budget
+
+    def __init__(self, files: List[str], loader: Callable[[str], np.array] = pipeline.load_image,
+                 workers: Optional[int] = None, max_bytes: int = DEFAULT_BYTES,
+                 store: Optional[Any] = None, verbose: bool = False, debug: bool = False):
+        self.verbose = verbose
+        self.debug = debug
+
+        self.files = list(files)
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='load')
+        self.futures = {}
+        self.current = None
+        self.store = store
+        self._images = OrderedDict()  # index -> decoded image, least recently used first
+        self._used = {}  # index -> last use
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def name(self, index: int) -> str:
+        return os.path.basename(self.files[index])
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(img.nbytes for img in self._images.values())
+
+    def loaded(self, index: int) -> bool:
+        with self._lock:
+            return index in self._images
+
+    def prefetch(self, indices: Optional[List[int]] = None):
+        """Start decoding files (all by default) on the worker threads"""
+        if indices is None:
+            indices = range(len(self.files))
+        for index in indices:
+            if not self.loaded(index):
+                self._submit(index)
+
+    def preview(self, index: int, max_size: int) -> Optional[Tuple[np.array, int, Tuple[int, ...]]]:
+        """Reduced size decode of file index, its pyramid level and the full shape, None if the format has none"""
+        image_file = loader.open_image(self.files[index])
+        if not image_file.reduces:
+            return None
+        img, level = image_file.preview(max_size)
+        if self.verbose or self.debug:
+            print('\t\t', 'Preview', self.name(index), img.shape, image_file.report())
+        return img, level, image_file.shape
+
+    def get(self, index: int, job: Optional[Job] = None) -> np.array:
+        """Decoded image of file index, waits for (or starts) its load"""
+        with self._lock:
+            img = self._images.get(index)
+            if img is not None:
+                self._images.move_to_end(index)
+                self._used[index] = tick()
+                return img
+            future = self._submit(index)
+        # Raises the loader's exception (e.g. OSError) if decoding failed
+        wait(future, job)
+        with self._lock:
+            img = self._images.get(index)
+            if img is None:
+                # Evicted again right away, keep it anyway since the caller needs it
+                img = future.result()
+                self._store(index, img)
+            return img
+
+    def _submit(self, index: int) -> Future:
+        with self._lock:
+            future = self.futures.get(index)
+            if future is None:
+                future = self.futures[index] = self.executor.submit(self._load, index)
+            return future
+
+    def _load(self, index: int) -> np.array:
+        try:
+            img = self.loader(self.files[index])
+        except Exception:
+            # A failed load is retried on the next request
+            with self._lock:
+                self.futures.pop(index, None)
+            raise
+        if self.debug:
+            print('\t\t', 'Loaded', self.name(index), img.shape)
+        with self._lock:
+            self._store(index, img)
+            self.futures.pop(index, None)
+        if self.store is not None:
+            self.store.enforce()
+        return img
+
+    def _store(self, index: int, img: np.array):
+        """Keep img and evict least recently used images over the memory cap"""
+        # Shared by every cache keyed on it
+        img.flags.writeable = False
+        with self._lock:
+            self._images[index] = img
+            self._images.move_to_end(index)
+            self._used[index] = tick()
+            total = sum(value.nbytes for value in self._images.values())
+            for old in list(self._images):
+                if total <= self.max_bytes:
+                    break
+                if old in (index, self.current):
+                    continue
+                total -= self._evict(old)
+
+    def _evict(self, index: int) -> int:
+        self._used.pop(index, None)
+        if self.debug:
+            print('\t\t', 'Stack Evicted:', self.name(index))
+        return self._images.pop(index).nbytes
+
+    def values(self) -> List[np.array]:
+        """Decoded images, least recently used first"""
+        with self._lock:
+            return list(self._images.values())
+
+    def _first(self, keep: Collection[int]) -> Optional[int]:
+        for index, img in self._images.items():
+            if index != self.current and id(img) not in keep:
+                return index
+        return None
+
+    def oldest(self, keep: Collection[int] = ()) -> Optional[int]:
+        """Last use of the least recently used image that may be evicted, None if there is none"""
+        with self._lock:
+            index = self._first(keep)
+            return None if index is None else self._used[index]
+
+    def evict_oldest(self, keep: Collection[int] = ()):
+        """Drop the least recently used image except the one being shown and ids in keep"""
+        with self._lock:
+            index = self._first(keep)
+            if index is not None:
+                self._evict(index)
+
+    def shutdown(self):
+        """Stop loading"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
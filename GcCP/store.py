@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+# # Store # #
+# Accounting of all image memory held by the application, by stage. Current
+# state (source image, filtered image, distance image, mask, display buffers)
+# is tracked through getters and marked read-only, so every consumer shares
+# the same arrays instead of copying them. Result caches and the file stack
+# register as evictable: they only hold intermediates that can be computed
+# again, and whenever the total is over the budget their least recently used
+# entries are dropped, oldest first across all of them. Arrays that are both
+# state and cached (e.g. the median result being shown) count once.
+
+# # Imports # #
+from typing import Optional, Any, Callable, Dict, Iterable, List, Tuple, Set
+import threading
+import numpy as np
+
+from .cache import ResultCache, DEFAULT_BYTES, result_nbytes
+
+DEFAULT_BUDGET = 2 << 30  # 2 GB
+
+
+def readonly(value: Any) -> Any:
+    """Mark an array read-only so it can be handed out without copies"""
+    if isinstance(value, np.ndarray) and value.size:
+        value.flags.writeable = False
+    return value
+
+
+def _root(value: Any) -> int:
+    """id of the object owning the memory of value, so views of one array count once"""
+    while isinstance(value, np.ndarray) and isinstance(value.base, np.ndarray):
+        value = value.base
+    return id(value)
+
+
+class ImageStore:
+    """Memory budget and per stage usage of application state and caches"""
+    verbose: bool
+    debug: bool
+
+    budget: int  # Total bytes intermediates are evicted to stay under
+    trackers: Dict[str, Callable[[], Iterable[Any]]]  # Current state objects by stage
+    evictables: Dict[str, Any]  # Caches by stage, anything with values(), oldest(keep) and evict_oldest(keep)
+    peak: int  # Largest total seen
+
+    def __init__(self, budget: int = DEFAULT_BUDGET, verbose: bool = False, debug: bool = False):
+        self.verbose = verbose
+        self.debug = debug
+
+        self.budget = budget
+        self.trackers = {}
+        self.evictables = {}
+        self.peak = 0
+        self._lock = threading.RLock()
+
+    def cache(self, stage: str, max_bytes: int = DEFAULT_BYTES) -> ResultCache:
+        """New result cache of stage that counts against the budget"""
+        cache = ResultCache(min(max_bytes, self.budget), verbose=self.verbose, debug=self.debug, store=self)
+        self.register(stage, cache)
+        return cache
+
+    def register(self, stage: str, evictable: Any):
+        """Count an evictable holder of recomputable results (replaces the old one of stage)"""
+        with self._lock:
+            self.evictables[stage] = evictable
+
+    def track(self, stage: str, getter: Callable[[], Iterable[Any]]):
+        """Count the objects returned by getter, they are never evicted"""
+        with self._lock:
+            self.trackers[stage] = getter
+
+    def usage(self) -> Dict[str, int]:
+        """Bytes held per stage, state first then caches"""
+        with self._lock:
+            seen = set()
+            usage = {}
+            for stage, getter in list(self.trackers.items()) + [(stage, evictable.values) for stage, evictable
+                                                                 in self.evictables.items()]:
+                nbytes = 0
+                for value in getter():
+                    if value is None or _root(value) in seen:
+                        continue
+                    seen.add(_root(value))
+                    nbytes += result_nbytes(value)
+                usage[stage] = usage.get(stage, 0) + nbytes
+            return usage
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self.usage().values())
+
+    def headroom(self) -> int:
+        """Bytes left before the budget is reached"""
+        return self.budget - self.nbytes
+
+    def enforce(self):
+        """Evict the least recently used intermediates of all caches until under budget"""
+        with self._lock:
+            total = self.nbytes
+            self.peak = max(self.peak, total)
+            if total <= self.budget:
+                return
+            # Evicting results that are also current state would free nothing
+            keep = set()
+            for getter in self.trackers.values():
+                for value in getter():
+                    keep.update((id(value), _root(value)))
+            while total > self.budget:
+                oldest = self._oldest(keep)
+                if oldest is None:
+                    break
+                stage, evictable = oldest
+                if self.debug:
+                    print('\t\t', 'Budget Evict:', stage)
+                evictable.evict_oldest(keep)
+                total = self.nbytes
+
+    def _oldest(self, keep: Set[int]) -> Optional[Tuple[str, Any]]:
+        found = None
+        for stage, evictable in self.evictables.items():
+            last_use = evictable.oldest(keep)
+            if last_use is not None and (found is None or last_use < found[0]):
+                found = (last_use, stage, evictable)
+        return None if found is None else found[1:]
+
+    def report(self) -> List[str]:
+        """Lines of usage per stage and total against the budget"""
+        usage = self.usage()
+        total = sum(usage.values())
+        self.peak = max(self.peak, total)
+        lines = ['{:.0f} / {:.0f} MB (peak {:.0f} MB)'.format(total / 2 ** 20, self.budget / 2 ** 20,
+                                                               self.peak / 2 ** 20)]
+        for stage, nbytes in usage.items():
+            if nbytes:
+                lines.append('{}: {:.1f} MB'.format(stage, nbytes / 2 ** 20))
+        return lines
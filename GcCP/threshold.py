@@ -1,10 +1,26 @@
 #!/usr/bin/python3
 
 # # Imports # #
-from typing import Optional
+from typing import Optional, Dict, List, Tuple, Callable, Sequence, Any, Union
 import tkinter as tk
 from tkinter import ttk
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from . import pipeline
+from . import trace
+from .palette import Palette
+from .level_index import LevelIndex
+from .bitmask import PackedMask
+from .color_space import MODES, SPACES, DEFAULT_WEIGHTS, convert, parse_weights
+from .cache import ResultCache, DEFAULT_BYTES
+from .disk_cache import DiskCache
+from .jobs import Job, wait
+
+# Slider moves flipping more pixels than this go through the preview and a full threshold,
+# flipping scattered pixels costs about 100 times more per pixel than thresholding all of them
+SCRUB_FRACTION = 0.01
+SCRUB_PIXELS = 1 << 18  # Keeps a scrub step on the Tk thread under ~50 ms
 
 
 class ThresholdUI(tk.Frame):
@@ -12,8 +28,18 @@ class ThresholdUI(tk.Frame):
     verbose: bool
     debug: bool
 
-    thresh_img: np.array  # Bool Image
+    thresh_img: Union[PackedMask, np.array]  # Packed mask (empty array when there is none)
     dist_img: np.array  # RGB Distance Values
+    hist: np.array  # Cumulative Histogram of dist_img
+    levels: Optional[LevelIndex]  # Pixels of dist_img by level, to update thresh_img in place
+    cutoff: float  # Threshold used for thresh_img
+    store: Optional[Any]  # Memory budget, the level index is skipped without room for it
+    palettes: ResultCache  # Palettes by source image (False if too many colors)
+    executor: ThreadPoolExecutor  # Idle Worker for palette index
+    pending: Dict[int, Future]  # Palette Job by id(source image)
+    conversions: ResultCache  # Color space conversions by (source image, space)
+    disk: DiskCache  # Distance images kept between sessions
+    weights: Tuple[float, float, float]  # Channel weights for Weighted RGB mode
 
     enable: tk.IntVar  # Threshold Flag
     check: ttk.Checkbutton  # Toggle Threshold
@@ -21,9 +47,15 @@ class ThresholdUI(tk.Frame):
     slider: ttk.Scale  # Threshold Cutoff Slider
     var: tk.DoubleVar  # self.slider Value
     entry: ttk.Entry  # Threshold Cutoff Display
+    mode: tk.StringVar  # Distance Mode
+    mode_box: ttk.Combobox  # Distance Mode Selection
+    weight_frame: ttk.Frame  # Weighted RGB Channel Weights Frame
+    weight_entries: List[ttk.Entry]  # R, G, B Weights
 
     def __init__(self, master: Optional[tk.Frame] = None,
-                 verbose: bool = False, debug: bool = False):
+                 verbose: bool = False, debug: bool = False,
+                 cache_bytes: int = DEFAULT_BYTES, store: Optional[Any] = None,
+                 disk: Optional[DiskCache] = None):
         # Initialize tk.Frame
         super().__init__(master)
         self.master = master
@@ -34,6 +66,20 @@ class ThresholdUI(tk.Frame):
         # Initialize image data
         self.thresh_img = np.empty(0)
         self.dist_img = np.empty(0)
+        self.hist = np.empty(0)
+        self.levels = None
+        self.cutoff = 0.0
+        self.store = store
+        if store is not None:
+            self.palettes = store.cache('palette', cache_bytes)
+            self.conversions = store.cache('conversion', cache_bytes)
+        else:
+            self.palettes = ResultCache(cache_bytes, verbose=verbose, debug=debug)
+            self.conversions = ResultCache(cache_bytes, verbose=verbose, debug=debug)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='palette')
+        self.pending = {}
+        self.weights = DEFAULT_WEIGHTS
+        self.disk = disk if disk is not None else DiskCache(max_bytes=0)
 
         # Initialize Widgets
         self.enable = tk.IntVar()
@@ -75,12 +121,42 @@ class ThresholdUI(tk.Frame):
         self.entry.insert(0, '0.00')
         self.entry.configure(state=tk.DISABLED)
 
+        self.mode = tk.StringVar()
+        self.mode.set(MODES[0])
+        self.mode_box = ttk.Combobox(
+            self,
+            textvariable=self.mode,
+            values=MODES,
+            width=12
+        )
+        self.mode_box.bind('<<ComboboxSelected>>', self.mode_callback)
+        self.mode_box.configure(state=tk.DISABLED)
+
+        self.weight_frame = ttk.Frame(
+            self
+        )
+        self.weight_entries = []
+        for _ in range(3):
+            entry = ttk.Entry(
+                self.weight_frame,
+                width=5
+            )
+            entry.bind('<Return>', self.weights_callback)
+            entry.bind('<FocusOut>', self.weights_callback)
+            self.weight_entries.append(entry)
+        self.show_weights()
+        self.set_weight_state()
+
     def grid(self, column: int = 0, row: int = 0, columnspan: int = 1, rowspan: int = 1):
         super().grid(column=column, row=row, columnspan=columnspan, rowspan=rowspan, sticky=tk.EW)
         self.check.grid(column=0, row=0, padx=(18, 0))
         self.slider.pack(side=tk.LEFT)
         self.entry.pack(side=tk.LEFT, padx=(4, 0))
         self.frame.grid(column=1, row=0, padx=(6, 6))
+        self.mode_box.grid(column=1, row=1, padx=(6, 6), sticky=tk.W)
+        self.weight_frame.grid(column=1, row=2, padx=(6, 6), sticky=tk.W)
+        for entry in self.weight_entries:
+            entry.pack(side=tk.LEFT, padx=(0, 2))
 
     def pack(self, side: str = tk.LEFT):
         super().pack(side=side)
@@ -88,6 +164,10 @@ class ThresholdUI(tk.Frame):
         self.slider.pack(side=tk.LEFT)
         self.entry.pack(side=tk.LEFT, padx=(4, 0))
         self.frame.pack(side=tk.LEFT, padx=(6, 6))
+        self.mode_box.pack(side=tk.LEFT)
+        self.weight_frame.pack(side=tk.LEFT)
+        for entry in self.weight_entries:
+            entry.pack(side=tk.LEFT, padx=(0, 2))
 
     def set(self, value: Optional[int] = 0, state: str = tk.DISABLED):
         """Set value and state of widgets"""
@@ -101,6 +181,48 @@ class ThresholdUI(tk.Frame):
                 state = tk.DISABLED
             self.entry.config(state=state)
             self.slider.config(state=state)
+            self.mode_box.config(state='readonly' if state == tk.NORMAL else state)
+            self.set_weight_state()
+
+    def set_weight_state(self):
+        """Weights can only be edited while the Weighted RGB mode is in use"""
+        state = tk.NORMAL if self.enable.get() == 1 and self.mode.get() == 'Weighted RGB' else tk.DISABLED
+        for entry in self.weight_entries:
+            entry.config(state=state)
+
+    def show_weights(self):
+        """Write self.weights into the weight entries"""
+        for entry, weight in zip(self.weight_entries, self.weights):
+            state = entry.cget('state')
+            entry.config(state=tk.NORMAL)
+            entry.delete(0, 'end')
+            entry.insert(0, '{:g}'.format(weight))
+            entry.config(state=state)
+
+    def set_weights(self, weights: Optional[Sequence[float]]):
+        """Use weights for the Weighted RGB mode, DEFAULT_WEIGHTS if None"""
+        self.weights = tuple(float(w) for w in weights) if weights is not None else DEFAULT_WEIGHTS
+        self.show_weights()
+
+    def weights_callback(self, event=None):
+        """Recompute distance image with the weights in the entries"""
+        app = self.master
+
+        try:
+            weights = parse_weights(','.join(entry.get() for entry in self.weight_entries))
+        except ValueError as e:
+            if self.verbose or self.debug:
+                print('Weights:\t', e)
+            self.show_weights()
+            return
+        if weights == tuple(self.weights):
+            return
+        self.set_weights(weights)
+        if self.verbose or self.debug:
+            print('Weights:\t', list(self.weights))
+        if self.mode.get() == 'Weighted RGB':
+            app.preview('distance')
+            app.refresh('distance')
 
     def clear(self):
         """Reset widgets to default state"""
@@ -113,70 +235,165 @@ class ThresholdUI(tk.Frame):
         if self.enable.get() == 1:
             self.slider.config(state=tk.NORMAL)
             self.entry.config(state=tk.NORMAL)
-            self.make_distance_img()
-            self.process()
+            self.mode_box.config(state='readonly')
+            self.set_weight_state()
+            app.preview('distance')
+            app.refresh('distance')
         else:
             self.slider.config(state=tk.DISABLED)
             self.entry.config(state=tk.DISABLED)
-            if app.median.enable.get() == 1:
-                # process_median()
-                pass
-            else:
-                app.img = app.open.img
-                self.make_distance_img()
-            app.canvas.update_img(app.img)
+            self.mode_box.config(state=tk.DISABLED)
+            self.set_weight_state()
+            app.refresh('display')
+
+    def mode_callback(self, event=None):
+        """Recompute distance image in the selected mode"""
+        app = self.master
+
+        if self.debug:
+            print('Distance Mode:', self.mode.get())
+        self.set_weight_state()
+        app.preview('distance')
+        app.refresh('distance')
 
     def slider_callback(self, value: str):
-        """Updates value displayed in Entry"""
+        """Updates value displayed in Entry, Percent and preview while dragging"""
+        app = self.master
+
         self.entry.delete(0, 'end')
         self.entry.insert(0, f'{float(value):.2f}')
+        if self.enable.get() == 1:
+            # Use the same rounding as slider_released so the number doesn't jump on release
+            cutoff = round(float(value), 2)
+            self.update_percent(cutoff)
+            if not self.scrub(cutoff):
+                app.preview('threshold')
+
+    def update_percent(self, threshold: float) -> Optional[float]:
+        """Show percent for threshold using the cached histogram (no full image pass)"""
+        app = self.master
+
+        if self.hist.size == 0:
+            return None
+        percent = pipeline.histogram_percent(self.hist, threshold)
+        app.percent.label[1].config(text=str(round(percent, 2)) + ' %')
+        app.regions.show_percent(threshold)
+        return percent
 
     def slider_released(self, event):
         """Process image using new value"""
+        app = self.master
+
         self.var.set(round(self.var.get(), 2))
         if self.debug:
             print("Slider Release:", event)
             print("Released value = " + str(self.var.get()))
-        self.process()
+        if self.current(self.var.get()):
+            # Mask was already updated in place while dragging
+            return
+        app.refresh('threshold')
 
-    def process(self):
-        """Preforms Thresholding and calculates Percent"""
+    def current(self, cutoff: float) -> bool:
+        """thresh_img is the full resolution mask of cutoff and nothing running will replace it"""
         app = self.master
 
-        threshold = self.var.get()
+        return (self.thresh_img.size > 0 and not app.jobs.busy and not app.classes.active()
+                and pipeline.threshold_level(self.cutoff) == pipeline.threshold_level(cutoff))
 
-        if self.verbose or self.debug:
-            print('Threshold:\t', threshold)
-        app.set_busy_state(True)
+    def scrub(self, cutoff: float) -> bool:
+        """Move thresh_img to cutoff in place, flipping only pixels between the old and new level.
+        False if the mask can't be updated or a full threshold would be cheaper."""
+        app = self.master
 
-        img_n = self.dist_img / 255.0
-        self.thresh_img = img_n >= threshold
-        percent = self.thresh_img.sum() / self.thresh_img.size * 100.0
-        if self.verbose or self.debug:
-            print('\t\t', 'Percent =', percent)
-        app.percent.label[1].config(text=str(round(percent, 2)) + ' %')
-        app.canvas.update_img(self.thresh_img)
+        if self.levels is None or not self.current(self.cutoff) or self.levels.shape != self.thresh_img.shape:
+            return False
+        old_level = pipeline.threshold_level(self.cutoff)
+        new_level = pipeline.threshold_level(cutoff)
+        count = self.levels.count(min(old_level, new_level), max(old_level, new_level))
+        if count > min(self.thresh_img.size * SCRUB_FRACTION, SCRUB_PIXELS):
+            return False
 
-        app.set_busy_state(False)
+        with trace.span('scrub', log=False, cutoff=cutoff, pixels=count):
+            # The mask is only ever written here, on the Tk thread
+            changed = self.levels.update(self.thresh_img, old_level, new_level)
+            self.cutoff = cutoff
+            if len(changed):
+                app.grains.reset()
+            app.canvas.update_pixels(self.thresh_img, changed)
+        return True
 
-    def make_distance_img(self):
-        """Calculate RGB distance to be thresholded"""
-        # Add an enum for different color spaces as input arg!!!
-        app = self.master
+    def process(self, job: Job, dist_img: np.array, threshold: float) -> PackedMask:
+        """Preforms Thresholding (runs on worker thread)"""
+        with trace.span('threshold', cutoff=threshold) as span:
+            job.step('Mask')
+            # Full resolution mask is only needed for display, packed it takes 1/8 of a bool mask
+            return span.result(pipeline.threshold_packed(dist_img, threshold))
 
-        # get rgb value from entry
-        color = list()
-        for rgb in app.color.rgb[:]:
-            color.append(int(rgb.entry.get()))
-        # print(color)
-        if self.verbose or self.debug:
-            print('RGB Distance:\t', color)
-        app.set_busy_state(True)
-        r = app.img[:, :, 0].astype(int) - color[0]
-        g = app.img[:, :, 1].astype(int) - color[1]
-        b = app.img[:, :, 2].astype(int) - color[2]
-        self.dist_img = 255.0 - ((r * r + g * g + b * b) ** 0.5) / (3 ** 0.5)
+    def make_distance_img(self, job: Job, img: np.array, color: List[int], mode: str = 'RGB',
+                          weights: Optional[Sequence[float]] = None) -> Tuple[np.array, np.array]:
+        """Calculate distance in mode and its histogram (runs on worker thread)"""
+        key = pipeline.distance_key(color, mode, weights)
+        dist_img = self.disk.get(img, key)
+        if dist_img is None:
+            palette = self.get_palette(img, job)
+            converted = None
+            if palette is None:
+                converted = self.converted(img, mode, job)
+            with trace.span('distance', mode=mode, color=list(color), palette=palette is not None) as span:
+                job.step('Distance')
+                dist_img = span.result(pipeline.distance(img, color, palette=palette, progress=job.progress,
+                                                         mode=mode, weights=weights, converted=converted))
+            self.disk.put(img, key, dist_img)
+        return dist_img, pipeline.histogram(dist_img)
+
+    def make_level_index(self, job: Job, dist_img: np.array) -> Optional[LevelIndex]:
+        """Index of dist_img pixels by level for scrubbing (runs on worker thread), None without memory for it"""
+        if self.store is not None and self.store.headroom() < dist_img.size * 4:
+            return None
+        with trace.span('level-index') as span:
+            job.step('Index')
+            return span.result(LevelIndex(dist_img, progress=job.progress))
+
+    def converted(self, img: np.array, mode: str, job: Optional[Job] = None) -> Optional[np.array]:
+        """img in the color space of mode, converted once and cached (None if mode needs no conversion)"""
+        if mode not in SPACES:
+            return None
+        result = self.conversions.get(img, mode)
+        if result is None:
+            with trace.span('convert', space=mode) as span:
+                if job is not None:
+                    job.step(mode)
+                result = self.conversions.put(img, mode, span.result(
+                    convert(img, mode, progress=job.progress if job else None)))
+        return result
+
+    def index_img(self, img: np.array):
+        """Build palette index for img on an idle worker, so new colors only pay for a gather"""
+        if self.palettes.get(img, 'palette', touch=False) is None and id(img) not in self.pending:
+            self.pending = {id(img): self.executor.submit(self._index, img)}
+
+    def get_palette(self, img: np.array, job: Optional[Job] = None) -> Optional[Palette]:
+        """Palette of img from cache, the idle worker, or built now"""
+        palette = self.palettes.get(img, 'palette')
+        if palette is None:
+            future = self.pending.pop(id(img), None)
+            if future is not None and not future.cancelled():
+                palette = wait(future, job)
+            else:
+                if job is not None:
+                    job.step('Palette')
+                palette = self._index(img, job.progress if job is not None else None)
+        return palette or None
 
-        self.dist_img = self.dist_img.astype(np.uint8)
+    def _index(self, img: np.array, progress: Optional[Callable[[float], None]] = None):
+        with trace.span('palette') as span:
+            palette = span.result(Palette.build(img, progress=progress))
+            # Too many colors means the full image distance is used
+            span.set(colors=len(palette) if palette is not None else 'too many')
+        return self.palettes.put(img, 'palette', palette or False)
 
-        app.set_busy_state(False)
+    def shutdown(self):
+        """Stop worker thread"""
+        for future in self.pending.values():
+            future.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+# # Tiled # #
+# Out-of-core version of the pipeline for images larger than RAM.
+# The image is read tile by tile from a memory-mapped array, each tile is
+# median filtered with a halo of size // 2 pixels so the result matches the
+# full image filter, then distance and threshold are applied. The percent is
+# accumulated from per tile histograms and the mask can be written to a
+# memory-mapped .npy file, so peak memory only depends on the tile size.
+
+# # Imports # #
+from typing import Optional, Sequence, Callable, Tuple
+import numpy as np
+
+from . import pipeline
+
+TILE = 2048  # Default tile height and width
+
+
+class ArrayReader:
+    """Reads tiles from an in-memory or memory-mapped array"""
+    img: np.array
+
+    def __init__(self, img: np.array):
+        self.img = img
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.img.shape
+
+    def read(self, y0: int, y1: int, x0: int, x1: int) -> np.array:
+        """RGB pixels of rows y0:y1 and columns x0:x1 as a uint8 array in memory"""
+        return np.ascontiguousarray(self.img[y0:y1, x0:x1, :3])
+
+
+def open_image(filename: str) -> ArrayReader:
+    """Tile reader for filename, .npy files are memory-mapped instead of loaded"""
+    if filename.lower().endswith('.npy'):
+        arr = np.load(filename, mmap_mode='r')
+        if arr.dtype == np.uint8 and arr.ndim == 3 and arr.shape[2] in (3, 4):
+            return ArrayReader(arr)
+        # Other arrays are converted (or rejected) like any loaded image
+    # Compressed formats have to be decoded in one piece
+    return ArrayReader(pipeline.load_image(filename))
+
+
+def tiles(height: int, width: int, tile: int = TILE):
+    """(y0, y1, x0, x1) of every tile in row major order"""
+    for y0 in range(0, height, tile):
+        for x0 in range(0, width, tile):
+            yield y0, min(y0 + tile, height), x0, min(x0 + tile, width)
+
+
+def process(reader: ArrayReader, color: Sequence[int], cutoff: float, size: Optional[int] = None,
+            tile: int = TILE, mask_path: Optional[str] = None,
+            progress: Optional[Callable[[float], None]] = None,
+            mode: str = 'RGB', weights: Optional[Sequence[float]] = None) -> Tuple[float, np.array]:
+    """Run the pipeline tile by tile, returns percent and cumulative distance histogram"""
+    height, width = reader.shape[0], reader.shape[1]
+    halo = size // 2 if size else 0
+
+    mask = None
+    if mask_path is not None:
+        mask = np.lib.format.open_memmap(mask_path, mode='w+', dtype=bool, shape=(height, width))
+
+    counts = np.zeros(256, dtype=np.int64)
+    dist_img = np.empty((tile, tile), dtype=np.uint8)
+    level = pipeline.threshold_level(cutoff)
+    n_tiles = -(-height // tile) * -(-width // tile)
+
+    for i, (y0, y1, x0, x1) in enumerate(tiles(height, width, tile)):
+        # Read tile plus halo, the halo is cropped again after filtering
+        hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, height)
+        hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, width)
+        img = reader.read(hy0, hy1, hx0, hx1)
+        if size:
+            img = pipeline.median(img, size)
+        img = img[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+
+        dist = pipeline.distance(img, color, out=dist_img[:y1 - y0, :x1 - x0], mode=mode, weights=weights)
+        counts += np.bincount(dist.ravel(), minlength=256)
+        if mask is not None:
+            np.greater_equal(dist, level, out=mask[y0:y1, x0:x1])
+
+        if progress is not None:
+            progress((i + 1) / n_tiles)
+
+    if mask is not None:
+        mask.flush()
+        del mask
+
+    hist = np.zeros(257, dtype=np.int64)
+    hist[:256] = np.cumsum(counts[::-1])[::-1]
+    return pipeline.histogram_percent(hist, cutoff), hist
+
+
+def process_file(filename: str, color: Sequence[int], cutoff: float, size: Optional[int] = None,
+                 tile: int = TILE, mask_path: Optional[str] = None,
+                 mode: str = 'RGB', weights: Optional[Sequence[float]] = None) -> float:
+    """Run the tiled pipeline on an image file and return the percent"""
+    return process(open_image(filename), color, cutoff, size, tile, mask_path, mode=mode, weights=weights)[0]
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+# # Trace # #
+# Lightweight instrumentation of pipeline stages. Code wraps a stage in
+# `with trace.span('median', size=3) as s:` and attaches its result with
+# s.result(img), which records the image shape and bytes produced. That is
+# the size of the result only, memory allocated for temporaries while the
+# stage ran is not measured here (the benchmarks record peak memory per
+# stage). Finished spans go into a ring buffer shared by all threads, so the
+# last few thousand stages of a session can be inspected in the debug panel or exported as a
+# Chrome trace (chrome://tracing, Perfetto) to see where interactive latency
+# goes. Recording a span costs a few microseconds, spans are always on.
+
+# # Imports # #
+from typing import Optional, Any, Dict, List
+import os
+import json
+import threading
+from time import perf_counter
+from collections import deque
+from contextlib import contextmanager
+
+RING_SIZE = 10000  # Spans kept
+
+
+class Span:
+    """One timed stage"""
+    name: str
+    start: float  # perf_counter() at start
+    duration: float  # Seconds
+    thread: str  # Name of the thread it ran on
+    thread_id: int
+    log: bool  # Printed in verbose mode, frequent spans like redraws are only printed in debug mode
+    args: Dict[str, Any]  # Parameters, shape and nbytes of the result (not bytes allocated while running)
+
+    def __init__(self, name: str, args: Dict[str, Any], log: bool = True):
+        self.name = name
+        self.log = log
+        self.args = args
+        self.start = perf_counter()
+        self.duration = 0.0
+        current = threading.current_thread()
+        self.thread = current.name
+        self.thread_id = current.ident
+
+    def result(self, value: Any) -> Any:
+        """Record shape and bytes of an array (or anything with nbytes) produced by the stage"""
+        if hasattr(value, 'shape'):
+            self.args['shape'] = tuple(int(n) for n in value.shape)
+        if hasattr(value, 'nbytes'):
+            self.args['nbytes'] = int(value.nbytes)
+        return value
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __str__(self) -> str:
+        text = '{:.1f} ms'.format(self.duration * 1000)
+        for key, value in self.args.items():
+            if key == 'nbytes':
+                value = '{:.1f} MB'.format(value / 2 ** 20)
+            text += ' {}={}'.format(key, value)
+        return text
+
+
+class Tracer:
+    """Ring buffer of finished spans from every thread"""
+    verbose: bool  # Print spans that log when they finish
+    debug: bool  # Print every span
+    spans: deque
+    count: int  # Spans recorded since start, including ones pushed out of the ring
+    origin: float  # perf_counter() at start, trace timestamps are relative to it
+
+    def __init__(self, capacity: int = RING_SIZE, verbose: bool = False, debug: bool = False):
+        self.verbose = verbose
+        self.debug = debug
+        self.spans = deque(maxlen=capacity)
+        self.count = 0
+        self.origin = perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, log: bool = True, **args):
+        """Time the body as stage name, args are stored with it"""
+        span = Span(name, args, log)
+        try:
+            yield span
+        finally:
+            span.duration = perf_counter() - span.start
+            self.record(span)
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            self.count += 1
+        if self.debug or (self.verbose and span.log):
+            print(span.name.capitalize() + ':\t', span)
+
+    def recent(self, n: Optional[int] = None) -> List[Span]:
+        """Last n spans (all kept by default), oldest first"""
+        with self._lock:
+            spans = list(self.spans)
+        return spans if n is None else spans[-n:]
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and largest duration in seconds per stage name"""
+        summary = {}
+        for span in self.recent():
+            entry = summary.setdefault(span.name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += span.duration
+            entry['max'] = max(entry['max'], span.duration)
+        return summary
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Spans in the Chrome trace event format"""
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in self.recent():
+            threads[span.thread_id] = span.thread
+            events.append({
+                'name': span.name,
+                'cat': 'stage',
+                'ph': 'X',
+                'ts': (span.start - self.origin) * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': {key: list(value) if isinstance(value, tuple) else value
+                         for key, value in span.args.items()},
+            })
+        for thread_id, thread in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                           'args': {'name': thread}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, filename: str):
+        """Write spans as Chrome trace JSON"""
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+
+TRACER = Tracer()  # Tracer of the application
+span = TRACER.span
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+# # Imports # #
+from typing import Optional
+import tkinter as tk
+from tkinter import ttk
+from tkinter import filedialog as fd
+
+from .trace import Tracer, TRACER
+
+REFRESH_MS = 500  # How often new spans are shown
+ROWS = 200  # Most recent spans listed
+
+
+class TraceUI(tk.Toplevel):
+    """Debug window listing recent stage spans, with a per stage summary and Chrome trace export"""
+    tracer: Tracer
+    shown: int  # tracer.count when the table was last filled
+    after_id: Optional[str]  # Scheduled refresh, cancelled when the window is closed
+
+    summary: ttk.Treeview  # Count, total and slowest per stage
+    table: ttk.Treeview  # Recent spans, newest first
+    clear_button: ttk.Button  # Forget recorded spans
+    export_button: ttk.Button  # Save Chrome trace JSON
+
+    def __init__(self, master: Optional[tk.Misc] = None, tracer: Tracer = TRACER):
+        super().__init__(master)
+        self.title('Trace')
+        self.tracer = tracer
+        self.shown = -1
+        self.after_id = None
+
+        self.summary = ttk.Treeview(
+            self,
+            columns=('stage', 'count', 'total', 'max'),
+            show='headings',
+            height=8
+        )
+        for column, text, width in (('stage', 'Stage', 100), ('count', 'Count', 60),
+                                    ('total', 'Total ms', 90), ('max', 'Slowest ms', 90)):
+            self.summary.heading(column, text=text)
+            self.summary.column(column, width=width)
+
+        self.table = ttk.Treeview(
+            self,
+            columns=('stage', 'ms', 'thread', 'details'),
+            show='headings',
+            height=16
+        )
+        for column, text, width in (('stage', 'Stage', 100), ('ms', 'ms', 70),
+                                    ('thread', 'Thread', 110), ('details', 'Details', 380)):
+            self.table.heading(column, text=text)
+            self.table.column(column, width=width)
+
+        self.clear_button = ttk.Button(
+            self,
+            text='Clear',
+            command=self.clear
+        )
+        self.export_button = ttk.Button(
+            self,
+            text='Export Chrome Trace',
+            command=self.export
+        )
+
+        self.summary.grid(column=0, row=0, columnspan=2, padx=6, pady=(6, 0), sticky=tk.EW)
+        self.table.grid(column=0, row=1, columnspan=2, padx=6, pady=(6, 0), sticky=tk.NSEW)
+        self.clear_button.grid(column=0, row=2, padx=6, pady=6, sticky=tk.W)
+        self.export_button.grid(column=1, row=2, padx=6, pady=6, sticky=tk.E)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        self.refresh()
+
+    def refresh(self):
+        """Show spans recorded since the last refresh, runs every REFRESH_MS while open"""
+        if self.tracer.count != self.shown:
+            self.shown = self.tracer.count
+            self.summary.delete(*self.summary.get_children())
+            for name, entry in sorted(self.tracer.summary().items(), key=lambda item: -item[1]['total']):
+                self.summary.insert('', tk.END, values=(name, entry['count'], round(entry['total'] * 1000, 1),
+                                                        round(entry['max'] * 1000, 1)))
+            self.table.delete(*self.table.get_children())
+            for span in reversed(self.tracer.recent(ROWS)):
+                details = ' '.join('{}={}'.format(key, value) for key, value in span.args.items())
+                self.table.insert('', tk.END, values=(span.name, round(span.duration * 1000, 1), span.thread,
+                                                      details))
+        self.after_id = self.after(REFRESH_MS, self.refresh)
+
+    def destroy(self):
+        """Stop refreshing before the widgets are gone"""
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+        super().destroy()
+
+    def clear(self):
+        self.tracer.clear()
+        self.shown = -1
+
+    def export(self):
+        """Ask for a file and write the spans as Chrome trace JSON"""
+        filename = fd.asksaveasfilename(
+            parent=self,
+            title='Export trace',
+            defaultextension='.json',
+            filetypes=(('Chrome Trace', '*.json'), ('All files', '*.*'))
+        )
+        if filename:
+            self.tracer.export(filename)
@@ -0,0 +1,3 @@
+#!/usr/bin/python
+
+# Benchmark suite, run with: python -m benchmarks.run --help
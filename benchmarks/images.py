@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+# # Images # #
+# Synthetic XRF-like scans for benchmarking. A map is made of a handful of
+# mineral phases: a coarse random grid of phases is blown up with nearest
+# neighbor scaling, so phases form blocky grains of a few hundred pixels like
+# element maps do. Every phase has its own color. 'few' images use exactly
+# those colors (the palette path), 'many' images add per-pixel noise so
+# almost every pixel has its own color (the full image path). The same seed
+# always gives the same image.
+
+# # Imports # #
+from typing import Tuple
+import numpy as np
+
+PHASES = 8  # Number of mineral phases
+GRAIN = 64  # Size of a grain of the phase grid in pixels
+NOISE = 24  # Largest noise added to each channel of 'many' images
+CHUNK_ROWS = 1024  # Rows generated at a time, bounds the scratch memory
+KINDS = ('few', 'many')
+
+
+def shape_for(megapixels: float) -> Tuple[int, int]:
+    """Height and width of a 4:3 image with about that many megapixels"""
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    return height, int(round(height * 4 / 3))
+
+
+def phase_colors(seed: int = 0) -> np.array:
+    """PHASES x 3 uint8 phase colors"""
+    return np.random.default_rng(seed).integers(0, 256, (PHASES, 3), dtype=np.uint8)
+
+
+def xrf_image(megapixels: float, kind: str = 'few', seed: int = 0) -> np.array:
+    """Height x Width x 3 uint8 synthetic scan, kind is 'few' or 'many' colors"""
+    if kind not in KINDS:
+        raise ValueError('unknown image kind: ' + str(kind))
+    rng = np.random.default_rng(seed)
+    height, width = shape_for(megapixels)
+    grid = rng.integers(0, PHASES, (height // GRAIN + 1, width // GRAIN + 1), dtype=np.uint8)
+    colors = phase_colors(seed)
+    cols = np.arange(width) // GRAIN
+
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    for y0 in range(0, height, CHUNK_ROWS):
+        y1 = min(y0 + CHUNK_ROWS, height)
+        phases = grid[np.arange(y0, y1) // GRAIN][:, cols]
+        np.take(colors, phases, axis=0, out=img[y0:y1])
+        if kind == 'many':
+            noise = rng.integers(-NOISE, NOISE + 1, (y1 - y0, width, 3), dtype=np.int16)
+            noise += img[y0:y1]
+            np.clip(noise, 0, 255, out=noise)
+            img[y0:y1] = noise
+    return img
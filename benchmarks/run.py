@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+# # Run # #
+# Times every stage on every synthetic image and writes wall time and peak
+# memory to JSON. Wall time is the best of --repeat runs. Peak memory is the
+# largest amount allocated through Python and NumPy during one extra run
+# under tracemalloc (decoder internals of Pillow are not included). Results
+# are compared with a stored baseline and the exit status is 1 if any stage
+# got slower or bigger than the tolerance allows.
+#
+#   python -m benchmarks.run --sizes 1,16 --save      # record a baseline
+#   python -m benchmarks.run --sizes 1,16             # compare against it
+
+# # Imports # #
+from typing import Dict, List, Optional
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+from benchmarks.images import xrf_image, shape_for, KINDS
+from benchmarks.stages import Case, stages
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+TOLERANCE = 0.25  # Allowed slowdown or growth before a stage counts as a regression
+MIN_SECONDS = 0.005  # Stages faster than this are timer noise and never fail
+MIN_BYTES = 1 << 20  # Same for memory
+
+
+def measure(run, repeat: int = 3) -> Dict[str, float]:
+    """Best wall time of repeat runs and peak traced memory of one more run"""
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        run()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': max(0, peak)}
+
+
+def run_all(sizes: List[float], kinds: List[str], only: Optional[List[str]] = None,
+            repeat: int = 3, verbose: bool = True) -> Dict[str, Dict[str, float]]:
+    """Results by 'size/kind/stage'"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for kind in kinds:
+                height, width = shape_for(size)
+                if verbose:
+                    print('Benchmark:\t', size, 'MP', kind, 'colors', (height, width))
+                case = Case(xrf_image(size, kind), directory)
+                for name, prepare, run in stages(case):
+                    if only and not any(name.startswith(prefix) for prefix in only):
+                        continue
+                    if prepare is not None:
+                        prepare()
+                    key = '{}MP/{}/{}'.format(size, kind, name)
+                    results[key] = measure(run, repeat)
+                    if verbose:
+                        print('\t\t', '{:<16}'.format(name), '{:9.1f} ms'.format(results[key]['seconds'] * 1000),
+                              '{:9.1f} MB'.format(results[key]['peak_bytes'] / 2 ** 20))
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float = TOLERANCE) -> List[str]:
+    """Regressions of results against baseline, one line each"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, floor in (('seconds', MIN_SECONDS), ('peak_bytes', MIN_BYTES)):
+            if max(result[metric], base[metric]) < floor:
+                continue
+            ratio = result[metric] / max(base[metric], 1e-12)
+            if ratio > 1 + tolerance:
+                regressions.append('{} {}: {:.3g} -> {:.3g} ({:+.0f}%)'.format(
+                    key, metric, base[metric], result[metric], (ratio - 1) * 100))
+    return regressions
+
+
+def environment() -> Dict[str, str]:
+    """Machine description stored with the results, baselines only compare on the same machine"""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': str(os.cpu_count()),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on synthetic scans')
+    parser.add_argument('--sizes', metavar='MP,...', default='1',
+                        help='image sizes in megapixels, e.g. 1,16,64,256 (default %(default)s)')
+    parser.add_argument('--kinds', metavar='KIND,...', default=','.join(KINDS),
+                        help='few and/or many colors (default %(default)s)')
+    parser.add_argument('--stages', metavar='NAME,...',
+                        help='only run stages starting with these names, e.g. median,distance')
+    parser.add_argument('--repeat', metavar='N', type=int, default=3,
+                        help='timed runs per stage, the best counts (default %(default)s)')
+    parser.add_argument('--output', metavar='JSON', help='write results to JSON')
+    parser.add_argument('--baseline', metavar='JSON', default=BASELINE,
+                        help='baseline to compare with (default benchmarks/baseline.json)')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', metavar='T', type=float, default=TOLERANCE,
+                        help='allowed slowdown or memory growth as a fraction (default %(default)s)')
+    parser.add_argument('--quiet', action='store_true', help='only print regressions')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    sizes = [float(size) if '.' in size else int(size) for size in args.sizes.split(',')]
+    kinds = args.kinds.split(',')
+    only = args.stages.split(',') if args.stages else None
+
+    results = run_all(sizes, kinds, only, args.repeat, verbose=not args.quiet)
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save:
+        # Keep baseline entries of sizes and stages that were not run this time
+        baseline = {'environment': report['environment'], 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline['results'] = json.load(f)['results']
+        baseline['results'].update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline:\t', 'Wrote', args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('Baseline:\t', 'None found, run with --save to record one')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != report['environment']:
+        print('Baseline:\t', 'Recorded on a different machine, times may not compare')
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for line in regressions:
+        print('Regression:\t', line)
+    if not regressions:
+        print('Baseline:\t', 'No regressions in', len(results), 'results')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
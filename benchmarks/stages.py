@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+
+# # Stages # #
+# Every pipeline stage as a function of one synthetic image, without Tk.
+# Each stage runs the same engine code the GUI runs for it: the distance
+# stage is what ThresholdUI.make_distance_img does once the palette index is
+# cached, overlay is the compositor behind OverlayUI.add_overlay, render is
+# the pyramid view that replaced the canvas scale_image, and get-color is the
+# disk sampler behind ImgCanvas.get_color and scrub is one slider step of
+# ThresholdUI.scrub there and back. disk-load is what a distance image stored
+# by an earlier session costs instead. Inputs a stage needs (distance image,
+# mask, palette, ...) are computed once and are not part of its time.
+
+# # Imports # #
+from typing import Callable, List, Tuple, Any, Optional
+import os
+import numpy as np
+from PIL import Image
+
+from GcCP import pipeline, loader, classify, components, regions
+from GcCP.palette import Palette
+from GcCP.pyramid import Pyramid
+from GcCP.composite import Compositor
+from GcCP.sampling import DiskSampler
+from GcCP.level_index import LevelIndex
+from GcCP.color_space import convert
+from GcCP.disk_cache import DiskCache
+
+MEDIAN_SIZES = (3, 5, 7, 9, 11, 13)  # Sizes offered by MedianUI
+COLOR = (200, 120, 40)  # Reference color
+CUTOFF = 0.6  # Threshold cutoff
+VIEW = 1000  # Canvas side for render
+DISKS = 20  # Selections per get-color run
+RADIUS = 25  # Selection radius
+
+
+class Case:
+    """One synthetic image and the inputs its stages need"""
+    img: np.array
+    directory: str  # Where the encoded copies are written
+
+    def __init__(self, img: np.array, directory: str):
+        self.img = img
+        self.directory = directory
+        self._inputs = {}
+
+    def input(self, name: str, make: Callable[[], Any]) -> Any:
+        """Input of a stage, made on first use"""
+        if name not in self._inputs:
+            self._inputs[name] = make()
+        return self._inputs[name]
+
+    def path(self, extension: str) -> str:
+        """File with the image encoded in the format of extension"""
+        def write():
+            path = os.path.join(self.directory, 'bench' + extension)
+            options = {'quality': 90} if extension == '.jpg' else {}
+            Image.fromarray(self.img).save(path, **options)
+            return path
+        return self.input(extension, write)
+
+    @property
+    def palette(self):
+        return self.input('palette', lambda: Palette.build(self.img))
+
+    @property
+    def dist_img(self) -> np.array:
+        return self.input('dist', lambda: pipeline.distance(self.img, COLOR, palette=self.palette))
+
+    @property
+    def mask(self) -> np.array:
+        return self.input('mask', lambda: pipeline.threshold(self.dist_img, CUTOFF))
+
+    @property
+    def packed(self):
+        return self.input('packed', lambda: pipeline.threshold_packed(self.dist_img, CUTOFF))
+
+    @property
+    def labels(self):
+        return self.input('labels', lambda: _regions(self))
+
+
+def _make_distance_img(case: Case):
+    dist_img = pipeline.distance(case.img, COLOR, palette=case.palette)
+    return dist_img, pipeline.histogram(dist_img)
+
+
+def _get_color(case: Case):
+    height, width = case.img.shape[:2]
+    rng = np.random.default_rng(0)
+    # A new image gets a new sampler, so building it is part of the first selection
+    sampler = DiskSampler(case.img)
+    for x, y in zip(rng.integers(0, width, DISKS), rng.integers(0, height, DISKS)):
+        sampler.mean(int(x), int(y), RADIUS)
+
+
+def _render(case: Case):
+    pyramid = case.input('pyramid', lambda: Pyramid(case.img))
+    height, width = case.img.shape[:2]
+    scale = min(1.0, VIEW / max(height, width))
+    return pyramid.render(0, 0, scale, int(width * scale), int(height * scale))
+
+
+def _scrub_inputs(case: Case):
+    """Packed mask at CUTOFF with a built display pyramid, and the level index"""
+    def make():
+        mask = pipeline.threshold_packed(case.dist_img, CUTOFF)
+        pyramid = Pyramid(mask)
+        pyramid.level(16)
+        return LevelIndex(case.dist_img), mask, pyramid
+    return case.input('scrub', make)
+
+
+def _scrub(case: Case):
+    index, mask, pyramid = _scrub_inputs(case)
+    level = pipeline.threshold_level(CUTOFF)
+    for old_level, new_level in ((level, level + 2), (level + 2, level)):
+        pyramid.update(index.update(mask, old_level, new_level))
+
+
+def _regions(case: Case) -> regions.RegionLabels:
+    """A rectangle, an ellipse and a polygon covering most of the image"""
+    height, width = case.img.shape[:2]
+    return regions.rasterize([
+        regions.Region('Rectangle', [(0.05 * width, 0.05 * height), (0.5 * width, 0.6 * height)]),
+        regions.Region('Ellipse', [(0.3 * width, 0.3 * height), (0.95 * width, 0.9 * height)]),
+        regions.Region('Polygon', [(0.1 * width, 0.95 * height), (0.5 * width, 0.4 * height),
+                                   (0.9 * width, 0.95 * height)]),
+    ], case.img.shape)
+
+
+def _disk(case: Case) -> DiskCache:
+    """Disk cache in the case directory that knows the image"""
+    def make():
+        disk = DiskCache(os.path.join(case.directory, 'cache'), 1 << 40, min_bytes=0)
+        disk.register(case.img, 'bench')
+        return disk
+    return case.input('disk', make)
+
+
+def _disk_load(case: Case):
+    """Distance image from the disk cache and its histogram, what a reopened file costs instead of distance"""
+    return pipeline.histogram(_disk(case).get(case.img, pipeline.distance_key(COLOR)))
+
+
+def _overlay(case: Case):
+    out = case.input('out', lambda: np.empty_like(case.img))
+    return Compositor().mask(case.img, case.mask, out=out)
+
+
+def stages(case: Case) -> List[Tuple[str, Optional[Callable[[], Any]], Callable[[], Any]]]:
+    """(name, prepare, run) of every stage in pipeline order, prepare makes the inputs and is not timed"""
+    result = [
+        ('load-png', lambda: case.path('.png'), lambda: loader.load(case.path('.png'))),
+        ('load-jpeg', lambda: case.path('.jpg'), lambda: loader.load(case.path('.jpg'))),
+    ]
+    for size in MEDIAN_SIZES:
+        result.append(('median-' + str(size), None, lambda size=size: pipeline.median(case.img, size)))
+    result += [
+        ('palette', None, lambda: Palette.build(case.img)),
+        ('distance', lambda: case.palette, lambda: _make_distance_img(case)),
+        ('distance-full', None, lambda: pipeline.distance(case.img, COLOR)),
+        ('convert-lab', None, lambda: convert(case.img, 'Lab')),
+        ('threshold', lambda: case.dist_img, lambda: pipeline.threshold(case.dist_img, CUTOFF)),
+        ('threshold-packed', lambda: case.dist_img, lambda: pipeline.threshold_packed(case.dist_img, CUTOFF)),
+        ('percent-packed', lambda: case.packed, lambda: pipeline.percent(case.packed)),
+        ('disk-store', lambda: (_disk(case), case.dist_img),
+         lambda: _disk(case).put(case.img, pipeline.distance_key(COLOR), case.dist_img)),
+        ('disk-load', lambda: _disk(case).put(case.img, pipeline.distance_key(COLOR), case.dist_img),
+         lambda: _disk_load(case)),
+        ('level-index', lambda: case.dist_img, lambda: LevelIndex(case.dist_img)),
+        ('scrub', lambda: _scrub_inputs(case), lambda: _scrub(case)),
+        ('overlay', lambda: case.mask, lambda: _overlay(case)),
+        ('pyramid', None, lambda: Pyramid(case.img).level(16)),
+        ('render', lambda: case.input('pyramid', lambda: Pyramid(case.img)).level(16), lambda: _render(case)),
+        ('get-color', None, lambda: _get_color(case)),
+        ('grains', lambda: case.packed, lambda: components.analyze(case.packed, case.img)),
+        ('regions-raster', None, lambda: _regions(case)),
+        ('regions', lambda: (case.labels, case.dist_img),
+         lambda: regions.region_stats(case.labels, case.dist_img, case.img)),
+        ('classify', lambda: case.palette,
+         lambda: classify.classify(case.img, [COLOR, (40, 40, 40), (250, 250, 250)], CUTOFF, palette=case.palette)),
+    ]
+    return result
@@ -2,10 +2,23 @@
 
 # # Imports # #
 from typing import Optional
+import argparse
 import tkinter as tk
 import numpy as np
 
-from GcCP import ImgCanvas, Progress, Percent, ColorUI, OverlayUI, ThresholdUI, MedianUI, OpenUI
+from GcCP import ImgCanvas, Progress, Percent, Memory, ColorUI, OverlayUI, ThresholdUI, MedianUI, OpenUI, ClassUI, \
+    StackUI, GrainUI, RegionUI, TraceUI
+from GcCP import batch, pipeline, classify, trace
+from GcCP.cache import DEFAULT_BYTES
+from GcCP.store import ImageStore, DEFAULT_BUDGET, readonly
+from GcCP.disk_cache import DiskCache, DEFAULT_DIR, DEFAULT_DISK_BYTES
+from GcCP.jobs import JobScheduler, Job
+from GcCP.color_space import MODES
+from GcCP.image_canvas import VIEW_SIZE
+
+# Pipeline stages in order, a change to one invalidates all later ones
+STAGES = ('median', 'distance', 'threshold', 'display')
+PREVIEW_PIXELS = VIEW_SIZE * VIEW_SIZE  # Largest preview, about the canvas, so previews cost the same for any scan
 
 verbose = True
 debug = False
@@ -18,13 +31,30 @@ class ColorPicker(tk.Frame):
     thresh: ThresholdUI
     overlay: OverlayUI
     color: ColorUI
+    classes: ClassUI
+    stack: StackUI
+    grains: GrainUI
+    regions: RegionUI
     percent: Percent
     progress: Progress
+    memory: Memory
+    jobs: JobScheduler
+    trace_window: Optional[TraceUI]  # Open trace window, F12 raises it instead of opening another
 
     img: Optional[np.array]
-    scale_factor: float # why does this exist in ColorPicker. Maybe move to Canvas? Definitely for pan and zoom.
+    cache_bytes: int
+    store: ImageStore  # Memory budget shared by all caches
+    disk: DiskCache  # Intermediates kept on disk between sessions
+    job_stage: Optional[str]  # First stage of running job
+    rerun_stage: Optional[str]  # Stage to run again once running job is done
+
+    # Preview results, computed on the display level of the image while the user interacts
+    preview_source: Optional[np.array]  # Pyramid level of self.open.img
+    preview_img: Optional[np.array]  # Median filtered preview_source
+    preview_dist: np.array  # RGB distance of preview_img
 
-    def __init__(self, master=None):
+    def __init__(self, master=None, cache_bytes: int = DEFAULT_BYTES, memory_bytes: int = DEFAULT_BUDGET,
+                 disk: Optional[DiskCache] = None, weights: Optional[tuple] = None):
         # Initialize tk.Frame
         super().__init__(master)
         self.master = master
@@ -35,66 +65,369 @@ class ColorPicker(tk.Frame):
         # variables to be used
         # self.original_img = [] Not used anymore. Use self.open.img
         self.img = None
-        self.scale_factor = 1
+        self.cache_bytes = cache_bytes  # memory cap for each result cache
+        self.store = ImageStore(memory_bytes, verbose=verbose, debug=debug)
+        self.disk = disk if disk is not None else DiskCache(max_bytes=0)
+        self.job_stage = None
+        self.rerun_stage = None
+        self.preview_source = None
+        self.preview_img = None
+        self.preview_dist = np.empty(0)
+        self.trace_window = None
         # self.dist_img = []  # Move inside Threshold class?
         # self.thresh_img = []  # Move inside Threshold class?
 
         # Initialize widget objects
         self.create_widgets(self)
+        self.thresh.set_weights(weights)
+        self.track_memory()
+        self.master.bind('<F12>', self.show_trace)
+
+    def show_trace(self, event=None):
+        """Open the trace window, or bring the open one to the front"""
+        if self.trace_window is not None and self.trace_window.winfo_exists():
+            self.trace_window.deiconify()
+            self.trace_window.lift()
+            self.trace_window.focus_set()
+            return
+        self.trace_window = TraceUI(self.master)
 
     def create_widgets(self, master=None):
         # Creates all widget objects, then adds them to frame
-        self.canvas = ImgCanvas(master)
-        self.canvas.grid(column=2, row=0, rowspan=10)
+        self.canvas = ImgCanvas(master, verbose=verbose, debug=debug, cache_bytes=self.cache_bytes, store=self.store,
+                             disk=self.disk)
+        self.canvas.grid(column=2, row=0, rowspan=14)
 
-        self.open = OpenUI(master)
+        self.open = OpenUI(master, verbose=verbose, debug=debug)
         self.open.grid(column=0, row=0, columnspan=2)
 
-        self.median = MedianUI(master)
+        self.median = MedianUI(master, verbose=verbose, debug=debug, cache_bytes=self.cache_bytes, store=self.store,
+                               disk=self.disk)
         self.median.grid(column=0, row=1, columnspan=2)
 
-        self.thresh = ThresholdUI(master, verbose=True)
+        self.thresh = ThresholdUI(master, verbose=verbose, debug=debug, cache_bytes=self.cache_bytes,
+                                  store=self.store, disk=self.disk)
         self.thresh.grid(column=0, row=2, columnspan=2)
 
-        self.overlay = OverlayUI(master)
+        self.overlay = OverlayUI(master, verbose=verbose, debug=debug)
         self.overlay.grid(column=0, row=3)
 
-        self.color = ColorUI(master)
+        self.color = ColorUI(master, verbose=verbose, debug=debug)
         self.color.grid(column=0, row=4, columnspan=2, rowspan=3)
 
+        self.classes = ClassUI(master, verbose=verbose, debug=debug)
+        self.classes.grid(column=0, row=7, columnspan=2)
+
         self.percent = Percent(master)
         self.percent.grid(column=0, row=8, columnspan=2)
 
         self.progress = Progress(master)
         self.progress.grid(column=0, row=9)
 
-    def set_busy_state(self, busy=False):
-        if busy:
-            print('\t\t', 'Processing...')
-            self.progress.label.config(text="Processing...")
-            self.median.set(None, tk.DISABLED)
-            self.thresh.set(None, tk.DISABLED)
-            self.overlay.set(None, tk.DISABLED)
-            self.color.set(tk.DISABLED, tk.DISABLED)
+        self.stack = StackUI(master, verbose=verbose, debug=debug)
+        self.stack.grid(column=0, row=10, columnspan=2)
+
+        self.grains = GrainUI(master, verbose=verbose, debug=debug)
+        self.grains.grid(column=0, row=11, columnspan=2)
+
+        self.regions = RegionUI(master, verbose=verbose, debug=debug)
+        self.regions.grid(column=0, row=12, columnspan=2)
+
+        self.memory = Memory(master, self.store)
+        self.memory.grid(column=0, row=13, columnspan=2)
+
+        self.jobs = JobScheduler(master, self.progress.label, verbose=verbose, debug=debug)
+
+    def track_memory(self):
+        """Count current state of every stage in the memory report"""
+        self.store.track('source', lambda: [self.open.img])
+        self.store.track('median', lambda: [self.img])
+        self.store.track('distance', lambda: [self.thresh.dist_img, self.thresh.hist, self.thresh.levels])
+        self.store.track('threshold', lambda: [self.thresh.thresh_img])
+        self.store.track('classes', lambda: [self.classes.class_img])
+        self.store.track('grains', lambda: [self.grains.grains])
+        self.store.track('regions', lambda: [self.regions.labels, self.regions.stats])
+        self.store.track('preview', lambda: [self.preview_img, self.preview_dist])
+        self.store.track('display', lambda: list(self.canvas.buffers.values()) + [self.canvas.shown,
+                                                                                  self.canvas.sampler])
+
+    def refresh(self, stage: str = 'median'):
+        """Recompute the pipeline from stage on the worker thread, then redraw"""
+        if type(self.open.img) is not np.ndarray:
+            return
+
+        if self.jobs.busy:
+            if STAGES.index(stage) > STAGES.index(self.job_stage):
+                # Running job's inputs are still valid, let it finish then redo the rest
+                if self.rerun_stage is None or STAGES.index(stage) < STAGES.index(self.rerun_stage):
+                    self.rerun_stage = stage
+                return
+            # Running job is stale, cancel it and start over
+            stage = STAGES[min(STAGES.index(stage), STAGES.index(self.job_stage))]
+        self.rerun_stage = None
+
+        # Stages can only start from valid inputs
+        thresh_on = self.thresh.enable.get() == 1
+        if stage == 'threshold' and (self.thresh.dist_img.size == 0 or self.classes.active()):
+            stage = 'distance'
+        if stage == 'display':
+            self.jobs.cancel()
+            self.job_stage = None
+            self.redraw()
+            return
+
+        # Read widgets here, the worker thread must not touch Tk
+        params = dict(
+            source=self.open.img,
+            img=self.img,
+            dist_img=self.thresh.dist_img,
+            size=int(self.median.var.get()) if self.median.enable.get() == 1 else 0,
+            color=self.color.get(),
+            mode=self.thresh.mode.get(),
+            weights=self.thresh.weights,
+            thresh_on=thresh_on,
+            cutoff=self.thresh.var.get(),
+            classes=self.classes.active()
+        )
+        self.job_stage = stage
+        self.jobs.submit(lambda job: self.run_stages(job, stage, **params),
+                         on_done=self.apply_stages, on_error=self.job_failed)
+
+    def preview(self, stage: str = 'median'):
+        """Run the pipeline from stage on the display resolution image and show it right away.
+        refresh() replaces it with the full resolution result once that is done."""
+        if type(self.open.img) is not np.ndarray:
+            return
+
+        # Zoomed in on a large scan the display level can be many MP, a coarser level keeps the Tk thread free.
+        # Levels are only taken once built (drawing builds them), never built here
+        built = self.canvas.pyramid_for(self.open.img).built(self.canvas.scale, PREVIEW_PIXELS)
+        if built is None or built[0] == 0:
+            # Image is shown at full size, a preview would not be any faster
+            return
+        level, source = built
+
+        with trace.span('preview', log=False, stage=stage, level=level):
+            self._preview(stage, level, source)
+
+    def _preview(self, stage: str, level: int, source: np.array):
+        if source is not self.preview_source:
+            stage = 'median'
+        if stage == 'threshold' and self.preview_dist.size == 0:
+            stage = 'distance'
+
+        if stage == 'median':
+            # Median size in preview pixels, sizes that shrink to 1 are skipped
+            size = int(self.median.var.get()) if self.median.enable.get() == 1 else 0
+            size = max(1, round(size / 2 ** level)) | 1
+            self.preview_source = source
+            self.preview_img = self.median.filtered(source, size) if size > 1 else source
+            self.preview_dist = np.empty(0)
+
+        thresh_on = self.thresh.enable.get() == 1
+        colors = self.classes.active()
+        if colors:
+            # Classification is cheap on the preview, no need to keep intermediate results
+            cutoff = round(self.thresh.var.get(), 2) if thresh_on else 0.0
+            label_img, counts = classify.classify(self.preview_img, colors, cutoff, self.thresh.mode.get(),
+                                                  self.thresh.weights)
+            self.canvas.update_img(classify.class_colors(colors, label_img), level)
+            return
+
+        if not thresh_on:
+            self.canvas.update_img(self.preview_img, level)
+            return
+
+        if stage in ('median', 'distance'):
+            mode = self.thresh.mode.get()
+            self.preview_dist = pipeline.distance(self.preview_img, self.color.get(), mode=mode,
+                                                  weights=self.thresh.weights,
+                                                  converted=self.thresh.converted(self.preview_img, mode))
+        cutoff = round(self.thresh.var.get(), 2)
+        thresh_img = pipeline.threshold(self.preview_dist, cutoff)
+        if stage != 'threshold' or self.thresh.hist.size == 0:
+            # Full resolution histogram is stale, show the preview estimate until it is replaced
+            self.percent.label[1].config(text='~' + str(round(pipeline.percent(thresh_img), 2)) + ' %')
+        self.canvas.update_img(thresh_img, level)
+
+    def run_stages(self, job: Job, stage: str, source: np.array, img: np.array, dist_img: np.array,
+                   size: int, color: list, mode: str, weights: tuple, thresh_on: bool, cutoff: float,
+                   classes: list) -> dict:
+        """Compute pipeline from stage (runs on worker thread)"""
+        with trace.span('pipeline', stage=stage):
+            result = {}
+            if stage == 'median':
+                img = self.median.process(job, source, size) if size else source
+                result['img'] = img
+            if classes:
+                # Classification replaces the single color distance and threshold
+                class_img, result['counts'] = self.classes.process(
+                    job, img, classes, cutoff if thresh_on else 0.0, mode, weights)
+                result['class_img'] = readonly(class_img)
+                result['dist_img'] = np.empty(0)
+                result['hist'] = np.empty(0)
+                result['levels'] = None
+                return result
+            if not thresh_on:
+                if stage != 'threshold':
+                    # distance image no longer matches, rebuild it when threshold is turned on
+                    result['dist_img'] = np.empty(0)
+                    result['hist'] = np.empty(0)
+                    result['levels'] = None
+                return result
+            if stage in ('median', 'distance'):
+                dist_img, result['hist'] = self.thresh.make_distance_img(job, img, color, mode, weights)
+                # Shared with the caches and the canvas, never written after this
+                result['dist_img'] = readonly(dist_img)
+            result['thresh_img'] = readonly(self.thresh.process(job, dist_img, cutoff))
+            result['cutoff'] = cutoff
+            if stage in ('median', 'distance'):
+                # Only needed once the slider moves, so the mask is not held up by it
+                result['levels'] = self.thresh.make_level_index(job, dist_img)
+            return result
+
+    def apply_stages(self, result: dict):
+        """Store results of a finished job and redraw (runs on Tk thread)"""
+        if 'img' in result:
+            self.img = result['img']
+        if 'dist_img' in result:
+            self.thresh.dist_img = result['dist_img']
+            self.thresh.hist = result['hist']
+            self.thresh.levels = result['levels']
+            self.thresh.thresh_img = np.empty(0)
+        if 'thresh_img' in result:
+            self.thresh.thresh_img = result['thresh_img']
+            self.thresh.cutoff = result['cutoff']
+        if 'dist_img' in result or 'thresh_img' in result:
+            # Grains were measured on the mask that was just replaced
+            self.grains.reset()
+        if 'class_img' in result:
+            self.classes.class_img = result['class_img']
+            self.classes.update_table(result['counts'])
+        if 'dist_img' in result:
+            # Region percents are read from histograms of the new distance image
+            self.regions.refresh()
+        if verbose or debug:
+            lines = self.store.report()
+            print('Memory:\t\t', lines[0])
+            for line in lines[1:]:
+                print('\t\t', line)
+
+        self.job_stage = None
+        if self.rerun_stage is not None:
+            # skip redraw, the rerun will redraw with current settings
+            self.refresh(self.rerun_stage)
+            return
+        self.redraw()
+
+    def job_failed(self, error: BaseException):
+        self.job_stage = None
+        self.rerun_stage = None
+
+    def redraw(self):
+        """Show classes or threshold result if enabled, current image otherwise"""
+        if self.classes.active() and self.classes.class_img is not None:
+            self.canvas.update_img(self.classes.class_img)
+        elif self.thresh.enable.get() == 1 and self.thresh.thresh_img.size > 0:
+            percent = self.thresh.update_percent(self.thresh.cutoff)
+            if verbose or debug:
+                print('\t\t', 'Percent =', percent)
+            self.canvas.update_img(self.thresh.thresh_img)
         else:
-            print('\t\t', 'Done!')
-            self.progress.label.config(text="Done")
-            self.median.set(None, tk.NORMAL)
-            self.thresh.set(None, tk.NORMAL)
-            self.overlay.set(None, tk.NORMAL)
-            self.color.set(tk.NORMAL, tk.NORMAL)
-        self.master.update_idletasks()
+            self.canvas.update_img(self.img)
 
 
-def main(verbose_flag: bool = True, debug_flag: bool = False):
+def main(verbose_flag: bool = True, debug_flag: bool = False, cache_bytes: int = DEFAULT_BYTES,
+         memory_bytes: int = DEFAULT_BUDGET, trace_file: Optional[str] = None,
+         disk_dir: str = DEFAULT_DIR, disk_bytes: int = DEFAULT_DISK_BYTES, verify: bool = False,
+         weights: Optional[tuple] = None):
     # TK init (GUI Start)
     global verbose, debug
     verbose = verbose_flag
     debug = debug_flag
+    trace.TRACER.verbose = verbose_flag
+    trace.TRACER.debug = debug_flag
     root = tk.Tk()
-    application = ColorPicker(master=root)
+    disk = DiskCache(disk_dir, disk_bytes, verify=verify, verbose=verbose_flag, debug=debug_flag)
+    application = ColorPicker(master=root, cache_bytes=cache_bytes, memory_bytes=memory_bytes, disk=disk,
+                              weights=weights)
     application.mainloop()
+    application.jobs.shutdown()
+    application.median.shutdown()
+    application.thresh.shutdown()
+    application.stack.shutdown()
+    application.grains.shutdown()
+    application.regions.shutdown()
+    if application.open.stack is not None:
+        application.open.stack.shutdown()
+    if verbose and disk.enabled:
+        print('Disk Cache:\t', disk.report())
+    if trace_file:
+        trace.TRACER.export(trace_file)
+        if verbose:
+            print('Trace:\t\t', 'Wrote', trace_file)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Geochemist's Color Picker")
+    parser.add_argument('--batch', metavar='DIR',
+                        help='process every image in DIR without the GUI')
+    parser.add_argument('--color', metavar='R,G,B', type=batch.parse_color, default=(255, 255, 255),
+                        help='reference color for the distance image (default 255,255,255)')
+    parser.add_argument('--threshold', metavar='T', type=float, default=0.0,
+                        help='threshold cutoff between 0 and 1, same as the GUI slider (default 0)')
+    parser.add_argument('--median', metavar='M', type=int, default=0,
+                        help='median filter size, 0 to disable (default 0)')
+    parser.add_argument('--mode', choices=MODES, default=MODES[0],
+                        help='distance mode (default %(default)s)')
+    parser.add_argument('--weights', metavar='R,G,B', type=batch.parse_weights,
+                        help='channel weights for the Weighted RGB mode, also editable in the GUI (default 1,1,1)')
+    parser.add_argument('--output', metavar='CSV',
+                        help='CSV file for batch results (default DIR/percent.csv)')
+    parser.add_argument('--workers', metavar='N', type=int,
+                        help='number of worker processes (default all cores)')
+    parser.add_argument('--tile', metavar='N', type=int,
+                        help='batch: process each image in N x N tiles to bound memory, '
+                             '.npy images are memory-mapped')
+    parser.add_argument('--mask-dir', metavar='DIR',
+                        help='batch: write each threshold mask to DIR as a memory-mappable .npy (needs --tile)')
+    parser.add_argument('--cache-mb', metavar='MB', type=int, default=DEFAULT_BYTES >> 20,
+                        help='memory cap for each cache of intermediate results (default %(default)s)')
+    parser.add_argument('--memory-mb', metavar='MB', type=int, default=DEFAULT_BUDGET >> 20,
+                        help='total memory budget, cached intermediates are evicted to stay under it '
+                             '(default %(default)s)')
+    parser.add_argument('--disk-cache', metavar='DIR', default=DEFAULT_DIR,
+                        help='directory where median, distance and display results are kept between sessions, '
+                             'found again by file content and settings (default %(default)s)')
+    parser.add_argument('--disk-cache-mb', metavar='MB', type=int, default=DEFAULT_DISK_BYTES >> 20,
+                        help='disk space for kept results, least recently used are deleted first, '
+                             '0 disables the disk cache (default %(default)s)')
+    parser.add_argument('--verify-cache', action='store_true',
+                        help='check the checksum of every kept result when it is loaded')
+    parser.add_argument('--trace', metavar='JSON',
+                        help='write the timing of every stage to JSON on exit, open it in chrome://tracing or '
+                             'Perfetto (F12 shows the same spans while running)')
+    parser.add_argument('--quiet', action='store_true', help='disable verbose output')
+    parser.add_argument('--debug', action='store_true', help='enable debug output')
+    args = parser.parse_args(argv)
+
+    if args.median < 0 or (args.median and args.median % 2 == 0):
+        parser.error('--median must be 0 or a positive odd number')
+    if args.tile is not None and args.tile < max(args.median, 1):
+        parser.error('--tile must be at least the median size')
+    if args.mask_dir and not args.tile:
+        parser.error('--mask-dir needs --tile')
+    return args
 
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.batch:
+        batch.run_batch(args.batch, args.color, args.threshold, args.median,
+                        output=args.output, workers=args.workers, tile=args.tile,
+                        mask_dir=args.mask_dir, mode=args.mode, weights=args.weights,
+                        cache_dir=args.disk_cache, cache_bytes=args.disk_cache_mb << 20,
+                        verify=args.verify_cache, verbose=not args.quiet)
+    else:
+        main(not args.quiet, args.debug, args.cache_mb << 20, args.memory_mb << 20, args.trace,
+             args.disk_cache, args.disk_cache_mb << 20, args.verify_cache, args.weights)
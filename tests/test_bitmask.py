@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+# # Imports # #
+import numpy as np
+
+from GcCP.bitmask import PackedMask
+
+
+def test_packed_mask_matches_bool_mask():
+    rng = np.random.default_rng(0)
+    # Widths that are and are not whole bytes
+    for shape in ((13, 16), (7, 21), (1, 1)):
+        img = rng.integers(0, 256, shape, dtype=np.uint8)
+        mask = img >= 100
+        packed = PackedMask.at_least(img, 100)
+        assert np.array_equal(packed.unpack(), mask)
+        assert np.array_equal(PackedMask.pack(mask).bits, packed.bits)
+        assert packed.count() == mask.sum()
+        assert np.isclose(packed.percent(), mask.mean() * 100)
+        assert (~packed).count() == (~mask).sum()
+
+
+def test_packed_mask_blocks_and_pixels():
+    rng = np.random.default_rng(1)
+    mask = rng.random((30, 45)) < 0.3
+    packed = PackedMask.pack(mask)
+    assert np.array_equal(packed.unpack(3, 17, 5, 38), mask[3:17, 5:38])
+    rows = rng.integers(0, 30, 100)
+    cols = rng.integers(0, 45, 100)
+    assert np.array_equal(packed.get(rows, cols), mask[rows, cols])
+
+    # Neighbouring pixels share bytes
+    positions = np.arange(40, 60)
+    packed.put(positions, True)
+    mask.reshape(-1)[positions] = True
+    assert np.array_equal(packed.unpack(), mask)
+    packed.put(positions[::3], False)
+    mask.reshape(-1)[positions[::3]] = False
+    assert np.array_equal(packed.unpack(), mask)
+
+
+def test_packed_mask_operators():
+    rng = np.random.default_rng(2)
+    a = rng.random((9, 19)) < 0.5
+    b = rng.random((9, 19)) < 0.5
+    pa, pb = PackedMask.pack(a), PackedMask.pack(b)
+    assert np.array_equal((pa & pb).unpack(), a & b)
+    assert np.array_equal((pa | pb).unpack(), a | b)
+    assert np.array_equal((pa ^ pb).unpack(), a ^ b)
@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+
+# # Imports # #
+import numpy as np
+
+from GcCP import pipeline, classify
+
+BLACK, GRAY, WHITE, RED, GREEN = (0, 0, 0), (128, 128, 128), (255, 255, 255), (255, 0, 0), (0, 255, 0)
+
+
+def test_hue_grays_match_nothing():
+    img = np.array([[BLACK, GRAY, WHITE, RED, GREEN]], dtype=np.uint8)
+
+    # Grays have no hue, so they are not a perfect match for red
+    assert pipeline.distance(img, RED, mode='Hue').tolist() == [[0, 0, 0, 255, 85]]
+    # and a gray reference matches no pixel, not even grays
+    assert pipeline.distance(img, GRAY, mode='Hue').tolist() == [[0, 0, 0, 0, 0]]
+
+
+def test_hue_classes_leave_grays_unclassified():
+    img = np.array([[BLACK, GRAY, WHITE, RED, GREEN]], dtype=np.uint8)
+
+    label_img, counts = classify.classify(img, [RED, GREEN], 0.5, mode='Hue')
+    assert label_img.tolist() == [[2, 2, 2, 0, 1]]
+    assert counts.tolist() == [1, 1, 3]
+
+    label_img, counts = classify.classify(img, [GRAY, RED], 0.5, mode='Hue')
+    assert label_img.tolist() == [[2, 2, 2, 1, 2]]
@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+
+# # Imports # #
+import numpy as np
+from scipy.ndimage import median_filter
+
+from GcCP.histogram_median import median_uint8
+
+
+def _expected(img, size):
+    """scipy median over size x size pixels, channels are filtered separately"""
+    return median_filter(img, size=(size, size) + (1,) * (img.ndim - 2), mode='reflect')
+
+
+def test_median_matches_scipy():
+    rng = np.random.default_rng(0)
+    for size in range(3, 16):
+        for shape in ((37, 41, 3), (16, 16), (40, 9, 4)):
+            img = rng.integers(0, 256, shape, dtype=np.uint8)
+            assert np.array_equal(median_uint8(img, size), _expected(img, size)), (size, shape)
+
+
+def test_median_of_images_smaller_than_the_kernel():
+    rng = np.random.default_rng(1)
+    for size in (3, 7, 15):
+        for shape in ((1, 1, 3), (2, 5, 3), (5, 4), (3, 20, 3), (20, 2)):
+            img = rng.integers(0, 256, shape, dtype=np.uint8)
+            assert np.array_equal(median_uint8(img, size), _expected(img, size)), (size, shape)
+
+
+def test_median_of_few_levels():
+    # Long runs of equal values, like the flat phases of a scan
+    rng = np.random.default_rng(2)
+    img = rng.choice(np.array([0, 1, 254, 255], dtype=np.uint8), size=(50, 60, 3))
+    for size in (3, 5, 9):
+        assert np.array_equal(median_uint8(img, size), _expected(img, size)), size
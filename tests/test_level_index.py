@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+# # Imports # #
+import numpy as np
+
+from GcCP.bitmask import PackedMask
+from GcCP.level_index import LevelIndex
+
+
+def test_level_index_groups_pixels_by_level():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (40, 50), dtype=np.uint8)
+    index = LevelIndex(img)
+    flat = img.ravel()
+    for lo, hi in ((0, 256), (10, 11), (100, 180), (255, 256)):
+        positions = index.between(lo, hi)
+        assert index.count(lo, hi) == positions.size
+        # Exactly the pixels in [lo, hi), grouped by level
+        assert np.array_equal(np.sort(positions), np.flatnonzero((flat >= lo) & (flat < hi)))
+        assert np.all(np.diff(flat[positions].astype(int)) >= 0)
+    # Ascending positions within a level
+    for level in (0, 77, 255):
+        assert np.array_equal(index.between(level, level + 1), np.flatnonzero(flat == level))
+
+
+def test_level_index_updates_masks_in_place():
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, (33, 27), dtype=np.uint8)
+    index = LevelIndex(img)
+    mask = img >= 128
+    packed = PackedMask.at_least(img, 128)
+    level = 128
+    for new_level in (200, 40, 40, 0, 256, 129):
+        changed = index.update(mask, level, new_level)
+        index.update(packed, level, new_level)
+        assert changed.size == abs(int((img >= level).sum()) - int((img >= new_level).sum()))
+        assert np.array_equal(mask, img >= new_level)
+        assert np.array_equal(packed.unpack(), img >= new_level)
+        level = new_level
+
+
+def test_level_index_across_chunks(monkeypatch):
+    # Runs of each chunk are appended to their level, positions must stay ascending
+    monkeypatch.setattr('GcCP.level_index.CHUNK_PIXELS', 97)
+    rng = np.random.default_rng(2)
+    img = rng.integers(0, 8, (30, 31), dtype=np.uint8)
+    index = LevelIndex(img)
+    flat = img.ravel()
+    for level in range(8):
+        assert np.array_equal(index.between(level, level + 1), np.flatnonzero(flat == level))
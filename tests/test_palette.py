@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+
+# # Imports # #
+import numpy as np
+
+from GcCP.palette import Palette
+from GcCP.distance import rgb_distance
+from GcCP.color_space import mode_distance
+
+
+def _scan(seed, colors=40, shape=(60, 70)):
+    """Image with few distinct colors, like an XRF phase map"""
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (colors, 3), dtype=np.uint8)
+    return palette[rng.integers(0, colors, shape)]
+
+
+def test_palette_distance_matches_rgb_distance():
+    img = _scan(0)
+    palette = Palette.build(img)
+    assert len(palette) <= 40
+    for color in ((0, 0, 0), (255, 255, 255), (12, 200, 99), tuple(img[5, 7])):
+        assert np.array_equal(palette.distance(color), rgb_distance(img, color)), color
+
+
+def test_palette_distance_matches_every_mode():
+    img = _scan(1)
+    palette = Palette.build(img)
+    for mode, weights in (('Weighted RGB', (3.0, 1.0, 0.5)), ('Lab', None), ('Hue', None)):
+        for color in ((255, 0, 0), (40, 90, 160)):
+            assert np.array_equal(palette.distance(color, mode=mode, weights=weights),
+                                  mode_distance(img, color, mode, weights)), (mode, color)
+
+
+def test_palette_of_too_many_colors():
+    img = _scan(2, colors=200)
+    assert Palette.build(img, max_colors=100) is None
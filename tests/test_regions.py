@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+# # Imports # #
+import numpy as np
+
+from GcCP import pipeline
+from GcCP.regions import Region, rasterize, region_stats
+
+
+def _mask(labels, label, shape):
+    """Full size bool mask of one region from its label layers"""
+    mask = np.zeros(shape, dtype=bool)
+    for layer in labels.layers:
+        labels.crop(mask)[...] |= layer == label
+    return mask
+
+
+def test_nested_regions_keep_their_pixels():
+    rng = np.random.default_rng(0)
+    shape = (200, 200)
+    dist_img = rng.integers(0, 256, shape, dtype=np.uint8)
+    img = rng.integers(0, 256, shape + (3,), dtype=np.uint8)
+    zone = Region('Rectangle', [(20, 20), (120, 120)])
+    grain = Region('Ellipse', [(40, 40), (80, 90)])
+    inner = Region('Polygon', [(50, 55), (70, 55), (60, 75)])
+    apart = Region('Rectangle', [(150, 150), (180, 170)])
+    labels = rasterize([zone, grain, inner, apart], shape)
+
+    # The zone is 100 x 100 pixels no matter what is drawn inside it
+    stats = region_stats(labels, dist_img, img)
+    assert stats.pixels[0] == 100 * 100
+    assert len(labels.layers) == 3
+
+    level = pipeline.threshold_level(0.5)
+    percents = stats.percent(0.5)
+    means = stats.mean()
+    for i in range(4):
+        mask = _mask(labels, i + 1, shape)
+        assert stats.pixels[i] == mask.sum() > 0
+        assert np.isclose(percents[i], (dist_img[mask] >= level).mean() * 100)
+        assert np.allclose(means[i], img[mask].mean(axis=0))
+    # Regions inside the zone are counted in it too
+    assert (_mask(labels, 2, shape) <= _mask(labels, 1, shape)).all()
+
+
+def test_disjoint_regions_share_one_layer():
+    labels = rasterize([Region('Rectangle', [(0, 0), (10, 10)]), Region('Ellipse', [(20, 20), (30, 40)])], (50, 50))
+    assert len(labels.layers) == 1
+    assert region_stats(labels).pixels[0] == 100